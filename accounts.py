@@ -0,0 +1,69 @@
+import time
+from flask import g, session
+from sqlalchemy import func
+from sqlalchemy.orm import make_transient_to_detached
+from cache import TTLCache
+from database import db, User, Product, CartItem
+
+# Per-request identity and cart badge without touching the cart rows.
+#
+# The user loader keeps each user's column values in a short-lived cache and
+# rebuilds the instance from them, attaching it to the session without a
+# SELECT. Writes to a user go through invalidate_user().
+#
+# The navbar badge reads a small {count, subtotal} summary stored in the
+# signed session cookie. The cart routes refresh it after every change;
+# otherwise it is recomputed with one aggregate query at most once per
+# CART_SUMMARY_MAX_AGE, which bounds how stale it gets when the same account
+# changes its cart from another browser.
+
+USER_CACHE_TTL = 60
+CART_SUMMARY_MAX_AGE = 300
+CART_SESSION_KEY = 'cart_summary'
+
+user_cache = TTLCache(maxsize=4096, ttl=USER_CACHE_TTL)
+
+def _columns(user):
+    return {attr.key: getattr(user, attr.key) for attr in db.inspect(user).mapper.column_attrs}
+
+def load_user(user_id):
+    columns = user_cache.get(user_id)
+    if columns is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            user_cache.set(user_id, _columns(user))
+        return user
+    user = User(**columns)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def invalidate_user(user_id):
+    user_cache.delete(user_id)
+
+def _query_cart_summary(user_id):
+    count, subtotal = db.session.query(
+        func.count(CartItem.id),
+        func.coalesce(func.sum(CartItem.quantity * Product.price), 0)
+    ).join(Product, CartItem.product_id == Product.id).filter(
+        CartItem.user_id == user_id
+    ).one()
+    return {'count': count, 'subtotal': round(float(subtotal), 2)}
+
+def refresh_cart_summary(user_id):
+    summary = _query_cart_summary(user_id)
+    session[CART_SESSION_KEY] = dict(summary, user_id=user_id, at=int(time.time()))
+    g.cart_summary = summary
+    return summary
+
+def cart_summary(user_id):
+    if 'cart_summary' in g:
+        return g.cart_summary
+    stored = session.get(CART_SESSION_KEY)
+    if stored and stored.get('user_id') == user_id and time.time() - stored['at'] < CART_SUMMARY_MAX_AGE:
+        g.cart_summary = {'count': stored['count'], 'subtotal': stored['subtotal']}
+        return g.cart_summary
+    return refresh_cart_summary(user_id)
+
+def clear_cart_summary():
+    session.pop(CART_SESSION_KEY, None)
+    g.pop('cart_summary', None)
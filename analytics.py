@@ -0,0 +1,177 @@
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+import numpy as np
+from sqlalchemy import func, select, union_all
+from cache import TTLCache
+from database import (db, User, Product, Category, Order, OrderItem, Booking, ArchivedOrder, ArchivedOrderItem,
+                      ArchivedBooking)
+
+# Sales reports for the admin area. The orders, order lines and bookings of
+# a window are read as plain columns (Core rows in FETCH_SIZE chunks off the
+# created_at index, straight into numpy arrays) and every figure is a
+# bincount/unique over those arrays; nothing is loaded as an ORM object and
+# no Python loop runs per order line. Line totals are first summed per
+# product, so the brand/style/category breakdowns only touch the products
+# actually sold. Orders and bookings moved to the archive tables by
+# maintenance.py are read alongside the live ones (UNION ALL, each arm on
+# its own created_at index).
+#
+# Reports are cached per window. A window that ends today is recomputed
+# after LIVE_TTL seconds; one that lies wholly in the past cannot change
+# (short of an admin edit) and is kept for CLOSED_TTL.
+
+FETCH_SIZE = 50000
+WINDOWS = (7, 30, 90, 365)
+DEFAULT_WINDOW = 30
+MAX_WINDOW = 3 * 366  # days in a custom range
+TOP = 10
+LIVE_TTL = 300
+CLOSED_TTL = 6 * 3600
+CONVERTED = ('confirmed', 'collected')
+LOST = ('expired', 'cancelled')
+REPEAT_BUCKETS = ('1', '2', '3', '4', '5+')
+ORDER_TABLES = ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem))
+BOOKING_TABLES = (Booking, ArchivedBooking)
+
+_EPOCH_JULIAN = 2440587.5  # julianday('1970-01-01')
+_EPOCH = date(1970, 1, 1)
+
+reports = TTLCache(maxsize=32, ttl=LIVE_TTL)
+
+def window(days=None, start=None, end=None, today=None):
+    # Inclusive [start, end] dates for ?days= or ?start=&end=.
+    today = today or datetime.utcnow().date()
+    if start and end:
+        start, end = min(start, end), min(max(start, end), today)
+        start = min(start, end)  # a range wholly in the future becomes today
+        return max(start, end - timedelta(days=MAX_WINDOW - 1)), end
+    days = days if days in WINDOWS else DEFAULT_WINDOW
+    return today - timedelta(days=days - 1), today
+
+def _columns(statement, count):
+    # Rows of `count` numeric columns as one float array per column.
+    chunks = []
+    result = db.session.connection().execute(statement.execution_options(stream_results=True))
+    for chunk in result.partitions(FETCH_SIZE):
+        chunks.append(np.fromiter(chain.from_iterable(chunk), dtype=np.float64,
+                                  count=count * len(chunk)).reshape(-1, count))
+    table = np.concatenate(chunks) if chunks else np.empty((0, count))
+    return [table[:, column] for column in range(count)]
+
+def _in_window(column, start, end):
+    return (column >= datetime.combine(start, time.min)) & (column < datetime.combine(end + timedelta(days=1), time.min))
+
+def _group(codes, labels, revenue, units, limit=None):
+    revenue_by = np.bincount(codes, weights=revenue, minlength=len(labels))
+    units_by = np.bincount(codes, weights=units, minlength=len(labels))
+    order = np.argsort(-revenue_by, kind='stable')
+    if limit:
+        order = order[:limit]
+    return [{'label': labels[index], 'revenue': float(revenue_by[index]), 'units': int(units_by[index])}
+            for index in order if units_by[index]]
+
+def _factorize(values):
+    labels = {}
+    codes = np.fromiter((labels.setdefault(value or 'Unspecified', len(labels)) for value in values),
+                        dtype=np.int64, count=len(values))
+    return codes, list(labels)
+
+def _product_breakdowns(line_products, line_quantity, line_price):
+    products, inverse = np.unique(line_products.astype(np.int64), return_inverse=True)
+    revenue = np.bincount(inverse, weights=line_quantity * line_price, minlength=len(products))
+    units = np.bincount(inverse, weights=line_quantity, minlength=len(products))
+
+    rows = {}
+    ids = products.tolist()
+    for offset in range(0, len(ids), 900):
+        rows.update((row.id, row) for row in db.session.query(
+            Product.id, Product.name, Product.brand, Product.style, Product.category_id
+        ).filter(Product.id.in_(ids[offset:offset + 900])))
+    categories = dict(db.session.query(Category.id, Category.name).all())
+    known = [rows.get(product_id) for product_id in ids]
+    breakdowns = {}
+    for key, value in (('brand', lambda row: row.brand), ('style', lambda row: row.style),
+                       ('category', lambda row: categories.get(row.category_id))):
+        codes, labels = _factorize([value(row) if row else None for row in known])
+        breakdowns[key] = _group(codes, labels, revenue, units)
+    names = [row.name if row else f'Deleted product #{product_id}' for product_id, row in zip(ids, known)]
+    breakdowns['products'] = _group(np.arange(len(ids)), names, revenue, units, limit=TOP)
+    return breakdowns
+
+def _customers(order_users, order_totals):
+    users, inverse, counts = np.unique(order_users.astype(np.int64), return_inverse=True, return_counts=True)
+    spend = np.bincount(inverse, weights=order_totals, minlength=len(users))
+    histogram = np.bincount(np.minimum(counts, len(REPEAT_BUCKETS)), minlength=len(REPEAT_BUCKETS) + 1)[1:]
+    top = np.argsort(-spend, kind='stable')[:TOP]
+    top_ids = users[top].tolist()
+    names = {row.id: f'{row.first_name} {row.last_name}' for row in db.session.query(
+        User.id, User.first_name, User.last_name).filter(User.id.in_(top_ids))}
+    return users, {
+        'customers': len(users),
+        'repeat_customers': int((counts > 1).sum()),
+        'orders_per_customer': [{'label': label, 'customers': int(value)}
+                                for label, value in zip(REPEAT_BUCKETS, histogram)],
+        'top_customers': [{'user_id': user_id, 'name': names.get(user_id, f'User #{user_id}'),
+                           'orders': int(counts[index]), 'revenue': float(spend[index])}
+                          for user_id, index in zip(top_ids, top.tolist())],
+    }
+
+def _bookings(start, end, ordering_users):
+    booked = union_all(*(select(model.user_id, model.status).where(_in_window(model.created_at, start, end))
+                         for model in BOOKING_TABLES)).subquery()
+    statuses = dict(db.session.query(booked.c.status, func.count()).group_by(booked.c.status).all())
+    booking_users, = _columns(select(booked.c.user_id), 1)
+    bookers = np.unique(booking_users.astype(np.int64))
+    converted = sum(statuses.get(status, 0) for status in CONVERTED)
+    decided = converted + sum(statuses.get(status, 0) for status in LOST)
+    return {
+        'bookings': sum(statuses.values()),
+        'statuses': sorted(statuses.items()),
+        'conversion': converted / decided if decided else None,
+        'bookers': len(bookers),
+        'bookers_who_ordered': int(np.isin(bookers, ordering_users, assume_unique=True).sum()),
+    }
+
+def build_report(start, end):
+    def placed(order):
+        return _in_window(order.created_at, start, end) & (order.status != 'cancelled')
+    order_ids, order_users, order_julian, order_totals = _columns(union_all(*(
+        select(order.id, order.user_id, func.julianday(order.created_at), order.total_amount).where(placed(order))
+        for order, _ in ORDER_TABLES)), 4)
+    line_products, line_quantity, line_price = _columns(union_all(*(
+        select(item.product_id, item.quantity, item.price).join(order, item.order_id == order.id).where(placed(order))
+        for order, item in ORDER_TABLES)), 3)
+    cancelled = sum(db.session.query(func.count(order.id)).filter(
+        _in_window(order.created_at, start, end), order.status == 'cancelled').scalar()
+        for order, _ in ORDER_TABLES)
+
+    days = (end - start).days + 1
+    day_index = np.floor(order_julian - _EPOCH_JULIAN).astype(np.int64) - (start - _EPOCH).days
+    day_index = np.clip(day_index, 0, days - 1)
+    revenue_by_day = np.bincount(day_index, weights=order_totals, minlength=days)
+    orders_by_day = np.bincount(day_index, minlength=days)
+
+    revenue = float(order_totals.sum())
+    users, customers = _customers(order_users, order_totals)
+    report = {
+        'start': start,
+        'end': end,
+        'generated_at': datetime.utcnow(),
+        'orders': len(order_ids),
+        'cancelled_orders': cancelled,
+        'revenue': revenue,
+        'units': int(line_quantity.sum()),
+        'average_order_value': revenue / len(order_ids) if len(order_ids) else 0.0,
+        'order_lines': len(line_products),
+        'daily': [{'day': start + timedelta(days=offset), 'orders': int(orders_by_day[offset]),
+                   'revenue': float(revenue_by_day[offset])} for offset in range(days)],
+        'booking': _bookings(start, end, users),
+    }
+    report.update(customers)
+    report.update(_product_breakdowns(line_products, line_quantity, line_price))
+    return report
+
+def sales_report(start, end, today=None):
+    today = today or datetime.utcnow().date()
+    return reports.get_or_set((start, end), lambda: build_report(start, end),
+                              ttl=LIVE_TTL if end >= today else CLOSED_TTL)
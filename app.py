@@ -1,37 +1,134 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from datetime import datetime
-import random
-import string
+import io
 import os
+import time
+import click
 from werkzeug.utils import secure_filename
-from database import db, User, Product, Category, CartItem, Order, OrderItem, Booking, BookingItem
+from werkzeug.middleware.proxy_fix import ProxyFix
+from email_validator import validate_email, EmailNotValidError
+from sqlalchemy import or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import (db, User, Product, Category, CartItem, Order, OrderItem, Booking, BookingItem, NewsletterSubscriber,
+                      ArchivedOrder, ArchivedBooking)
+from queries import with_view, order_counts_by_user
+from pagination import (paginate, paginate_ranked, PRODUCT_SORTS, USER_SORTS, ORDER_SORTS, BOOKING_SORTS,
+                        ARCHIVED_ORDER_SORTS, ARCHIVED_BOOKING_SORTS)
+import catalog
+import search
+import facets
+import stock
+import order_pipeline
+import ids
+import stats
+import images
+import accounts
+import sqlite_engine
+import migrations
+import query_plans
+import profiling
+import jobs
+import tasks
+import catalog_io
+import http_cache
+import cart_ops
+import passwords
+import ratelimit
+import recommendations
+import analytics
+import exports
+import maintenance
+import fragments
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sunglass_store.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///sunglass_store.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Image upload configuration
 app.config['UPLOAD_FOLDER'] = 'static/uploads/products'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+# Directory that `image` columns in catalog imports are resolved against
+app.config['CATALOG_IMAGE_DIR'] = os.environ.get('CATALOG_IMAGE_DIR')
+
+# Profiling: requests slower than this go to instance/slow_requests.log;
+# cost headers are sent in debug mode or with PROFILE_HEADERS=1
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', profiling.SLOW_REQUEST_MS))
+app.config['PROFILE_HEADERS'] = os.environ.get('PROFILE_HEADERS') == '1'
+app.config['PROFILE_MEMORY'] = os.environ.get('PROFILE_MEMORY') == '1'
+
+# Background jobs: worker threads started in this process (0 when a
+# separate `flask run-jobs` process does the work)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', jobs.DEFAULT_WORKERS))
+
+# Nightly maintenance (see maintenance.py): hour of day in UTC, or
+# MAINTENANCE_HOUR=off to leave it to cron and `flask maintenance`
+app.config['MAINTENANCE_HOUR'] = (None if os.environ.get('MAINTENANCE_HOUR') == 'off'
+                                  else int(os.environ.get('MAINTENANCE_HOUR', maintenance.MAINTENANCE_HOUR)))
+app.config['CART_EXPIRY_DAYS'] = int(os.environ.get('CART_EXPIRY_DAYS', maintenance.CART_EXPIRY_DAYS))
+app.config['ARCHIVE_AFTER_MONTHS'] = int(os.environ.get('ARCHIVE_AFTER_MONTHS', maintenance.ARCHIVE_AFTER_MONTHS))
+# Minutes between sweeps releasing expired booking reservations, or
+# BOOKING_SWEEP_MINUTES=off to leave it to `flask release-expired-bookings`
+app.config['BOOKING_SWEEP_MINUTES'] = (None if os.environ.get('BOOKING_SWEEP_MINUTES') == 'off'
+                                       else int(os.environ.get('BOOKING_SWEEP_MINUTES',
+                                                               maintenance.BOOKING_SWEEP_MINUTES)))
+
+# Product card and layout fragment cache, and the compiled-template cache
+# directory (see fragments.py); an empty TEMPLATE_CACHE_DIR turns it off
+app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', '1') == '1'
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+
+# Password hashing pool (see passwords.py) and login limits: a burst of
+# LOGIN_BURST attempts per IP refilled at LOGIN_PER_MINUTE, and at most
+# LOGIN_FAILURES failed logins per email in LOGIN_FAILURE_WINDOW seconds
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', passwords.HASH_WORKERS))
+app.config['PASSWORD_HASH_PENDING'] = int(os.environ.get('PASSWORD_HASH_PENDING', passwords.MAX_PENDING))
+app.config['PASSWORD_HASH_PROCESSES'] = os.environ.get('PASSWORD_HASH_PROCESSES') == '1'
+app.config['LOGIN_RATE_LIMIT'] = os.environ.get('LOGIN_RATE_LIMIT', '1') == '1'
+app.config['LOGIN_BURST'] = 10
+app.config['LOGIN_PER_MINUTE'] = 12
+app.config['LOGIN_FAILURES'] = 5
+app.config['LOGIN_FAILURE_WINDOW'] = 15 * 60
+# Reverse proxies in front of the app whose X-Forwarded-For/-Proto are
+# trusted. The login limiter keys on request.remote_addr, which behind a
+# proxy is the proxy itself unless this matches the deployment; 0 trusts
+# no headers, since a client could forge them.
+app.config['PROXY_HOPS'] = int(os.environ.get('PROXY_HOPS', 0))
 
 # Create upload directory if it doesn't exist
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+if app.config['PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_HOPS'], x_proto=app.config['PROXY_HOPS'])
+
+passwords.init_app(app)
+login_limiter = ratelimit.TokenBucket(app.config['LOGIN_BURST'], app.config['LOGIN_PER_MINUTE'] / 60)
+login_failures = ratelimit.SlidingWindow(app.config['LOGIN_FAILURES'], app.config['LOGIN_FAILURE_WINDOW'])
+
+sqlite_engine.configure(app)
 db.init_app(app)
+sqlite_engine.install(app, db)
+profiling.init_app(app, db)
+http_cache.init_app(app)
+fragments.init_app(app)
+
+@app.before_request
+def start_job_workers():
+    if app.config['JOB_WORKERS']:
+        jobs.start_workers(app)
+
+@app.template_global()
+def image_variants(filename):
+    return images.variants_for(app.config['UPLOAD_FOLDER'], filename)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-@app.context_processor
-def inject_current_date():
-    return {'current_date': datetime.now().strftime('%Y-%m-%d')}
-
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -39,106 +136,187 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return accounts.load_user(int(user_id))
+
+@app.template_global()
+def cart_summary():
+    return accounts.cart_summary(current_user.id)
 
 def generate_order_number():
-    return 'ORD' + ''.join(random.choices(string.digits, k=8))
+    return 'ORD' + ids.new_id()
 
 def generate_booking_number():
-    return 'BKG' + ''.join(random.choices(string.digits, k=8))
+    return 'BKG' + ids.new_id()
+
+@stock.retry_on_busy
+def place_booking(user_id, product_id, quantity, pickup_date):
+    product = db.session.get(Product, product_id)
+    
+    booking = Booking(
+        booking_number=generate_booking_number(),
+        total_amount=product.price * quantity,
+        pickup_date=pickup_date,
+        user_id=user_id
+    )
+    db.session.add(booking)
+    db.session.add(BookingItem(
+        booking=booking,
+        product_id=product_id,
+        quantity=quantity,
+        price=product.price
+    ))
+    
+    stock.reserve_stock([(product_id, quantity)])
+    stats.increment('bookings')
+    
+    db.session.commit()
+    catalog.invalidate_products([product_id])
+    return booking
 
 @app.route('/')
+@http_cache.cached_page
 def index():
-    categories = Category.query.all()
-    featured_products = Product.query.filter_by(is_active=True).limit(8).all()
+    categories = catalog.categories()
+    featured_products = catalog.featured_products()
     return render_template('index.html', 
                          categories=categories, 
                          featured_products=featured_products)
 
 @app.route('/products')
+@http_cache.cached_page
 def products():
-    category_id = request.args.get('category_id', type=int)
-    brand = request.args.get('brand')
-    style = request.args.get('style')
+    q = request.args.get('q', '').strip()
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     
+    filters = {
+        'category_id': request.args.get('category_id', type=int),
+        'brand': request.args.get('brand') or None,
+        'style': request.args.get('style') or None,
+        'color': request.args.get('color') or None,
+        'frame_material': request.args.get('frame_material') or None,
+        'lens_type': request.args.get('lens_type') or None,
+        'uv_protection': True if request.args.get('uv_protection') else None,
+        'polarization': True if request.args.get('polarization') else None,
+        'price_bucket': request.args.get('price_bucket') if request.args.get('price_bucket') in facets.BUCKET_RANGES else None,
+    }
+    
     query = Product.query.filter_by(is_active=True)
     
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-    if brand:
-        query = query.filter(Product.brand.ilike(f'%{brand}%'))
-    if style:
-        query = query.filter(Product.style.ilike(f'%{style}%'))
+    for facet, value in filters.items():
+        if value is None:
+            continue
+        if facet == 'price_bucket':
+            low, high = facets.BUCKET_RANGES[value]
+            query = query.filter(Product.price >= low)
+            if high is not None:
+                query = query.filter(Product.price < high)
+        else:
+            query = query.filter(getattr(Product, facet) == value)
     if min_price:
         query = query.filter(Product.price >= min_price)
     if max_price:
         query = query.filter(Product.price <= max_price)
     
-    products = query.all()
-    categories = Category.query.all()
-    brands = db.session.query(Product.brand).distinct().all()
-    styles = db.session.query(Product.style).distinct().all()
+    ranked_ids = search.search_product_ids(q) if q else None
+    if q and request.args.get('sort', 'relevance') == 'relevance':
+        page = paginate_ranked(query, ranked_ids, default_per_page=24)
+    elif q:
+        page = paginate(query.filter(Product.id.in_(ranked_ids)), PRODUCT_SORTS, default_per_page=24)
+    else:
+        page = paginate(query, PRODUCT_SORTS, default_per_page=24)
+    
+    facet_result = facets.facet_index.search(filters, restrict_ids=ranked_ids,
+                                             min_price=min_price or None,
+                                             max_price=max_price or None)
     
     return render_template('products.html', 
-                         products=products, 
-                         categories=categories,
-                         brands=[b[0] for b in brands],
-                         styles=[s[0] for s in styles])
+                         products=page.items, 
+                         page=page,
+                         q=q,
+                         total=facet_result.total,
+                         facet_counts=facet_result.counts,
+                         categories=catalog.categories())
 
 @app.route('/product/<int:product_id>')
+@http_cache.cached_page
 def product_detail(product_id):
-    product = Product.query.get_or_404(product_id)
-    related_products = Product.query.filter(
-        Product.category_id == product.category_id,
-        Product.id != product.id,
-        Product.is_active == True
-    ).limit(4).all()
-    
-    # Manually pass current date
-    current_date = datetime.now().strftime('%Y-%m-%d')
-    
+    product = with_view(Product.query, 'product_detail').get_or_404(product_id)
+    related_products = recommendations.related_products(product)
+
     return render_template('product_detail.html', 
                          product=product, 
-                         related_products=related_products,
-                         current_date=current_date)
+                         related_products=related_products)
 
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 @login_required
 def add_to_cart(product_id):
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        return cart_api_response({'operations': [{'op': 'add', 'product_id': product_id,
+                                                  'quantity': data.get('quantity', 1)}]})
+    
     product = Product.query.get_or_404(product_id)
-    quantity = int(request.form.get('quantity', 1))
+    try:
+        quantity = int(request.form.get('quantity', 1))
+    except ValueError:
+        quantity = 0
+    
+    if quantity < 1:
+        flash('Please choose a quantity of at least 1', 'error')
+        return redirect(url_for('product_detail', product_id=product_id))
     
     if product.stock_quantity < quantity:
         flash('Not enough stock available', 'error')
         return redirect(url_for('product_detail', product_id=product_id))
     
-    cart_item = CartItem.query.filter_by(
-        user_id=current_user.id, 
-        product_id=product_id
-    ).first()
-    
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(
+    # Insert or top up in one statement; the unique (user_id, product_id)
+    # index keeps two concurrent adds from creating duplicate rows.
+    db.session.execute(
+        sqlite_insert(CartItem).values(
             user_id=current_user.id,
             product_id=product_id,
-            quantity=quantity
+            quantity=quantity,
+            added_at=datetime.utcnow()
+        ).on_conflict_do_update(
+            index_elements=[CartItem.user_id, CartItem.product_id],
+            set_={'quantity': CartItem.quantity + quantity}
         )
-        db.session.add(cart_item)
+    )
     
     db.session.commit()
+    accounts.refresh_cart_summary(current_user.id)
     flash('Product added to cart successfully!', 'success')
     return redirect(url_for('cart'))
 
 @app.route('/cart')
 @login_required
 def cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    cart_items = with_view(CartItem.query, 'cart').filter_by(user_id=current_user.id).all()
     total = sum(item.product.price * item.quantity for item in cart_items)
-    return render_template('cart.html', cart_items=cart_items, total=total)
+    return render_template('cart.html', cart_items=cart_items, total=total, totals=cart_ops.totals(total))
+
+def cart_api_response(payload):
+    try:
+        result = cart_ops.apply(current_user.id, cart_ops.parse_operations(payload))
+    except cart_ops.CartError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    return jsonify(result), 200 if result['success'] else 409
+
+@app.route('/api/cart', methods=['GET', 'POST'])
+@login_required
+def cart_api():
+    # POST {"operations": [{"op": "add"|"set"|"remove", "product_id": 1, "quantity": 2}, ...]}
+    if request.method == 'GET':
+        lines = order_pipeline.load_cart(current_user.id)
+        subtotal = sum(line.price * line.quantity for line in lines)
+        return jsonify({
+            'lines': [{'product_id': line.product_id, 'price': line.price, 'quantity': line.quantity,
+                       'line_total': round(line.price * line.quantity, 2)} for line in lines],
+            'cart': dict(cart_ops.totals(subtotal), count=len(lines)),
+        })
+    
+    return cart_api_response(request.get_json(silent=True))
 
 @app.route('/update_cart/<int:cart_item_id>', methods=['POST'])
 @login_required
@@ -146,9 +324,18 @@ def update_cart(cart_item_id):
     cart_item = CartItem.query.get_or_404(cart_item_id)
     
     if cart_item.user_id != current_user.id:
+        if request.is_json:
+            return jsonify({'error': 'Unauthorized action'}), 403
         flash('Unauthorized action', 'error')
         return redirect(url_for('cart'))
     
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        if data.get('action') == 'remove':
+            return cart_api_response({'operations': [{'op': 'remove', 'product_id': cart_item.product_id}]})
+        return cart_api_response({'operations': [{'op': 'set', 'product_id': cart_item.product_id,
+                                                  'quantity': data.get('quantity', 1)}]})
+    
     action = request.form.get('action')
     
     if action == 'update':
@@ -161,48 +348,38 @@ def update_cart(cart_item_id):
         db.session.delete(cart_item)
     
     db.session.commit()
+    accounts.refresh_cart_summary(current_user.id)
     flash('Cart updated successfully!', 'success')
     return redirect(url_for('cart'))
 
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    
-    if not cart_items:
-        flash('Your cart is empty', 'error')
-        return redirect(url_for('cart'))
-    
     if request.method == 'POST':
         order_number = generate_order_number()
-        total_amount = sum(item.product.price * item.quantity for item in cart_items)
-        
-        order = Order(
-            order_number=order_number,
-            total_amount=total_amount,
-            payment_method=request.form.get('payment_method'),
-            shipping_address=request.form.get('shipping_address'),
-            user_id=current_user.id
-        )
-        db.session.add(order)
-        
-        for cart_item in cart_items:
-            order_item = OrderItem(
-                order=order,
-                product_id=cart_item.product_id,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
-            )
-            db.session.add(order_item)
-            
-            cart_item.product.stock_quantity -= cart_item.quantity
+        try:
+            order_id = order_pipeline.place_order(current_user.id, order_number,
+                                                  request.form.get('payment_method'),
+                                                  request.form.get('shipping_address'))
+        except stock.OutOfStock:
+            db.session.rollback()
+            flash('Some items in your cart are no longer available in the requested quantity.', 'error')
+            return redirect(url_for('cart'))
         
-        CartItem.query.filter_by(user_id=current_user.id).delete()
+        if order_id is None:
+            flash('Your cart is empty', 'error')
+            return redirect(url_for('cart'))
         
-        db.session.commit()
+        accounts.refresh_cart_summary(current_user.id)
         flash(f'Order #{order_number} placed successfully!', 'success')
         return redirect(url_for('orders'))
     
+    cart_items = with_view(CartItem.query, 'cart').filter_by(user_id=current_user.id).all()
+    
+    if not cart_items:
+        flash('Your cart is empty', 'error')
+        return redirect(url_for('cart'))
+    
     total = sum(item.product.price * item.quantity for item in cart_items)
     return render_template('checkout.html', cart_items=cart_items, total=total)
 
@@ -213,50 +390,42 @@ def book_product(product_id):
     quantity = int(request.form.get('quantity', 1))
     pickup_date = request.form.get('pickup_date')
     
-    if product.stock_quantity < quantity:
+    if quantity < 1 or product.stock_quantity < quantity:
         flash('Not enough stock available', 'error')
         return redirect(url_for('product_detail', product_id=product_id))
     
-    booking_number = generate_booking_number()
-    total_amount = product.price * quantity
-    
-    booking = Booking(
-        booking_number=booking_number,
-        total_amount=total_amount,
-        pickup_date=datetime.strptime(pickup_date, '%Y-%m-%d'),
-        user_id=current_user.id
-    )
-    db.session.add(booking)
-    
-    booking_item = BookingItem(
-        booking=booking,
-        product_id=product_id,
-        quantity=quantity,
-        price=product.price
-    )
-    db.session.add(booking_item)
-    
-    product.stock_quantity -= quantity
+    try:
+        booking = place_booking(current_user.id, product_id, quantity,
+                                datetime.strptime(pickup_date, '%Y-%m-%d'))
+    except stock.OutOfStock:
+        db.session.rollback()
+        flash('Not enough stock available', 'error')
+        return redirect(url_for('product_detail', product_id=product_id))
     
-    db.session.commit()
-    flash(f'Product booked successfully! Booking #: {booking_number}', 'success')
+    flash(f'Product booked successfully! Booking #: {booking.booking_number}', 'success')
     return redirect(url_for('bookings'))
 
 @app.route('/orders')
 @login_required
 def orders():
-    user_orders = Order.query.filter_by(user_id=current_user.id).order_by(
-        Order.created_at.desc()
-    ).all()
-    return render_template('orders.html', orders=user_orders)
+    archived = bool(request.args.get('archived'))
+    if archived:
+        query, sorts = with_view(ArchivedOrder.query, 'archived_orders'), ARCHIVED_ORDER_SORTS
+    else:
+        query, sorts = with_view(Order.query, 'orders'), ORDER_SORTS
+    page = paginate(query.filter_by(user_id=current_user.id), sorts)
+    return render_template('orders.html', orders=page.items, page=page, archived=archived)
 
 @app.route('/bookings')
 @login_required
 def bookings():
-    user_bookings = Booking.query.filter_by(user_id=current_user.id).order_by(
-        Booking.created_at.desc()
-    ).all()
-    return render_template('bookings.html', bookings=user_bookings)
+    archived = bool(request.args.get('archived'))
+    if archived:
+        query, sorts = with_view(ArchivedBooking.query, 'archived_bookings'), ARCHIVED_BOOKING_SORTS
+    else:
+        query, sorts = with_view(Booking.query, 'bookings'), BOOKING_SORTS
+    page = paginate(query.filter_by(user_id=current_user.id), sorts)
+    return render_template('bookings.html', bookings=page.items, page=page, archived=archived)
 
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -269,6 +438,7 @@ def profile():
         current_user.email = request.form.get('email')
         
         db.session.commit()
+        accounts.invalidate_user(current_user.id)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('profile'))
     
@@ -281,16 +451,19 @@ def admin_dashboard():
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    stats = {
-        'total_users': User.query.count(),
-        'total_products': Product.query.count(),
-        'total_orders': Order.query.count(),
-        'total_bookings': Booking.query.count(),
-        'recent_orders': Order.query.order_by(Order.created_at.desc()).limit(5).all(),
-        'low_stock_products': Product.query.filter(Product.stock_quantity <= 5).all()
+    counters = stats.counters()
+    dashboard_stats = {
+        'total_users': int(counters['users']),
+        'total_products': int(counters['products']),
+        'total_orders': int(counters['orders']),
+        'total_bookings': int(counters['bookings']),
+        'total_revenue': counters['revenue'],
+        'daily_sales': stats.daily_sales(),
+        'recent_orders': with_view(Order.query, 'dashboard_orders').order_by(Order.created_at.desc()).limit(5).all(),
+        'low_stock_products': stats.low_stock_products()
     }
     
-    return render_template('admin/dashboard.html', stats=stats)
+    return render_template('admin/dashboard.html', stats=dashboard_stats)
 
 @app.route('/admin/products')
 @login_required
@@ -299,9 +472,9 @@ def admin_products():
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    products = Product.query.all()
-    categories = Category.query.all()
-    return render_template('admin/products.html', products=products, categories=categories)
+    page = paginate(with_view(Product.query, 'admin_products'), PRODUCT_SORTS, default_per_page=50)
+    categories = catalog.categories()
+    return render_template('admin/products.html', products=page.items, page=page, categories=categories)
 
 @app.route('/admin/add_product', methods=['POST'])
 @login_required
@@ -323,6 +496,7 @@ def admin_add_product():
                     image_filename = timestamp + filename
                     image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
                     image_file.save(image_path)
+                    jobs.enqueue('image_variants', filename=image_filename)
                 else:
                     flash('Invalid file type. Please upload JPEG, PNG, GIF, or WebP images.', 'error')
                     return redirect(url_for('admin_products'))
@@ -345,7 +519,11 @@ def admin_add_product():
         )
         
         db.session.add(product)
+        stats.increment('products')
+        http_cache.catalog_changed()
         db.session.commit()
+        catalog.invalidate_catalog()
+        facets.facet_index.update(product)
         
         flash('Product added successfully!', 'success')
         return redirect(url_for('admin_products'))
@@ -371,6 +549,7 @@ def admin_update_product(product_id):
                 # Delete old image if exists
                 if product.image_url and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], product.image_url)):
                     os.remove(os.path.join(app.config['UPLOAD_FOLDER'], product.image_url))
+                    images.discard_variants(app.config['UPLOAD_FOLDER'], product.image_url)
                 
                 # Generate secure filename
                 filename = secure_filename(image_file.filename)
@@ -378,6 +557,7 @@ def admin_update_product(product_id):
                 image_filename = timestamp + filename
                 image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
                 image_file.save(image_path)
+                jobs.enqueue('image_variants', filename=image_filename)
                 product.image_url = image_filename
     
     product.name = request.form.get('name')
@@ -393,7 +573,10 @@ def admin_update_product(product_id):
     product.uv_protection = bool(request.form.get('uv_protection'))
     product.polarization = bool(request.form.get('polarization'))
     
+    http_cache.catalog_changed()
     db.session.commit()
+    catalog.invalidate_catalog()
+    facets.facet_index.update(product)
     flash('Product updated successfully!', 'success')
     return redirect(url_for('admin_products'))
 
@@ -406,11 +589,148 @@ def admin_delete_product(product_id):
     
     product = Product.query.get_or_404(product_id)
     product.is_active = False
+    http_cache.catalog_changed()
     db.session.commit()
+    catalog.invalidate_catalog()
+    facets.facet_index.update(product)
     
     flash('Product deleted successfully!', 'success')
     return redirect(url_for('admin_products'))
 
+@app.route('/admin/product/<int:product_id>')
+@login_required
+def admin_product_json(product_id):
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    product = db.session.get(Product, product_id)
+    if product is None:
+        return jsonify({'error': 'Product not found'}), 404
+    return jsonify(vars(catalog.snapshot(product)))
+
+@app.route('/admin/catalog/import', methods=['POST'])
+@login_required
+def admin_import_catalog():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    fmt = request.form.get('format') or catalog_io.detect_format(upload.filename)
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'error': 'Format must be csv or jsonl'}), 400
+    
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    report = catalog_io.import_products(stream, fmt, app.config['UPLOAD_FOLDER'],
+                                        image_dir=app.config['CATALOG_IMAGE_DIR'])
+    return jsonify(report.as_dict())
+
+@app.route('/admin/catalog/export')
+@login_required
+def admin_export_catalog():
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'error': 'Format must be csv or jsonl'}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(catalog_io.export_products(fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=catalog.{fmt}'})
+
+@app.route('/admin/export/<dataset>')
+@login_required
+def admin_export(dataset):
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    fmt = request.args.get('format', 'csv')
+    gzip = bool(request.args.get('gzip'))
+    try:
+        filters = exports.parse_filters(dataset, request.args.get('since'), request.args.get('until'),
+                                        request.args.get('status'))
+        chunks = exports.export(dataset, fmt, gzip=gzip, **filters)
+    except exports.ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    if gzip:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={exports.filename(dataset, fmt, gzip=gzip, **filters)}'
+    })
+
+@app.route('/admin/maintenance')
+@login_required
+def admin_maintenance():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    scheduled = maintenance.scheduled_at()
+    return jsonify({
+        'next_run': scheduled.isoformat() if scheduled else None,
+        'runs': maintenance.recent_runs(),
+    })
+
+@app.route('/admin/cache_stats')
+@login_required
+def admin_cache_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    return jsonify({
+        'catalog': catalog.catalog_cache.stats(),
+        'pages': dict(http_cache.page_cache.stats(), catalog_version=http_cache.catalog_version()),
+        'password_hashing': passwords.pool.stats(),
+    })
+
+@app.route('/admin/jobs')
+@login_required
+def admin_job_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(jobs.metrics())
+
+@app.route('/admin/perf', methods=['GET', 'POST'])
+@login_required
+def admin_perf():
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    if request.method == 'POST':
+        profiling.reset()
+        flash('Performance counters reset.', 'success')
+        return redirect(url_for('admin_perf'))
+    
+    return render_template('admin/perf.html', endpoints=profiling.endpoint_summaries(),
+                           slow_request_ms=app.config['SLOW_REQUEST_MS'])
+
+@app.route('/admin/reports')
+@login_required
+def admin_reports():
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    def parse_day(value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+        except ValueError:
+            return None
+    start, end = analytics.window(request.args.get('days', type=int),
+                                  parse_day(request.args.get('start')), parse_day(request.args.get('end')))
+    if request.args.get('refresh'):
+        analytics.reports.delete((start, end))
+    started = time.perf_counter()
+    report = analytics.sales_report(start, end)
+    return render_template('admin/reports.html', report=report, windows=analytics.WINDOWS,
+                           days=request.args.get('days', type=int),
+                           elapsed_ms=(time.perf_counter() - started) * 1000)
+
 @app.route('/admin/orders')
 @login_required
 def admin_orders():
@@ -418,8 +738,10 @@ def admin_orders():
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    page = paginate(with_view(Order.query, 'admin_orders'), ORDER_SORTS, default_per_page=50)
+    return render_template('admin/orders.html', orders=page.items, page=page,
+                           export_statuses=exports.DATASETS['orders'].statuses,
+                           archive_statuses=exports.DATASETS['archived_orders'].statuses)
 
 @app.route('/admin/update_order_status/<int:order_id>', methods=['POST'])
 @login_required
@@ -441,8 +763,9 @@ def admin_users():
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    users = User.query.all()
-    return render_template('admin/users.html', users=users)
+    page = paginate(User.query, USER_SORTS, default_per_page=50)
+    order_counts = order_counts_by_user([user.id for user in page.items])
+    return render_template('admin/users.html', users=page.items, page=page, order_counts=order_counts)
 
 @app.route('/admin/bookings')
 @login_required
@@ -451,8 +774,10 @@ def admin_bookings():
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    bookings = Booking.query.order_by(Booking.created_at.desc()).all()
-    return render_template('admin/bookings.html', bookings=bookings)
+    page = paginate(with_view(Booking.query, 'admin_bookings'), BOOKING_SORTS, default_per_page=50)
+    return render_template('admin/bookings.html', bookings=page.items, page=page,
+                           export_statuses=exports.DATASETS['bookings'].statuses,
+                           archive_statuses=exports.DATASETS['archived_bookings'].statuses)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -460,21 +785,45 @@ def login():
         return redirect(url_for('index'))
     
     if request.method == 'POST':
-        email = request.form.get('email')
-        password = request.form.get('password')
+        email = (request.form.get('email') or '').strip().lower()
+        password = request.form.get('password') or ''
         
-        user = User.query.filter_by(email=email).first()
+        try:
+            check_login_rate(email)
+            user = User.query.filter_by(email=email).first()
+            valid = user is not None and passwords.verify(user.password, password)
+        except ratelimit.Limited as limited:
+            flash('Too many login attempts. Please wait a moment and try again.', 'error')
+            return throttled(render_template('login.html'), limited.retry_after)
+        except passwords.PoolBusy:
+            flash('The store is busy right now. Please try again in a moment.', 'error')
+            return throttled(render_template('login.html'), 1, 503)
         
-        if user and check_password_hash(user.password, password):
+        if valid:
+            login_failures.clear(email)
             login_user(user)
+            accounts.clear_cart_summary()
             next_page = request.args.get('next')
             flash('Login successful!', 'success')
             return redirect(next_page) if next_page else redirect(url_for('index'))
         else:
+            login_failures.add(email)
             flash('Login failed. Check your email and password.', 'error')
     
     return render_template('login.html')
 
+def check_login_rate(email=None):
+    if not app.config['LOGIN_RATE_LIMIT']:
+        return
+    login_limiter.hit(request.remote_addr or 'unknown')
+    if email:
+        login_failures.check(email)
+
+def throttled(body, retry_after, status=429):
+    response = app.make_response((body, status))
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
@@ -512,12 +861,17 @@ def register():
                 flash('You must agree to the terms and conditions.', 'error')
                 return render_template('register.html')
             
-            # Check if user already exists
-            if User.query.filter_by(email=email).first():
+            check_login_rate()
+            
+            # Check if user already exists (email or username, one query)
+            taken = db.session.query(User.email, User.username).filter(
+                or_(User.email == email, User.username == username)
+            ).all()
+            if any(row.email == email for row in taken):
                 flash('Email already registered. Please use a different email.', 'error')
                 return render_template('register.html')
             
-            if User.query.filter_by(username=username).first():
+            if taken:
                 flash('Username already taken. Please choose a different username.', 'error')
                 return render_template('register.html')
             
@@ -525,12 +879,13 @@ def register():
             new_user = User(
                 username=username,
                 email=email,
-                password=generate_password_hash(password),
+                password=passwords.hash_password(password),
                 first_name=first_name,
                 last_name=last_name
             )
             
             db.session.add(new_user)
+            stats.increment('users')
             db.session.commit()
             
             # Log the user in after registration
@@ -539,10 +894,16 @@ def register():
             flash('🎉 Registration successful! Welcome to SunStyle!', 'success')
             return redirect(url_for('index'))
             
+        except ratelimit.Limited as limited:
+            flash('Too many attempts. Please wait a moment and try again.', 'error')
+            return throttled(render_template('register.html'), limited.retry_after)
+        except passwords.PoolBusy:
+            flash('The store is busy right now. Please try again in a moment.', 'error')
+            return throttled(render_template('register.html'), 1, 503)
         except Exception as e:
             db.session.rollback()
             flash('An error occurred during registration. Please try again.', 'error')
-            print(f"Registration error: {str(e)}")  # For debugging
+            app.logger.exception('Registration failed for %s', request.form.get('email'))
             return render_template('register.html')
     
     return render_template('register.html')
@@ -567,24 +928,34 @@ def test_register():
     '''
 @app.route('/subscribe', methods=['POST'])
 def subscribe():
-    email = request.form.get('email')
-    if email:
-        # Here you would typically save to database or send to email service
-        flash('Thank you for subscribing to our newsletter!', 'success')
-    else:
+    try:
+        email = validate_email(request.form.get('email', ''), check_deliverability=False).normalized.lower()
+    except EmailNotValidError:
         flash('Please enter a valid email address.', 'error')
-    return redirect(url_for('index'))
+        return redirect(request.referrer or url_for('index'))
+    
+    added = db.session.execute(
+        sqlite_insert(NewsletterSubscriber).values(email=email, created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[NewsletterSubscriber.email])
+    ).rowcount
+    if added:
+        jobs.enqueue('newsletter_welcome', email=email)
+    db.session.commit()
+    flash('Thank you for subscribing to our newsletter!', 'success')
+    return redirect(request.referrer or url_for('index'))
 
 @app.route('/logout')
 @login_required
 def logout():
     logout_user()
+    accounts.clear_cart_summary()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
 def init_db():
     with app.app_context():
-        db.create_all()
+        migrations.upgrade()
+        search.create_search_index()
         
         # Create admin user if not exists
         if not User.query.filter_by(email='admin@sunglassstore.com').first():
@@ -646,7 +1017,135 @@ def init_db():
             ]
             db.session.add_all(products)
         
+        maintenance.schedule()
+        maintenance.schedule_booking_sweep()
         db.session.commit()
+        stats.ensure_initialized()
+
+@app.cli.command('release-expired-bookings')
+def release_expired_bookings_command():
+    released = stock.release_expired_bookings()
+    print(f'Released {len(released)} expired booking(s)')
+
+@app.cli.command('maintenance')
+@click.option('--task', 'tasks', multiple=True, type=click.Choice(maintenance.TASKS),
+              help='Run only these tasks (repeatable); default is all of them.')
+@click.option('--full-vacuum', is_flag=True, help='Rewrite the whole file with VACUUM (blocks writers; '
+              'needed once to enable incremental vacuum on an older database).')
+def maintenance_command(tasks, full_vacuum):
+    report = maintenance.run(tasks or maintenance.TASKS, full_vacuum=full_vacuum)
+    for task, result in report.items():
+        print(f'{task:>8}: ' + ', '.join(f'{name}={value}' for name, value in result.items()))
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    totals = stats.rebuild()
+    print('Rebuilt dashboard statistics: ' + ', '.join(f'{name}={value:g}' for name, value in totals.items()))
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    folder = app.config['UPLOAD_FOLDER']
+    built = 0
+    for filename in sorted(os.listdir(folder)):
+        if allowed_file(filename) and os.path.isfile(os.path.join(folder, filename)):
+            images.build_variants(folder, filename)
+            built += 1
+    print(f'Built variants for {built} image(s)')
+
+@app.cli.command('build-recommendations')
+@click.option('--full', is_flag=True, help='Recompute every list instead of only products bought since the last run.')
+def build_recommendations_command(full):
+    started = time.perf_counter()
+    result = recommendations.build() if full else recommendations.refresh()
+    print(f'Updated related products for {result["products"]} product(s) from {result["baskets"]} basket(s): '
+          f'{result["neighbors"]} neighbor row(s) in {time.perf_counter() - started:.2f}s')
+
+@app.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--images', type=click.Path(exists=True, file_okay=False), help='Directory holding the image files.')
+@click.option('--batch-size', default=catalog_io.BATCH_SIZE, show_default=True, help='Rows per transaction.')
+def import_catalog_command(path, fmt, images, batch_size):
+    fmt = fmt or catalog_io.detect_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = catalog_io.import_products(stream, fmt, app.config['UPLOAD_FOLDER'],
+                                            image_dir=images or app.config['CATALOG_IMAGE_DIR'],
+                                            batch_size=batch_size)
+    for error in report.errors:
+        print(f'line {error["line"]}: {error["error"]}')
+    print(f'Read {report.rows} row(s) in {report.seconds:.2f}s ({report.rows_per_second:.0f} rows/s): '
+          f'{report.created} created, {report.updated} updated, {report.failed} failed')
+    if report.failed:
+        raise SystemExit(1)
+
+@app.cli.command('export-catalog')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+def export_catalog_command(path, fmt):
+    fmt = fmt or catalog_io.detect_format(path)
+    with click.open_file(path, 'w', encoding='utf-8') as output:
+        for chunk in catalog_io.export_products(fmt):
+            output.write(chunk)
+
+@app.cli.command('export-data')
+@click.argument('dataset', type=click.Choice(sorted(exports.DATASETS)))
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(exports.FORMATS), help='Defaults to the file extension.')
+@click.option('--since', help='First day to include (YYYY-MM-DD).')
+@click.option('--until', help='Last day to include (YYYY-MM-DD).')
+@click.option('--status', help='Only orders/bookings with this status.')
+@click.option('--gzip', is_flag=True, help='Compress the output (implied by a .gz path).')
+def export_data_command(dataset, path, fmt, since, until, status, gzip):
+    gzip = gzip or path.endswith('.gz')
+    fmt = fmt or catalog_io.detect_format(path[:-3] if path.endswith('.gz') else path)
+    try:
+        filters = exports.parse_filters(dataset, since, until, status)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    started = time.perf_counter()
+    written = 0
+    with click.open_file(path, 'wb' if gzip else 'w', **({} if gzip else {'encoding': 'utf-8'})) as output:
+        for chunk in exports.export(dataset, fmt, gzip=gzip, **filters):
+            output.write(chunk)
+            written += len(chunk)
+    click.echo(f'Exported {dataset} ({written} bytes) in {time.perf_counter() - started:.1f}s', err=True)
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    applied = migrations.upgrade()
+    for version, description in applied:
+        print(f'Applied migration {version}: {description}')
+    with db.engine.connect() as connection:
+        print(f'Schema at version {migrations.current_version(connection)}')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    checked, failures = query_plans.check(app)
+    for path, statement, steps in failures:
+        print(f'{path}: {" | ".join(steps) or statement}')
+        if steps:
+            print(f'    {" ".join(statement.split())}')
+    print(f'Checked {checked} distinct queries, {len(failures)} full scan(s)')
+    if failures:
+        raise SystemExit(1)
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=jobs.DEFAULT_WORKERS, show_default=True, help='Worker threads to run.')
+@click.option('--once', is_flag=True, help='Run every job that is due, then exit.')
+def run_jobs_command(workers, once):
+    if once:
+        print(f'Ran {jobs.run_pending()} job(s)')
+        return
+    maintenance.schedule()
+    maintenance.schedule_booking_sweep()
+    db.session.commit()
+    started = jobs.start_workers(app, workers)
+    print(f'Running {len(started)} job worker(s); press Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        jobs.stop_workers()
 
 if __name__ == '__main__':
     init_db()
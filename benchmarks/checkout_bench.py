@@ -0,0 +1,96 @@
+# Order placement micro-benchmark: the original per-row ORM checkout versus
+# order_pipeline.place_order(), for carts of 1, 10 and 100 lines. Reports
+# SQL statements and latency per order.
+#
+#   python benchmarks/checkout_bench.py --repeat 50
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def legacy_place_order(db, user_id, order_number, CartItem, Order, OrderItem):
+    # checkout() as it was before the pipeline: lazy product loads, a
+    # Python-side stock decrement and one OrderItem object per line.
+    cart_items = CartItem.query.filter_by(user_id=user_id).all()
+    order = Order(
+        order_number=order_number,
+        total_amount=sum(item.product.price * item.quantity for item in cart_items),
+        payment_method='card',
+        shipping_address='Bench street',
+        user_id=user_id
+    )
+    db.session.add(order)
+    for cart_item in cart_items:
+        db.session.add(OrderItem(order=order, product_id=cart_item.product_id,
+                                 quantity=cart_item.quantity, price=cart_item.product.price))
+        cart_item.product.stock_quantity -= cart_item.quantity
+    CartItem.query.filter_by(user_id=user_id).delete()
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--sizes', default='1,10,100')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    workdir = tempfile.mkdtemp(prefix='checkout_bench_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+
+    import app as store
+    import order_pipeline
+    from sqlalchemy import event
+    from database import db, User, Product, Category, CartItem, Order, OrderItem
+
+    statements = [0]
+
+    with store.app.app_context():
+        db.create_all()
+        db.session.add(Category(id=1, name='Bench'))
+        db.session.add(User(id=1, username='bench', email='bench@example.com', password='x',
+                            first_name='Bench', last_name='User'))
+        db.session.add_all(Product(id=i, name=f'Product {i}', price=10.0 + i, brand='Bench',
+                                   stock_quantity=10 ** 9, category_id=1)
+                           for i in range(1, max(sizes) + 1))
+        db.session.commit()
+        # Reads go to the 'read' bind (sqlite_engine.py), so count on every engine.
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute',
+                         lambda *_: statements.__setitem__(0, statements[0] + 1))
+
+        def fill_cart(size):
+            db.session.add_all(CartItem(user_id=1, product_id=i, quantity=2) for i in range(1, size + 1))
+            db.session.commit()
+            db.session.expunge_all()
+
+        serial = [0]
+        def next_number():
+            serial[0] += 1
+            return f'BENCH{serial[0]:08d}'
+
+        paths = {
+            'legacy': lambda: legacy_place_order(db, 1, next_number(), CartItem, Order, OrderItem),
+            'pipeline': lambda: order_pipeline.place_order(1, next_number(), 'card', 'Bench street'),
+        }
+
+        print(f'{"cart":>5} {"path":>9} {"stmts":>6} {"mean ms":>8} {"p95 ms":>8}')
+        for size in sizes:
+            for name, place in paths.items():
+                timings = []
+                for _ in range(args.repeat):
+                    fill_cart(size)
+                    statements[0] = 0
+                    started = time.perf_counter()
+                    place()
+                    timings.append((time.perf_counter() - started) * 1000)
+                    db.session.expunge_all()
+                timings.sort()
+                p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+                print(f'{size:>5} {name:>9} {statements[0]:>6} {statistics.mean(timings):>8.2f} {p95:>8.2f}')
+
+if __name__ == '__main__':
+    main()
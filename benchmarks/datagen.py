@@ -0,0 +1,234 @@
+# Synthetic data for load tests. Fills a fresh database with categories,
+# products, users, orders (with their lines) and bookings spread over the
+# last year, deterministically for a given --seed, then rebuilds the
+# dashboard counters and the related-products lists.
+#
+#   python benchmarks/datagen.py --db /tmp/load.db --products 100000 --users 100000 --orders 1000000
+#
+# Every generated user has the password `bench-pass`; user 1 is an admin
+# (admin@bench.example). Users are bench<N>@bench.example.
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ids
+
+PASSWORD = 'bench-pass'
+ADMIN_EMAIL = 'admin@bench.example'
+CHUNK = 10000
+
+CATEGORIES = ('Aviator', 'Wayfarer', 'Sport', 'Round', 'Cat Eye', 'Oversized', 'Kids', 'Prescription')
+BRANDS = ('Ray-Ban', 'Oakley', 'Persol', 'Maui Jim', 'Costa', 'Prada', 'Gucci', 'Tom Ford',
+          'Carrera', 'Polaroid', 'Smith', 'Oliver Peoples')
+COLORS = ('Black', 'Tortoise', 'Gold', 'Silver', 'Blue', 'Brown', 'Green', 'Red', 'White', 'Gunmetal')
+MATERIALS = ('Acetate', 'Metal', 'Titanium', 'Nylon', 'Wood', 'Carbon Fiber')
+LENSES = ('Polycarbonate', 'Glass', 'CR-39', 'Nylon', 'Trivex')
+ADJECTIVES = ('Classic', 'Urban', 'Coastal', 'Vintage', 'Summit', 'Street', 'Desert', 'Harbor',
+              'Solar', 'Midnight', 'Alpine', 'Metro', 'Sunset', 'Nomad', 'Pilot', 'Edge')
+PAYMENT_METHODS = ('card', 'upi', 'cod', 'netbanking')
+ORDER_STATUSES = ('pending', 'processing', 'shipped', 'delivered', 'delivered', 'delivered', 'cancelled')
+
+def chunks(rows, size=CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def order_number(created, serial):
+    # Same shape as ids.new_id(), with the serial in place of node+sequence.
+    ms = max(0, int((created - ids.EPOCH.replace(tzinfo=None)).total_seconds() * 1000))
+    return 'ORD' + ids.encode((ms << (ids.NODE_BITS + ids.SEQUENCE_BITS)) | serial)
+
+def insert_rows(connection, table, rows, label, total):
+    started = time.perf_counter()
+    done = 0
+    for batch in chunks(rows):
+        connection.execute(table.insert(), batch)
+        done += len(batch)
+        print(f'\r  {label}: {done}/{total}', end='', flush=True)
+    print(f'\r  {label}: {done} rows in {time.perf_counter() - started:.1f}s')
+
+def generate(args):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.db)
+    os.environ.setdefault('JOB_WORKERS', '0')
+    os.chdir(ROOT)
+    from werkzeug.security import generate_password_hash
+    import app as store
+    import migrations
+    import recommendations
+    import search
+    import stats
+    from database import db, Category, Product, User, Order, OrderItem, Booking, BookingItem
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=args.days)
+    password = generate_password_hash(PASSWORD)
+
+    with store.app.app_context():
+        migrations.upgrade()
+        search.create_search_index()
+        with db.engine.begin() as connection:
+            # Bulk load only: durability does not matter for a scratch database.
+            connection.exec_driver_sql('PRAGMA synchronous=OFF')
+
+            insert_rows(connection, Category.__table__, (
+                {'id': i + 1, 'name': name, 'description': f'{name} sunglasses'}
+                for i, name in enumerate(CATEGORIES)
+            ), 'categories', len(CATEGORIES))
+
+            prices = {}
+            def products():
+                for product_id in range(1, args.products + 1):
+                    category = rng.randrange(len(CATEGORIES))
+                    brand = rng.choice(BRANDS)
+                    price = round(rng.lognormvariate(4.6, 0.6), 2)
+                    prices[product_id] = price
+                    yield {
+                        'id': product_id,
+                        'name': f'{brand} {rng.choice(ADJECTIVES)} {CATEGORIES[category]} {product_id}',
+                        'description': f'{rng.choice(ADJECTIVES)} {CATEGORIES[category].lower()} frame '
+                                       f'in {rng.choice(COLORS).lower()} with {rng.choice(LENSES).lower()} lenses.',
+                        'price': price,
+                        'brand': brand,
+                        'style': CATEGORIES[category],
+                        'color': rng.choice(COLORS),
+                        'frame_material': rng.choice(MATERIALS),
+                        'lens_type': rng.choice(LENSES),
+                        'uv_protection': rng.random() < 0.9,
+                        'polarization': rng.random() < 0.4,
+                        'stock_quantity': rng.randint(0, 5) if rng.random() < 0.02 else rng.randint(100, 1000),
+                        'image_url': None,
+                        'is_active': rng.random() < 0.97,
+                        'created_at': start + timedelta(seconds=rng.randrange(args.days * 86400)),
+                        'category_id': category + 1,
+                    }
+            insert_rows(connection, Product.__table__, products(), 'products', args.products)
+
+            def users():
+                for user_id in range(1, args.users + 1):
+                    admin = user_id == 1
+                    yield {
+                        'id': user_id,
+                        'username': 'benchadmin' if admin else f'bench{user_id}',
+                        'email': ADMIN_EMAIL if admin else f'bench{user_id}@bench.example',
+                        'password': password,
+                        'first_name': rng.choice(('Asha', 'Ravi', 'Maya', 'Arjun', 'Sara', 'Leo', 'Nina', 'Omar')),
+                        'last_name': f'User{user_id}',
+                        'phone': None,
+                        'address': f'{user_id} Bench Street',
+                        'is_admin': admin,
+                        'created_at': start + timedelta(seconds=rng.randrange(args.days * 86400)),
+                    }
+            insert_rows(connection, User.__table__, users(), 'users', args.users)
+
+            # Orders in time order, like production, so ids and order
+            # numbers increase with created_at.
+            step = args.days * 86400 / max(args.orders, 1)
+            order_lines = []
+            def orders():
+                for order_id in range(1, args.orders + 1):
+                    created = start + timedelta(seconds=order_id * step)
+                    lines = []
+                    for _ in range(rng.choice((1, 1, 1, 2, 2, 3, 4))):
+                        product_id = rng.randint(1, args.products)
+                        lines.append((product_id, rng.randint(1, 3), prices[product_id]))
+                    order_lines.append((order_id, lines))
+                    yield {
+                        'id': order_id,
+                        'order_number': order_number(created, order_id),
+                        'total_amount': round(sum(quantity * price for _, quantity, price in lines), 2),
+                        'status': rng.choice(ORDER_STATUSES),
+                        'payment_method': rng.choice(PAYMENT_METHODS),
+                        'payment_status': 'paid',
+                        'shipping_address': f'{order_id} Bench Street',
+                        'created_at': created,
+                        'updated_at': created,
+                        'user_id': rng.randint(1, args.users),
+                    }
+                    if len(order_lines) >= CHUNK:
+                        flush_lines()
+
+            item_id = [0]
+            def flush_lines():
+                rows = []
+                for order_id, lines in order_lines:
+                    for product_id, quantity, price in lines:
+                        item_id[0] += 1
+                        rows.append({'id': item_id[0], 'order_id': order_id, 'product_id': product_id,
+                                     'quantity': quantity, 'price': price})
+                order_lines.clear()
+                if rows:
+                    connection.execute(OrderItem.__table__.insert(), rows)
+
+            insert_rows(connection, Order.__table__, orders(), 'orders', args.orders)
+            flush_lines()
+            print(f'  order lines: {item_id[0]} rows')
+
+            booking_step = args.days * 86400 / max(args.bookings, 1)
+            booking_lines = []
+            def bookings():
+                for booking_id in range(1, args.bookings + 1):
+                    created = start + timedelta(seconds=booking_id * booking_step)
+                    product_id = rng.randint(1, args.products)
+                    quantity = rng.randint(1, 2)
+                    booking_lines.append({'id': booking_id, 'booking_id': booking_id, 'product_id': product_id,
+                                          'quantity': quantity, 'price': prices[product_id]})
+                    yield {
+                        'id': booking_id,
+                        'booking_number': f'BKG{booking_id:016d}',
+                        'status': rng.choice(('reserved', 'collected', 'collected', 'expired')),
+                        'pickup_date': created + timedelta(days=rng.randint(1, 7)),
+                        'total_amount': round(quantity * prices[product_id], 2),
+                        'created_at': created,
+                        'updated_at': created,
+                        'user_id': rng.randint(1, args.users),
+                    }
+            insert_rows(connection, Booking.__table__, bookings(), 'bookings', args.bookings)
+            insert_rows(connection, BookingItem.__table__, booking_lines, 'booking lines', len(booking_lines))
+
+        started = time.perf_counter()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        totals = stats.rebuild()
+        print(f'  analyze + counters: {time.perf_counter() - started:.1f}s')
+        started = time.perf_counter()
+        built = recommendations.build()
+        print(f'  related products: {built["neighbors"]} rows in {time.perf_counter() - started:.1f}s')
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', required=True, help='path of the SQLite file to create')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--bookings', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help='overwrite an existing file')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f'{args.db} exists; pass --force to replace it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    started = time.perf_counter()
+    totals = generate(args)
+    print(f'Generated {args.db} in {time.perf_counter() - started:.1f}s: '
+          + ', '.join(f'{name}={value:g}' for name, value in totals.items()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Multi-process uniqueness check for ids.py: several worker processes (plus
+# forked children of an already-used generator) each draw ids as fast as
+# they can; every id must be globally unique and strictly increasing within
+# its process.
+#
+#   python benchmarks/id_uniqueness.py --processes 8 --count 500000
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ids
+
+def draw(count):
+    next_id = ids.generator.next_id
+    values = [next_id() for _ in range(count)]
+    increasing = all(a < b for a, b in zip(values, values[1:]))
+    return values, increasing
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--count', type=int, default=250000, help='ids per process')
+    args = parser.parse_args()
+
+    # Warm the parent's generator so forked children inherit used state.
+    ids.generator.next_id()
+
+    started = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(args.processes) as pool:
+        results = pool.map(draw, [args.count] * args.processes)
+    elapsed = time.perf_counter() - started
+
+    total = args.processes * args.count
+    seen = set()
+    for values, _ in results:
+        seen.update(values)
+    monotonic = all(increasing for _, increasing in results)
+    encoded = sorted(ids.encode(value) for value in results[0][0][:1000])
+
+    print(f'processes={args.processes} ids={total} elapsed={elapsed:.2f}s rate={total / elapsed:,.0f}/s')
+    print(f'unique={len(seen)} duplicates={total - len(seen)} monotonic per process={monotonic}')
+    print(f'string order matches numeric order={encoded == [ids.encode(v) for v in results[0][0][:1000]]}')
+    return 0 if len(seen) == total and monotonic else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
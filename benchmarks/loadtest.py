@@ -0,0 +1,331 @@
+# Scripted load test for the storefront, checkout and admin flows.
+#
+#   python benchmarks/datagen.py --db /tmp/load.db                  # once
+#   python benchmarks/loadtest.py run --db /tmp/load.db --save      # in-process
+#   python benchmarks/loadtest.py run --url http://127.0.0.1:8000 --save
+#   python benchmarks/loadtest.py compare benchmarks/results/A.json benchmarks/results/B.json
+#
+# In-process runs use the Flask test client against a scratch copy of
+# --db, so every run starts from the same data. Live-server runs need the
+# server started on a datagen database with PROFILE_HEADERS=1 for query
+# counts. Each scenario runs --threads workers for --duration seconds and
+# reports p50/p95/p99 latency, throughput and mean SQL statements per
+# route. --save writes the results to benchmarks/results/ named after the
+# commit; `compare` diffs two result files and exits non-zero when a
+# route's p95 regressed by more than --threshold percent or it issues
+# more SQL statements than before.
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+from datagen import PASSWORD, ADMIN_EMAIL, BRANDS, CATEGORIES
+
+SCENARIOS = ('browse', 'detail', 'checkout', 'admin')
+SORTS = ('newest', 'price_asc', 'price_desc', 'name')
+PRICE_BUCKETS = ('0-50', '50-100', '100-150', '150-200', '200-300', '300+')
+SEARCH_TERMS = ('aviator', 'ray', 'sport round', 'vintage', 'oakley pilot', 'cat eye')
+SQL_TOLERANCE = 0.5  # mean statements per request before it counts as a regression
+NEXT_LINK = re.compile(r'href="([^"]*(?:[?&]|&amp;)after=[^"]*)"')
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def next_page(self):
+        match = NEXT_LINK.search(self.body)
+        return match.group(1).replace('&amp;', '&') if match else None
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return Response(response.status_code, response.headers, response.get_data(as_text=True))
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpSession:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return Response(response.status, response.headers, response.read().decode('utf-8', 'replace'))
+        except urllib.error.HTTPError as error:
+            return Response(error.code, error.headers, error.read().decode('utf-8', 'replace'))
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def call(self, session, label, method, path, data=None):
+        started = time.perf_counter()
+        response = session.request(method, path, data)
+        elapsed = time.perf_counter() - started
+        sql = response.headers.get('X-SQL-Count')
+        with self.lock:
+            self.samples.setdefault(label, []).append(
+                (elapsed, response.status < 400, int(sql) if sql is not None else None))
+        return response
+
+def login(session, email):
+    response = session.request('POST', '/login', {'email': email, 'password': PASSWORD})
+    if response.status != 302:
+        raise RuntimeError(f'Login failed for {email} (HTTP {response.status})')
+
+def browse(recorder, session, rng, ctx):
+    params = {'sort': rng.choice(SORTS)}
+    roll = rng.random()
+    if roll < 0.25:
+        params['brand'] = rng.choice(BRANDS)
+    elif roll < 0.45:
+        params['category_id'] = rng.randint(1, len(CATEGORIES))
+    elif roll < 0.6:
+        params['price_bucket'] = rng.choice(PRICE_BUCKETS)
+    elif roll < 0.75:
+        params = {'q': rng.choice(SEARCH_TERMS)}
+    label = 'GET /products?q' if 'q' in params else 'GET /products'
+    response = recorder.call(session, label, 'GET', '/products?' + urllib.parse.urlencode(params))
+    for _ in range(2):
+        next_page = response.next_page()
+        if not next_page or rng.random() < 0.5:
+            break
+        response = recorder.call(session, 'GET /products (next page)', 'GET', next_page)
+
+def detail(recorder, session, rng, ctx):
+    recorder.call(session, 'GET /product/<id>', 'GET', f'/product/{rng.randint(1, ctx["products"])}')
+
+def checkout(recorder, session, rng, ctx):
+    for _ in range(rng.choice((1, 1, 2, 3))):
+        product_id = rng.randint(1, ctx['products'])
+        recorder.call(session, 'POST /add_to_cart/<id>', 'POST', f'/add_to_cart/{product_id}', {'quantity': 1})
+    recorder.call(session, 'GET /cart', 'GET', '/cart')
+    recorder.call(session, 'GET /checkout', 'GET', '/checkout')
+    recorder.call(session, 'POST /checkout', 'POST', '/checkout',
+                  {'payment_method': 'card', 'shipping_address': 'Load test street'})
+
+ADMIN_PAGES = ('/admin/dashboard', '/admin/orders', '/admin/products', '/admin/users', '/admin/bookings')
+
+def admin(recorder, session, rng, ctx):
+    path = rng.choice(ADMIN_PAGES)
+    response = recorder.call(session, 'GET ' + path, 'GET', path)
+    next_page = response.next_page()
+    if next_page and rng.random() < 0.5:
+        recorder.call(session, f'GET {path} (next page)', 'GET', next_page)
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for label, samples in sorted(recorder.samples.items()):
+        latencies = sorted(sample[0] for sample in samples)
+        sql = [sample[2] for sample in samples if sample[2] is not None]
+        routes[label] = {
+            'count': len(samples),
+            'errors': sum(1 for sample in samples if not sample[1]),
+            'rps': round(len(samples) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'sql_mean': round(sum(sql) / len(sql), 2) if sql else None,
+        }
+    total = sum(route['count'] for route in routes.values())
+    return {'seconds': round(elapsed, 2), 'requests': total, 'rps': round(total / elapsed, 2), 'routes': routes}
+
+def run_scenario(name, make_session, args, ctx):
+    recorder = Recorder()
+    action = globals()[name]
+    sessions = []
+    for worker in range(args.threads):
+        session = make_session()
+        if name == 'admin':
+            login(session, ADMIN_EMAIL)
+        elif name == 'checkout':
+            # Users 2.. are customers; keep workers (and runs) on distinct carts.
+            login(session, f'bench{2 + worker}@bench.example')
+        sessions.append(session)
+
+    deadline = time.perf_counter() + args.duration
+    def work(worker):
+        rng = random.Random(args.seed * 1000 + worker)
+        session = sessions[worker]
+        while time.perf_counter() < deadline:
+            action(recorder, session, rng, ctx)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(recorder, time.perf_counter() - started)
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+def print_results(results):
+    for name, scenario in results['scenarios'].items():
+        print(f'\n[{name}] {scenario["requests"]} requests in {scenario["seconds"]}s, {scenario["rps"]} req/s')
+        print(f'  {"route":<36} {"count":>6} {"err":>4} {"req/s":>7} {"p50 ms":>8} {"p95 ms":>8} '
+              f'{"p99 ms":>8} {"max ms":>8} {"sql":>5}')
+        for label, route in scenario['routes'].items():
+            sql = f'{route["sql_mean"]:.1f}' if route['sql_mean'] is not None else '-'
+            print(f'  {label:<36} {route["count"]:6d} {route["errors"]:4d} {route["rps"]:7.1f} '
+                  f'{route["p50_ms"]:8.2f} {route["p95_ms"]:8.2f} {route["p99_ms"]:8.2f} '
+                  f'{route["max_ms"]:8.2f} {sql:>5}')
+
+def command_run(args):
+    scenarios = SCENARIOS if args.scenario == 'all' else tuple(args.scenario.split(','))
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise SystemExit(f'Unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}')
+
+    if args.url:
+        make_session = lambda: HttpSession(args.url)
+        ctx = {'products': args.products}
+        target = args.url
+    else:
+        if not args.db:
+            raise SystemExit('Pass --db (a datagen database) or --url')
+        workdir = tempfile.mkdtemp(prefix='loadtest_')
+        scratch = os.path.join(workdir, 'load.db')
+        shutil.copyfile(args.db, scratch)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + scratch
+        os.environ['JOB_WORKERS'] = '0'
+        os.environ['PROFILE_HEADERS'] = '1'
+        os.environ['MAIL_BACKEND'] = 'memory'
+        os.environ['LOGIN_RATE_LIMIT'] = '0'  # every simulated user logs in from 127.0.0.1
+        os.chdir(ROOT)
+        import app as store
+        from database import db, Product
+        with store.app.app_context():
+            ctx = {'products': db.session.query(db.func.max(Product.id)).scalar() or 1}
+        make_session = lambda: TestClientSession(store.app)
+        target = args.db
+
+    commit, dirty = git_revision()
+    results = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'at': datetime.utcnow().isoformat(timespec='seconds'),
+            'target': target,
+            'mode': 'http' if args.url else 'test-client',
+            'threads': args.threads,
+            'duration': args.duration,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'scenarios': {},
+    }
+    for name in scenarios:
+        print(f'Running {name} ({args.threads} threads, {args.duration:g}s)...', flush=True)
+        results['scenarios'][name] = run_scenario(name, make_session, args, ctx)
+    print_results(results)
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        path = args.output or os.path.join(RESULTS_DIR, f'{stamp}-{commit}{"-dirty" if dirty else ""}.json')
+        with open(path, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        print(f'\nSaved {path}')
+
+def command_compare(args):
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.candidate) as handle:
+        candidate = json.load(handle)
+    print(f'baseline  {baseline["meta"]["commit"]} ({baseline["meta"]["at"]})')
+    print(f'candidate {candidate["meta"]["commit"]} ({candidate["meta"]["at"]})')
+    regressions = 0
+    for name, scenario in candidate['scenarios'].items():
+        old_routes = baseline['scenarios'].get(name, {}).get('routes', {})
+        print(f'\n[{name}]')
+        print(f'  {"route":<36} {"p50 ms":>17} {"p95 ms":>17} {"p99 ms":>17} {"sql":>11}')
+        for label, route in scenario['routes'].items():
+            old = old_routes.get(label)
+            if old is None:
+                print(f'  {label:<36} (new)')
+                continue
+            cells = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                change = (route[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                cells.append(f'{route[key]:8.2f} {change:+7.1f}%')
+            sql = f'{old["sql_mean"] or 0:.1f}->{route["sql_mean"] or 0:.1f}'
+            p95_change = (route['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0.0
+            more_sql = (route['sql_mean'] or 0) - (old['sql_mean'] or 0) >= SQL_TOLERANCE
+            regressed = p95_change > args.threshold or more_sql
+            regressions += regressed
+            print(f'  {label:<36} {" ".join(cells)} {sql:>11}{"  REGRESSED" if regressed else ""}')
+    print(f'\n{regressions} regressed route(s) (p95 +{args.threshold:g}% or more queries)')
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run scenarios and print (optionally save) results')
+    run.add_argument('--db', help='datagen database; copied to a scratch file for the run')
+    run.add_argument('--url', help='base URL of a running server instead of the test client')
+    run.add_argument('--products', type=int, default=100000, help='product id range for --url runs')
+    run.add_argument('--scenario', default='all', help=f'comma list of {", ".join(SCENARIOS)} or all')
+    run.add_argument('--threads', type=int, default=4)
+    run.add_argument('--duration', type=float, default=20, help='seconds per scenario')
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--save', action='store_true')
+    run.add_argument('--output', help='results file (default benchmarks/results/<time>-<commit>.json)')
+
+    compare = commands.add_parser('compare', help='diff two saved result files')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=10, help='allowed p95 increase in percent')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        command_run(args)
+    else:
+        sys.exit(command_compare(args))
+
+if __name__ == '__main__':
+    main()
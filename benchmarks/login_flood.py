@@ -0,0 +1,142 @@
+# Catalog latency during a credential-stuffing flood. Catalog clients fetch
+# product listings (distinct filters, so the page cache does not answer
+# them) first on a quiet server, then while flood clients post wrong
+# passwords for real accounts as fast as they can. Each configuration runs
+# in its own process against a fresh database:
+#
+#   inline     hashing on the request thread, no rate limit (the old code)
+#   threads    hashing on the one-thread pool (the default), no rate limit
+#   pool       hashing on the low-priority worker process (gunicorn), no rate limit
+#   pool+limit the process pool plus the per-IP token bucket / per-email window
+#
+#   python benchmarks/login_flood.py --flooders 8 --readers 2 --seconds 8
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'flood-pass'
+PRODUCTS = 200
+USERS = 50
+
+CONFIGS = {
+    'inline': {'PASSWORD_HASH_WORKERS': '0', 'LOGIN_RATE_LIMIT': '0'},
+    'threads': {'PASSWORD_HASH_WORKERS': '1', 'PASSWORD_HASH_PROCESSES': '0', 'LOGIN_RATE_LIMIT': '0'},
+    'pool': {'PASSWORD_HASH_WORKERS': '1', 'PASSWORD_HASH_PROCESSES': '1', 'LOGIN_RATE_LIMIT': '0'},
+    'pool+limit': {'PASSWORD_HASH_WORKERS': '1', 'PASSWORD_HASH_PROCESSES': '1', 'LOGIN_RATE_LIMIT': '1'},
+}
+
+def _load_app(db_path, config):
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['JOB_WORKERS'] = '0'
+    os.environ.update(CONFIGS[config])
+    import app as store
+    return store
+
+def setup(store):
+    from werkzeug.security import generate_password_hash
+    from database import db, User, Product, Category
+    password = generate_password_hash(PASSWORD)
+    with store.app.app_context():
+        store.migrations.upgrade()
+        store.search.create_search_index()
+        db.session.add(Category(id=1, name='Bench'))
+        for i in range(PRODUCTS):
+            db.session.add(Product(name=f'Bench Aviator {i}', description='Benchmark frame',
+                                   price=10.0 + i, brand='Bench', style='Aviator',
+                                   stock_quantity=100, category_id=1))
+        for i in range(USERS):
+            db.session.add(User(username=f'flood{i}', email=f'flood{i}@example.com',
+                                password=password, first_name='Flood', last_name=str(i)))
+        db.session.commit()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def read_catalog(store, deadline, latencies, seed):
+    client = store.app.test_client()
+    rng = random.Random(seed)
+    while time.time() < deadline:
+        started = time.perf_counter()
+        response = client.get(f'/products?min_price={rng.randint(10, 200)}&max_price={rng.randint(200, 400)}')
+        latencies.append((time.perf_counter() - started, response.status_code == 200))
+
+def flood(store, deadline, statuses, seed):
+    client = store.app.test_client()
+    rng = random.Random(seed)
+    while time.time() < deadline:
+        response = client.post('/login', data={'email': f'flood{rng.randrange(USERS)}@example.com',
+                                               'password': 'wrong-' + str(rng.random())})
+        statuses.append(response.status_code)
+
+def phase(store, args, flooding):
+    deadline = time.time() + args.seconds
+    latencies = []
+    statuses = []
+    threads = [threading.Thread(target=read_catalog, args=(store, deadline, latencies, i))
+               for i in range(args.readers)]
+    if flooding:
+        threads += [threading.Thread(target=flood, args=(store, deadline, statuses, 1000 + i))
+                    for i in range(args.flooders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+def run(config, args, results):
+    db_path = os.path.join(tempfile.mkdtemp(prefix='login_flood_'), 'bench.db')
+    store = _load_app(db_path, config)
+    setup(store)
+    store.app.test_client().get('/products')  # warm caches and the hash pool
+    store.passwords.pool.run(len, '')
+    rows = []
+    for flooding in (False, True):
+        latencies, statuses = phase(store, args, flooding)
+        times = [elapsed for elapsed, _ in latencies]
+        rows.append({
+            'phase': 'flood' if flooding else 'quiet',
+            'reads': len(times) / args.seconds,
+            'read_errors': sum(1 for _, ok in latencies if not ok),
+            'p50': percentile(times, 0.5), 'p95': percentile(times, 0.95), 'p99': percentile(times, 0.99),
+            'checked': sum(1 for status in statuses if status == 200) / args.seconds,
+            'rejected': sum(1 for status in statuses if status in (429, 503)) / args.seconds,
+        })
+    store.passwords.pool.shutdown()
+    results.put((config, rows))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--flooders', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=8)
+    parser.add_argument('--only', choices=sorted(CONFIGS))
+    args = parser.parse_args()
+
+    print(f'flooders={args.flooders} readers={args.readers} seconds={args.seconds:g} cpus={os.cpu_count()}')
+    print(f'{"config":>10} {"phase":>5} {"reads/s":>8} {"r err":>5} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"checked/s":>9} {"shed/s":>7}')
+    context = multiprocessing.get_context('spawn')
+    for config in CONFIGS:
+        if args.only not in (None, config):
+            continue
+        results = context.Queue()
+        process = context.Process(target=run, args=(config, args, results))
+        process.start()
+        _, rows = results.get()
+        process.join()
+        for row in rows:
+            print(f'{config:>10} {row["phase"]:>5} {row["reads"]:8.1f} {row["read_errors"]:5d} '
+                  f'{row["p50"] * 1000:8.2f} {row["p95"] * 1000:8.2f} {row["p99"] * 1000:8.2f} '
+                  f'{row["checked"]:9.1f} {row["rejected"]:7.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# Read latency under concurrent checkouts, with and without the SQLite
+# tuning in sqlite_engine.py. Writer processes loop add_to_cart + checkout
+# while reader processes fetch order history and search results; each
+# configuration gets a fresh database.
+#
+#   python benchmarks/read_write_contention.py --writers 4 --readers 4 --seconds 10
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'contention-pass'
+PRODUCTS = 200
+
+def _load_app(db_path, tuned):
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['SQLITE_TUNING'] = '1' if tuned else '0'
+    os.environ['JOB_WORKERS'] = '0'
+    import app as store
+    return store
+
+def setup(db_path, tuned, users):
+    store = _load_app(db_path, tuned)
+    from werkzeug.security import generate_password_hash
+    from database import db, User, Product, Category
+    password = generate_password_hash(PASSWORD)
+    with store.app.app_context():
+        db.create_all()
+        store.search.create_search_index()
+        db.session.add(Category(id=1, name='Bench'))
+        for i in range(PRODUCTS):
+            db.session.add(Product(name=f'Bench Aviator {i}', description='Benchmark frame',
+                                   price=10.0 + i, brand='Bench', style='Aviator',
+                                   stock_quantity=10 ** 9, category_id=1))
+        for i in range(users):
+            db.session.add(User(username=f'bench{i}', email=f'bench{i}@example.com',
+                                password=password, first_name='Bench', last_name=str(i)))
+        db.session.commit()
+
+def _client(store, user):
+    client = store.app.test_client()
+    client.post('/login', data={'email': f'bench{user}@example.com', 'password': PASSWORD})
+    return client
+
+def writer(db_path, tuned, user, start_at, seconds, results):
+    store = _load_app(db_path, tuned)
+    client = _client(store, user)
+    placed = errors = 0
+    time.sleep(max(0, start_at - time.time()))
+    deadline = start_at + seconds
+    product = 1 + user
+    while time.time() < deadline:
+        try:
+            client.post(f'/add_to_cart/{product}', data={'quantity': 1})
+            response = client.post('/checkout', data={'payment_method': 'card',
+                                                      'shipping_address': 'Bench street'})
+            if response.status_code == 302 and response.headers['Location'].endswith('/orders'):
+                placed += 1
+            else:
+                errors += 1
+        except Exception:
+            errors += 1
+        product = 1 + (product % PRODUCTS)
+    results.put(('writer', placed, errors, []))
+
+def reader(db_path, tuned, user, start_at, seconds, results):
+    store = _load_app(db_path, tuned)
+    client = _client(store, user)
+    urls = ['/orders', '/products?q=aviator', '/bookings']
+    latencies = []
+    errors = 0
+    time.sleep(max(0, start_at - time.time()))
+    deadline = start_at + seconds
+    i = 0
+    while time.time() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            status = client.get(url).status_code
+        except Exception:
+            status = None
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            errors += 1
+    results.put(('reader', len(latencies), errors, latencies))
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def run(tuned, args):
+    context = multiprocessing.get_context('spawn')
+    db_path = os.path.join(tempfile.mkdtemp(prefix='contention_'), 'bench.db')
+    users = args.writers + args.readers
+    setup_process = context.Process(target=setup, args=(db_path, tuned, users))
+    setup_process.start()
+    setup_process.join()
+
+    results = context.Queue()
+    start_at = time.time() + args.warmup
+    processes = [context.Process(target=writer, args=(db_path, tuned, i, start_at, args.seconds, results))
+                 for i in range(args.writers)]
+    processes += [context.Process(target=reader, args=(db_path, tuned, args.writers + i, start_at, args.seconds, results))
+                  for i in range(args.readers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    orders = sum(count for role, count, _, _ in collected if role == 'writer')
+    write_errors = sum(errors for role, _, errors, _ in collected if role == 'writer')
+    latencies = [value for role, _, _, values in collected if role == 'reader' for value in values]
+    read_errors = sum(errors for role, _, errors, _ in collected if role == 'reader')
+    label = 'tuned' if tuned else 'stock'
+    print(f'{label:>6} {orders / args.seconds:9.1f} {write_errors:6d} {len(latencies) / args.seconds:9.1f} '
+          f'{read_errors:6d} {percentile(latencies, 0.5) * 1000:8.2f} {percentile(latencies, 0.95) * 1000:8.2f} '
+          f'{percentile(latencies, 0.99) * 1000:8.2f} {max(latencies, default=0) * 1000:8.2f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=3, help='seconds allowed for workers to log in')
+    parser.add_argument('--only', choices=['stock', 'tuned'])
+    args = parser.parse_args()
+
+    print(f'writers={args.writers} readers={args.readers} seconds={args.seconds:g}')
+    print(f'{"config":>6} {"orders/s":>9} {"w err":>6} {"reads/s":>9} {"r err":>6} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for tuned in (False, True):
+        if args.only in (None, 'tuned' if tuned else 'stock'):
+            run(tuned, args)
+
+if __name__ == '__main__':
+    main()
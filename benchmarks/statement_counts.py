@@ -0,0 +1,141 @@
+# Statement-count regression check for the admin and account listing
+# pages. Seeds a fresh database with N orders/bookings (half of them old
+# enough to be archived), counts the SQL statements each page issues, grows
+# the data to 10N and counts again. Every page must issue the same number
+# of statements at both sizes, and no more than MAX_STATEMENTS: a listing
+# that lazy-loads per row (an N+1) shows up as a count that grows with the
+# data. Exits 1 on any failure.
+#
+#   python benchmarks/statement_counts.py --orders 200
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MAX_STATEMENTS = 12
+PRODUCTS = 50
+LINES = 3
+
+PAGES = (
+    '/orders',
+    '/orders?sort=oldest',
+    '/orders?archived=1',
+    '/bookings',
+    '/bookings?archived=1',
+    '/cart',
+    '/profile',
+    '/admin/dashboard',
+    '/admin/orders',
+    '/admin/orders?sort=oldest',
+    '/admin/users',
+    '/admin/bookings',
+    '/admin/products',
+)
+
+def seed(db, models, start, count, rng):
+    User, Order, OrderItem, Booking, BookingItem, CartItem = models
+    now = datetime.utcnow()
+    users = range(start // 2 + 2, (start + count) // 2 + 2)
+    db.session.execute(User.__table__.insert(), [
+        {'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@bench.example', 'password': 'x',
+         'first_name': 'Bench', 'last_name': f'User {user_id}'} for user_id in users])
+    orders, order_lines, bookings, booking_lines = [], [], [], []
+    for number in range(start + 1, start + count + 1):
+        # Every other row belongs to the admin, whose account pages are checked.
+        user_id = 1 if number % 2 else rng.choice(users)
+        old = number % 4 < 2  # half are finished and older than the archive age
+        created = now - timedelta(days=rng.randint(400, 700) if old else rng.randint(0, 300))
+        orders.append({'id': number, 'order_number': f'ORD{number:08d}', 'total_amount': 100.0,
+                       'status': 'delivered' if old else 'pending', 'payment_method': 'card',
+                       'shipping_address': 'Bench street', 'created_at': created, 'user_id': user_id})
+        bookings.append({'id': number, 'booking_number': f'BKG{number:08d}', 'total_amount': 50.0,
+                         'status': 'collected' if old else 'reserved', 'pickup_date': created + timedelta(days=3),
+                         'created_at': created, 'user_id': user_id})
+        for product_id in rng.sample(range(1, PRODUCTS + 1), LINES):
+            order_lines.append({'order_id': number, 'product_id': product_id, 'quantity': 1, 'price': 100.0 / LINES})
+        booking_lines.append({'booking_id': number, 'product_id': rng.randint(1, PRODUCTS), 'quantity': 1,
+                              'price': 50.0})
+    for model, rows in ((Order, orders), (OrderItem, order_lines), (Booking, bookings), (BookingItem, booking_lines)):
+        db.session.execute(model.__table__.insert(), rows)
+    db.session.commit()
+
+def count_statements(app, db, admin_id):
+    counts = {}
+    statements = [0]
+
+    def count(*_):
+        statements[0] += 1
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for path in PAGES:
+            client.get(path)  # warm the process caches
+            statements[0] = 0
+            status = client.get(path).status_code
+            counts[path] = statements[0] if status == 200 else f'HTTP {status}'
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', count)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=200, help='N; the second pass has 10N.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='statement_counts_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['JOB_WORKERS'] = '0'
+    os.environ['MAINTENANCE_HOUR'] = 'off'
+
+    import app as store
+    import maintenance
+    import stats
+    from database import db, User, Category, Product, CartItem, Order, OrderItem, Booking, BookingItem
+
+    rng = random.Random(args.seed)
+    models = (User, Order, OrderItem, Booking, BookingItem, CartItem)
+    with store.app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, username='admin', email='admin@bench.example', password='x',
+                            first_name='Bench', last_name='Admin', is_admin=True))
+        db.session.add(Category(id=1, name='Bench'))
+        db.session.add_all(Product(id=i, name=f'Bench Frame {i}', price=10.0 + i, brand='Bench',
+                                   stock_quantity=i % 8, category_id=1) for i in range(1, PRODUCTS + 1))
+        db.session.add_all(CartItem(user_id=1, product_id=i, quantity=1) for i in range(1, 6))
+        db.session.commit()
+
+        results = []
+        seeded = 0
+        for total in (args.orders, 10 * args.orders):
+            seed(db, models, seeded, total - seeded, rng)
+            seeded = total
+            maintenance.archive()
+            stats.rebuild()
+            results.append(count_statements(store.app, db, 1))
+
+    failures = 0
+    print(f'{"page":<28} {args.orders:>8} {10 * args.orders:>8}')
+    for path in PAGES:
+        small, large = results[0][path], results[1][path]
+        ok = isinstance(small, int) and small == large and small <= MAX_STATEMENTS
+        failures += not ok
+        print(f'{path:<28} {small:>8} {large:>8}' + ('' if ok else '  FAIL'))
+    print(f'{len(PAGES)} pages, {failures} failure(s) (bound: {MAX_STATEMENTS} statements)')
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Concurrent checkout stress test: many logged-in clients race to buy the
+# same product through /add_to_cart and /checkout, then the database is
+# checked for oversell.
+#
+#   python benchmarks/stock_stress.py --threads 16 --stock 500
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--stock', type=int, default=300)
+    parser.add_argument('--attempts', type=int, default=100, help='checkouts per thread')
+    parser.add_argument('--max-quantity', type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stock_stress_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'stress.db')
+
+    from werkzeug.security import generate_password_hash
+    import app as store
+    from database import db, User, Product, Category, OrderItem
+
+    password = generate_password_hash('stress-pass')
+    with store.app.app_context():
+        db.create_all()
+        db.session.add(Category(id=1, name='Stress'))
+        db.session.add(Product(id=1, name='Contended', price=10.0, brand='Bench',
+                               stock_quantity=args.stock, category_id=1))
+        for i in range(args.threads):
+            db.session.add(User(username=f'stress{i}', email=f'stress{i}@example.com',
+                                password=password, first_name='Stress', last_name=str(i)))
+        db.session.commit()
+
+    outcomes = {'placed': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.threads)
+
+    def worker(i):
+        client = store.app.test_client()
+        client.post('/login', data={'email': f'stress{i}@example.com', 'password': 'stress-pass'})
+        start_gate.wait()
+        for _ in range(args.attempts):
+            quantity = random.randint(1, args.max_quantity)
+            try:
+                client.post('/add_to_cart/1', data={'quantity': quantity})
+                response = client.post('/checkout', data={'payment_method': 'card',
+                                                          'shipping_address': 'Bench street'})
+                if response.status_code == 302 and response.headers['Location'].endswith('/orders'):
+                    outcome = 'placed'
+                elif response.status_code == 302:
+                    outcome = 'rejected'
+                else:
+                    outcome = 'errors'
+            except Exception:
+                outcome = 'errors'
+            with lock:
+                outcomes[outcome] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with store.app.app_context():
+        remaining = db.session.get(Product, 1).stock_quantity
+        sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)).scalar()
+
+    print(f'threads={args.threads} attempts={args.threads * args.attempts} elapsed={elapsed:.2f}s')
+    print(f'orders placed={outcomes["placed"]} rejected={outcomes["rejected"]} errors={outcomes["errors"]}')
+    print(f'throughput={outcomes["placed"] / elapsed:.1f} orders/s')
+    print(f'initial stock={args.stock} sold={sold} remaining={remaining}')
+    oversold = remaining < 0 or sold + remaining != args.stock
+    print('OVERSOLD' if oversold else 'no oversell')
+    return 1 if oversold else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Template render micro-benchmark: the product grid (products.html) with
+# 50 and 500 cards, rendered with the fragment cache off, on but cold (every
+# card rendered and stored) and warm (every card served from the cache);
+# then the time a fresh Jinja environment takes to load every template
+# without and with the on-disk bytecode cache.
+#
+#   python benchmarks/template_render.py --repeat 20
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def timed(render, repeat, before=None):
+    timings = []
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        render()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.mean(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--sizes', default='50,500')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    workdir = tempfile.mkdtemp(prefix='template_bench_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['TEMPLATE_CACHE_DIR'] = os.path.join(workdir, 'jinja_cache')
+    os.environ['JOB_WORKERS'] = '0'
+
+    import app as store
+    import facets
+    import fragments
+    from flask import render_template
+    from jinja2 import Environment, FileSystemBytecodeCache
+    from database import db, Product, Category
+    from pagination import paginate, PRODUCT_SORTS
+
+    with store.app.app_context():
+        db.create_all()
+        db.session.add(Category(id=1, name='Bench'))
+        db.session.add_all(Product(id=i, name=f'Bench Frame {i}', price=50.0 + i, brand='Bench',
+                                   style='Aviator', color='Black', stock_quantity=i % 20,
+                                   description='Lightweight frame with polarized lenses. ' * 4,
+                                   category_id=1, is_active=True)
+                           for i in range(1, max(sizes) + 1))
+        db.session.commit()
+
+    print(f'{"cards":>6} {"fragment cache":>15} {"mean ms":>8} {"p95 ms":>8}')
+    for size in sizes:
+        with store.app.test_request_context('/products'):
+            # The pager comes from a normal page; the grid gets `size` cards.
+            page = paginate(Product.query.filter_by(is_active=True), PRODUCT_SORTS)
+            products = Product.query.order_by(Product.id).limit(size).all()
+            facet_result = facets.facet_index.search({})
+
+            def render():
+                render_template('products.html', products=products, page=page, q='', total=size,
+                                facet_counts=facet_result.counts, categories=[])
+
+            store.app.config['FRAGMENT_CACHE'] = False
+            render()  # compile outside the timings
+            results = {'off': timed(render, args.repeat)}
+            store.app.config['FRAGMENT_CACHE'] = True
+            results['cold'] = timed(render, args.repeat, before=fragments.clear)
+            results['warm'] = timed(render, args.repeat)
+            for mode, (mean, p95) in results.items():
+                print(f'{size:>6} {mode:>15} {mean:>8.2f} {p95:>8.2f}')
+
+    # Template loading in a fresh process, approximated by a fresh environment.
+    loader = store.app.jinja_env.loader
+    names = store.app.jinja_env.list_templates(extensions=('html',))
+    cache_dir = os.path.join(workdir, 'bench_bytecode')
+    os.makedirs(cache_dir)
+
+    def load_all(bytecode_cache):
+        environment = Environment(loader=loader, bytecode_cache=bytecode_cache)
+        environment.globals.update(store.app.jinja_env.globals)
+        for name in names:
+            environment.get_template(name)
+
+    load_all(FileSystemBytecodeCache(cache_dir))  # fill the cache
+    print(f'\n{len(names)} templates, load time per fresh environment')
+    print(f'{"bytecode cache":>15} {"mean ms":>8} {"p95 ms":>8}')
+    for label, cache in (('off', lambda: None), ('on', lambda: FileSystemBytecodeCache(cache_dir))):
+        mean, p95 = timed(lambda: load_all(cache()), args.repeat)
+        print(f'{label:>15} {mean:>8.2f} {p95:>8.2f}')
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+from datetime import datetime
+from sqlalchemy import and_, delete
+from sqlalchemy.dialects.sqlite import insert
+from database import db, Product, CartItem
+import accounts
+import stock
+
+# Cart changes for the JSON cart API. A request carries a list of
+# operations (add / set / remove, keyed by product id) that are applied
+# together: one read of the touched products joined to this user's cart
+# rows, one upsert for the adds and one for the sets, one DELETE, and the
+# aggregate query that refreshes the navbar summary. The response carries
+# only the touched lines and the new totals, so the cart page never has
+# to re-render.
+
+MAX_OPERATIONS = 50
+SHIPPING = 5.00
+TAX_RATE = 0.1
+
+OPERATIONS = ('add', 'set', 'remove')
+
+class CartError(ValueError):
+    pass
+
+def parse_operations(payload):
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise CartError('operations must be a non-empty list')
+    if len(operations) > MAX_OPERATIONS:
+        raise CartError(f'at most {MAX_OPERATIONS} operations per request')
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise CartError(f'op must be one of {", ".join(OPERATIONS)}')
+        try:
+            product_id = int(operation['product_id'])
+            quantity = int(operation.get('quantity', 1 if operation['op'] == 'add' else 0))
+        except (KeyError, TypeError, ValueError):
+            raise CartError('product_id and quantity must be integers')
+        if operation['op'] == 'add' and quantity < 1:
+            raise CartError('add needs a positive quantity')
+        if quantity < 0:
+            raise CartError('quantity must not be negative')
+        parsed.append((operation['op'], product_id, quantity))
+    return parsed
+
+def totals(subtotal):
+    tax = round(subtotal * TAX_RATE, 2)
+    return {'subtotal': round(subtotal, 2), 'shipping': SHIPPING, 'tax': tax,
+            'total': round(subtotal + SHIPPING + tax, 2)}
+
+@stock.retry_on_busy
+def apply(user_id, operations):
+    product_ids = {product_id for _, product_id, _ in operations}
+    rows = db.session.query(
+        Product.id, Product.name, Product.price, Product.stock_quantity, Product.is_active, CartItem.quantity
+    ).outerjoin(CartItem, and_(CartItem.product_id == Product.id, CartItem.user_id == user_id)).filter(
+        Product.id.in_(product_ids)
+    ).all()
+    products = {row.id: row for row in rows}
+    current = {row.id: row.quantity or 0 for row in rows}
+
+    wanted = dict(current)
+    increments = {}  # product -> amount added, or None once a set/remove makes it absolute
+    errors = {}
+    for op, product_id, quantity in operations:
+        product = products.get(product_id)
+        if product is None:
+            errors[product_id] = 'Product not found'
+            continue
+        if op == 'add':
+            target = wanted[product_id] + quantity
+        elif op == 'set':
+            target = quantity
+        else:
+            target = 0
+        if target > wanted[product_id] and not product.is_active:
+            errors[product_id] = 'Product is no longer available'
+        elif target > product.stock_quantity:
+            errors[product_id] = f'Only {product.stock_quantity} in stock'
+        else:
+            wanted[product_id] = target
+            if op == 'add' and increments.get(product_id, 0) is not None:
+                increments[product_id] = increments.get(product_id, 0) + quantity
+            else:
+                increments[product_id] = None
+            errors.pop(product_id, None)
+
+    # Adds are applied as quantity + n on the current row, so concurrent
+    # adds from the snapshot read above are not lost; sets and removes
+    # write the value asked for.
+    added = [product_id for product_id, amount in increments.items() if amount]
+    changed = {product_id: wanted[product_id] for product_id, amount in increments.items()
+               if amount is None and wanted[product_id] != current[product_id]}
+    upserts = [product_id for product_id, quantity in changed.items() if quantity > 0]
+    removals = [product_id for product_id, quantity in changed.items() if quantity == 0]
+    statement = insert(CartItem.__table__)
+    if added:
+        result = db.session.execute(statement.on_conflict_do_update(
+            index_elements=[CartItem.user_id, CartItem.product_id],
+            set_={'quantity': CartItem.__table__.c.quantity + statement.excluded.quantity}
+        ).returning(CartItem.__table__.c.product_id, CartItem.__table__.c.quantity),
+            [{'user_id': user_id, 'product_id': product_id, 'quantity': increments[product_id],
+              'added_at': datetime.utcnow()} for product_id in added])
+        wanted.update(result.all())
+    if upserts:
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[CartItem.user_id, CartItem.product_id],
+            set_={'quantity': statement.excluded.quantity}
+        ), [{'user_id': user_id, 'product_id': product_id, 'quantity': changed[product_id],
+             'added_at': datetime.utcnow()} for product_id in upserts])
+    if removals:
+        db.session.execute(
+            delete(CartItem).where(CartItem.user_id == user_id, CartItem.product_id.in_(removals))
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+    summary = accounts.refresh_cart_summary(user_id)
+    lines = [{
+        'product_id': product_id,
+        'name': products[product_id].name,
+        'price': products[product_id].price,
+        'quantity': wanted[product_id],
+        'line_total': round(products[product_id].price * wanted[product_id], 2),
+        'max_quantity': products[product_id].stock_quantity,
+    } for product_id in sorted(products)]
+    return {
+        'success': not errors,
+        'lines': lines,
+        'errors': [{'product_id': product_id, 'error': error} for product_id, error in sorted(errors.items())],
+        'cart': dict(totals(summary['subtotal']), count=summary['count']),
+    }
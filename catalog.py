@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+from cache import TTLCache
+from database import db, Product, Category
+import fragments
+
+FEATURED_LIMIT = 8
+
+# Catalog reads for the storefront. Entries are plain snapshots rather than
+# ORM instances so they can outlive the session that loaded them. The admin
+# product routes and stock changes invalidate through the hooks below (which
+# also drop the rendered cards in fragments.py); the TTL bounds staleness in
+# processes that did not see the write.
+catalog_cache = TTLCache(maxsize=4096, ttl=300)
+
+def snapshot(obj):
+    return SimpleNamespace(**{
+        attr.key: getattr(obj, attr.key)
+        for attr in db.inspect(obj).mapper.column_attrs
+    })
+
+def categories():
+    return catalog_cache.get_or_set('categories', lambda: [
+        snapshot(category) for category in Category.query.order_by(Category.id).all()
+    ])
+
+def product_cards(product_ids):
+    cards = {}
+    missing = []
+    for product_id in product_ids:
+        card = catalog_cache.get(('product', product_id))
+        if card is None:
+            missing.append(product_id)
+        else:
+            cards[product_id] = card
+    if missing:
+        for product in Product.query.filter(Product.id.in_(missing)).all():
+            card = snapshot(product)
+            catalog_cache.set(('product', product.id), card)
+            cards[product.id] = card
+    return [cards[product_id] for product_id in product_ids if product_id in cards]
+
+def featured_products(limit=FEATURED_LIMIT):
+    # Only the ids are cached here, so a stock change on one product just
+    # drops that product's card and leaves the list alone.
+    ids = catalog_cache.get_or_set(('featured', limit), lambda: [
+        row[0] for row in db.session.query(Product.id).filter_by(is_active=True)
+        .order_by(Product.id).limit(limit).all()
+    ])
+    return product_cards(ids)
+
+def invalidate_products(product_ids):
+    product_ids = list(product_ids)
+    for product_id in product_ids:
+        catalog_cache.delete(('product', product_id))
+    fragments.invalidate_products(product_ids)
+
+def invalidate_catalog():
+    catalog_cache.clear()
+    fragments.clear()
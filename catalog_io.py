@@ -0,0 +1,313 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert
+from werkzeug.utils import secure_filename
+from database import db, Product, Category
+import catalog
+import facets
+import http_cache
+import jobs
+import stats
+
+# Bulk catalog import and export keyed by product SKU.
+#
+# Input is read one record at a time from CSV or JSONL and applied in
+# batches of BATCH_SIZE rows, each batch in its own transaction: one SELECT
+# finds which SKUs exist, new products go in with one executemany
+# INSERT ... ON CONFLICT(sku) DO UPDATE, and existing ones are updated
+# with one executemany UPDATE per distinct set of columns. Memory use is
+# bounded by the batch size however long the file is. A row for an
+# existing SKU may carry any subset of columns, so a supplier stock feed
+# is just `sku,stock_quantity`.
+#
+# Export walks the table by primary key in chunks and yields text, so the
+# admin endpoint can stream it.
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+FIELDS = ('sku', 'name', 'description', 'price', 'discount_price', 'brand', 'style', 'color',
+          'frame_material', 'lens_type', 'uv_protection', 'polarization', 'stock_quantity',
+          'is_active', 'category', 'image')
+REQUIRED_FOR_NEW = ('name', 'price', 'brand', 'category')
+FLOAT_FIELDS = ('price', 'discount_price')
+BOOL_FIELDS = ('uv_protection', 'polarization', 'is_active')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+
+class RowError(ValueError):
+    pass
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'errors': self.errors,
+        }
+
+def detect_format(filename, default='csv'):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension == '.csv':
+        return 'csv'
+    return default
+
+def read_records(stream, fmt):
+    # Yields (line_number, dict) from a text stream without reading it whole.
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                yield line_number, RowError(f'invalid JSON: {error}')
+                continue
+            yield line_number, record if isinstance(record, dict) else RowError('expected a JSON object')
+    else:
+        raise ValueError(f'Unknown catalog format {fmt!r}')
+
+def _clean(record):
+    # Normalize one input record to Product column values; blank cells mean
+    # "leave unchanged" rather than "clear".
+    values = {}
+    for field in FIELDS:
+        raw = record.get(field)
+        if raw is None or (isinstance(raw, str) and not raw.strip()):
+            continue
+        if isinstance(raw, str):
+            raw = raw.strip()
+        try:
+            if field in FLOAT_FIELDS:
+                values[field] = round(float(raw), 2)
+                if values[field] < 0:
+                    raise RowError(f'{field} must not be negative')
+            elif field == 'stock_quantity':
+                values[field] = int(raw)
+                if values[field] < 0:
+                    raise RowError('stock_quantity must not be negative')
+            elif field in BOOL_FIELDS:
+                if isinstance(raw, bool):
+                    values[field] = raw
+                elif str(raw).lower() in TRUE_VALUES:
+                    values[field] = True
+                elif str(raw).lower() in FALSE_VALUES:
+                    values[field] = False
+                else:
+                    raise RowError(f'{field} must be true or false')
+            else:
+                values[field] = str(raw)
+        except (TypeError, ValueError) as error:
+            if isinstance(error, RowError):
+                raise
+            raise RowError(f'invalid {field}: {raw!r}')
+    if not values.get('sku'):
+        raise RowError('sku is required')
+    if len(values['sku']) > 64:
+        raise RowError('sku is longer than 64 characters')
+    return values
+
+class _Resolver:
+    # Category names and image files seen during one import.
+    def __init__(self, upload_folder, image_dir):
+        self.upload_folder = upload_folder
+        self.image_dir = image_dir
+        self.categories = {name.lower(): category_id for category_id, name in
+                           db.session.query(Category.id, Category.name).all()}
+        self.category_ids = set(self.categories.values())
+        self.images = {}
+
+    def category(self, value):
+        if str(value).isdigit() and int(value) in self.category_ids:
+            return int(value)
+        key = str(value).strip().lower()
+        if key not in self.categories:
+            category = Category(name=str(value).strip())
+            db.session.add(category)
+            db.session.flush()
+            self.categories[key] = category.id
+            self.category_ids.add(category.id)
+        return self.categories[key]
+
+    def image(self, name):
+        # Copy the file into the upload folder under a content-hash name so
+        # re-imports of the same picture are free, and queue its variants.
+        # A name that is already in the upload folder (as in an export) is
+        # kept as it is.
+        if name in self.images:
+            return self.images[name]
+        source = os.path.join(self.image_dir, name) if self.image_dir else None
+        if not source or not os.path.isfile(source):
+            if name == os.path.basename(name) and os.path.isfile(os.path.join(self.upload_folder, name)):
+                self.images[name] = name
+                return name
+            if not self.image_dir:
+                raise RowError(f'image {name!r} is not in the upload folder and no image directory is configured')
+        if os.path.commonpath([os.path.abspath(source), os.path.abspath(self.image_dir)]) != os.path.abspath(self.image_dir):
+            raise RowError(f'image {name!r} is outside the image directory')
+        if not os.path.isfile(source):
+            raise RowError(f'image {name!r} not found')
+        digest = hashlib.sha256()
+        with open(source, 'rb') as handle:
+            for block in iter(lambda: handle.read(1 << 16), b''):
+                digest.update(block)
+        filename = f'{digest.hexdigest()[:16]}_{secure_filename(os.path.basename(name))}'
+        target = os.path.join(self.upload_folder, filename)
+        if not os.path.exists(target):
+            shutil.copyfile(source, target)
+            jobs.enqueue('image_variants', filename=filename)
+        self.images[name] = filename
+        return filename
+
+def _apply_batch(batch, resolver, report):
+    skus = [values['sku'] for _, values in batch]
+    existing = dict(db.session.execute(
+        select(Product.sku, Product.id).where(Product.sku.in_(skus))
+    ).all())
+
+    inserts = {}
+    updates = {}
+    seen = {}
+    for line, values in batch:
+        try:
+            if 'category' in values:
+                values['category_id'] = resolver.category(values.pop('category'))
+            if 'image' in values:
+                values['image_url'] = resolver.image(values.pop('image'))
+            if values['sku'] not in existing and values['sku'] not in seen:
+                missing = [field for field in REQUIRED_FOR_NEW
+                           if field not in values and not (field == 'category' and 'category_id' in values)]
+                if missing:
+                    raise RowError(f'new product is missing {", ".join(missing)}')
+        except RowError as error:
+            report.error(line, str(error))
+            continue
+        # A SKU repeated within the batch: later rows win, merged over earlier ones.
+        merged = dict(seen.get(values['sku'], {}), **values)
+        seen[values['sku']] = merged
+
+    for sku, values in seen.items():
+        target = updates if sku in existing else inserts
+        target.setdefault(tuple(sorted(values)), []).append(values)
+
+    # Core statements on the table: executemany without the ORM's
+    # per-row bookkeeping.
+    table = Product.__table__
+    for columns, rows in inserts.items():
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.sku],
+            set_={column: statement.excluded[column] for column in columns if column != 'sku'}
+        )
+        db.session.execute(statement, rows)
+        report.created += len(rows)
+    for columns, rows in updates.items():
+        db.session.execute(
+            update(table).where(table.c.sku == db.bindparam('match_sku'))
+            .values({column: db.bindparam(column) for column in columns if column != 'sku'}),
+            [dict(row, match_sku=row['sku']) for row in rows]
+        )
+        report.updated += len(rows)
+
+    if inserts:
+        stats.increment('products', sum(len(rows) for rows in inserts.values()))
+    if seen:
+        http_cache.catalog_changed()
+    db.session.commit()
+    catalog.invalidate_products(existing[sku] for sku in seen if sku in existing)
+
+def import_products(stream, fmt, upload_folder, image_dir=None, batch_size=BATCH_SIZE):
+    report = ImportReport()
+    resolver = _Resolver(upload_folder, image_dir)
+    batch = []
+    for line, record in read_records(stream, fmt):
+        report.rows += 1
+        try:
+            if isinstance(record, RowError):
+                raise record
+            batch.append((line, _clean(record)))
+        except RowError as error:
+            report.error(line, str(error))
+        if len(batch) >= batch_size:
+            _apply_batch(batch, resolver, report)
+            batch = []
+    if batch:
+        _apply_batch(batch, resolver, report)
+    # New products change listings, categories and facet counts.
+    catalog.invalidate_catalog()
+    facets.facet_index.invalidate()
+    return report.finish()
+
+EXPORT_COLUMNS = ('sku', 'name', 'description', 'price', 'discount_price', 'brand', 'style', 'color',
+                  'frame_material', 'lens_type', 'uv_protection', 'polarization', 'stock_quantity',
+                  'is_active', 'category', 'image')
+
+def export_rows(chunk_size=BATCH_SIZE):
+    # Keyset walk over the primary key: each chunk is an index range read.
+    columns = [getattr(Product, column) for column in EXPORT_COLUMNS if column not in ('category', 'image')]
+    query = select(Product.id, *columns, Category.name.label('category'), Product.image_url.label('image')) \
+        .join(Category, Product.category_id == Category.id).order_by(Product.id).limit(chunk_size)
+    last_id = 0
+    while True:
+        rows = db.session.execute(query.where(Product.id > last_id)).all()
+        if not rows:
+            return
+        for row in rows:
+            yield {column: getattr(row, column) for column in EXPORT_COLUMNS}
+        last_id = rows[-1].id
+        db.session.rollback()  # release the read snapshot between chunks
+
+def export_products(fmt, chunk_size=BATCH_SIZE):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        yield buffer.getvalue()
+        for row in export_rows(chunk_size):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow({key: '' if value is None else value for key, value in row.items()})
+            yield buffer.getvalue()
+    elif fmt == 'jsonl':
+        for row in export_rows(chunk_size):
+            yield json.dumps(row) + '\n'
+    else:
+        raise ValueError(f'Unknown catalog format {fmt!r}')
@@ -2,8 +2,11 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
 import json
+from sqlalchemy import event, select
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlite_engine import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -31,6 +34,7 @@ class Category(db.Model):
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(64))  # supplier key for bulk import (see catalog_io.py)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     price = db.Column(db.Float, nullable=False)
@@ -54,6 +58,45 @@ class Product(db.Model):
     booking_items = db.relationship('BookingItem', backref='product', lazy=True)
     cart_items = db.relationship('CartItem', backref='product', lazy=True)
 
+    # Keyset pagination sort keys
+    __table_args__ = (
+        db.Index('ix_product_price_id', 'price', 'id'),
+        db.Index('ix_product_name_id', 'name', 'id'),
+        # Low-stock range scan for the dashboard
+        db.Index('ix_product_stock_quantity', 'stock_quantity'),
+        # Storefront listings: active products in each sort order
+        db.Index('ix_product_active_id', 'is_active', 'id'),
+        db.Index('ix_product_active_price_id', 'is_active', 'price', 'id'),
+        db.Index('ix_product_active_name_id', 'is_active', 'name', 'id'),
+        # Category filter and related products
+        db.Index('ix_product_category_active_id', 'category_id', 'is_active', 'id'),
+        # Bulk import upserts by SKU
+        db.Index('uq_product_sku', 'sku', unique=True),
+    )
+
+DEFAULT_SKU_FORMAT = 'SKU%06d'  # printf-style, shared with the SQL backfill in migrations.py
+
+def free_sku(connection, product_id):
+    # The id-based SKU, or the first free '-2', '-3'... variant of it when
+    # an imported product already uses it.
+    table = Product.__table__
+    base = sku = DEFAULT_SKU_FORMAT % product_id
+    suffix = 1
+    while connection.execute(select(table.c.id).where(table.c.sku == sku)).first() is not None:
+        suffix += 1
+        sku = f'{base}-{suffix}'
+    return sku
+
+@event.listens_for(Product, 'after_insert')
+def _default_sku(mapper, connection, target):
+    # Products added by hand get an id-based SKU, so an exported catalog
+    # can be imported again.
+    if not target.sku:
+        sku = free_sku(connection, target.id)
+        connection.execute(mapper.local_table.update()
+                           .where(mapper.local_table.c.id == target.id).values(sku=sku))
+        set_committed_value(target, 'sku', sku)
+
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     quantity = db.Column(db.Integer, default=1)
@@ -62,6 +105,14 @@ class CartItem(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
 
+    __table_args__ = (
+        # One row per product in a cart; also serves the per-user cart scan
+        db.Index('uq_cart_item_user_product', 'user_id', 'product_id', unique=True),
+        db.Index('ix_cart_item_product_id', 'product_id'),
+        # Stale cart sweep (see maintenance.py)
+        db.Index('ix_cart_item_added_at', 'added_at'),
+    )
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -77,6 +128,12 @@ class Order(db.Model):
     
     order_items = db.relationship('OrderItem', backref='order', lazy=True)
 
+    # Keyset pagination sort keys
+    __table_args__ = (
+        db.Index('ix_order_created_at_id', 'created_at', 'id'),
+        db.Index('ix_order_user_created_at_id', 'user_id', 'created_at', 'id'),
+    )
+
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     quantity = db.Column(db.Integer, nullable=False)
@@ -85,6 +142,11 @@ class OrderItem(db.Model):
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_order_item_order_id', 'order_id'),
+        db.Index('ix_order_item_product_id', 'product_id'),
+    )
+
 class Booking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     booking_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -98,10 +160,153 @@ class Booking(db.Model):
     
     booking_items = db.relationship('BookingItem', backref='booking', lazy=True)
 
+    # Keyset pagination sort keys
+    __table_args__ = (
+        db.Index('ix_booking_created_at_id', 'created_at', 'id'),
+        db.Index('ix_booking_user_created_at_id', 'user_id', 'created_at', 'id'),
+        # Expiry sweep over reserved bookings
+        db.Index('ix_booking_status_pickup_date', 'status', 'pickup_date'),
+    )
+
 class BookingItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
     
     booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
\ No newline at end of file
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_booking_item_booking_id', 'booking_id'),
+        db.Index('ix_booking_item_product_id', 'product_id'),
+    )
+
+# Completed orders and bookings older than the archive age are moved here
+# by maintenance.py, keeping their ids, so the hot tables stay small.
+# Customers still see them under "Archived" in their order/booking history.
+
+class ArchivedOrder(db.Model):
+    __tablename__ = 'order_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_number = db.Column(db.String(50), nullable=False)
+    total_amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50))
+    payment_method = db.Column(db.String(50), nullable=False)
+    payment_status = db.Column(db.String(50))
+    shipping_address = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    order_items = db.relationship('ArchivedOrderItem', backref='order', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_order_archive_user_created_at_id', 'user_id', 'created_at', 'id'),
+        db.Index('ix_order_archive_created_at_id', 'created_at', 'id'),
+    )
+
+class ArchivedOrderItem(db.Model):
+    __tablename__ = 'order_item_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+
+    order_id = db.Column(db.Integer, db.ForeignKey('order_archive.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_order_item_archive_order_id', 'order_id'),
+        db.Index('ix_order_item_archive_product_id', 'product_id'),
+    )
+
+class ArchivedBooking(db.Model):
+    __tablename__ = 'booking_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    booking_number = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(50))
+    pickup_date = db.Column(db.DateTime)
+    total_amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    booking_items = db.relationship('ArchivedBookingItem', backref='booking', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_booking_archive_user_created_at_id', 'user_id', 'created_at', 'id'),
+        db.Index('ix_booking_archive_created_at_id', 'created_at', 'id'),
+    )
+
+class ArchivedBookingItem(db.Model):
+    __tablename__ = 'booking_item_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking_archive.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_booking_item_archive_booking_id', 'booking_id'),
+        db.Index('ix_booking_item_archive_product_id', 'product_id'),
+    )
+
+class StoreStat(db.Model):
+    # Running totals maintained by the routes that change them (see stats.py)
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
+
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class ProductNeighbor(db.Model):
+    # Precomputed "related products" lists (see recommendations.py); the
+    # clustered (product_id, rank) key makes one product's list one range read
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    neighbor_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class Job(db.Model):
+    # Deferred work picked up by the background workers (see jobs.py)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    last_error = db.Column(db.Text)
+    worker = db.Column(db.String(100))
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Claim scan: oldest runnable job first
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+class MaintenanceRun(db.Model):
+    # One row per maintenance pass; `report` is the JSON summary
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    seconds = db.Column(db.Float, nullable=False, default=0)
+    report = db.Column(db.Text, nullable=False, default='{}')
+
+class NewsletterSubscriber(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
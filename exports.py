@@ -0,0 +1,209 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import select, tuple_
+from database import (db, User, Product, Order, OrderItem, Booking, BookingItem, ArchivedOrder, ArchivedOrderItem,
+                      ArchivedBooking, ArchivedBookingItem)
+
+# Streaming exports of orders, bookings (live or archived, see
+# maintenance.py) and users for the admin area and `flask export-data`.
+#
+# Rows are read in keyset chunks of CHUNK_SIZE along (created_at, id), the
+# same index the admin listings page through (users by id), so every chunk
+# is an index range read and a date range only touches its own part of
+# the table. The lines of a chunk's orders or bookings come from one
+# SELECT ... IN, and the read snapshot is released between chunks. Each
+# chunk is formatted and handed to the response as one piece of text, so
+# memory stays at one chunk however many rows there are, and the header
+# (or the gzip header) is sent before the first query runs.
+#
+# Rows stay Core tuples end to end: CSV goes through csv.writer.writerows
+# with one row per order/booking line and the order columns repeated;
+# JSONL has one object per order/booking with its lines nested.
+
+CHUNK_SIZE = 1000
+FORMATS = ('csv', 'jsonl')
+GZIP_LEVEL = 6
+
+class ExportError(ValueError):
+    pass
+
+def _lines(item, parent_key):
+    def lines(parent_ids):
+        parent = getattr(item, parent_key)
+        return select(
+            parent.label('parent_id'), item.product_id, Product.name.label('product_name'), item.quantity, item.price
+        ).join(Product, item.product_id == Product.id).where(parent.in_(parent_ids)).order_by(parent, item.id)
+    return lines
+
+LINE_COLUMNS = ('product_id', 'product_name', 'quantity', 'price')
+
+class Dataset:
+    def __init__(self, model, columns, statuses=(), lines=None, keyset=('created_at', 'id')):
+        self.model = model
+        self.columns = columns
+        self.statuses = statuses
+        self.lines = lines
+        self.keyset = keyset
+
+    def select(self):
+        return select(self.model.id, *(column.label(name) for name, column in self.columns))
+
+    @property
+    def fieldnames(self):
+        names = ['id'] + [name for name, _ in self.columns]
+        return names + list(LINE_COLUMNS) if self.lines else names
+
+ORDER_STATUSES = ('pending', 'confirmed', 'shipped', 'delivered', 'cancelled')
+BOOKING_STATUSES = ('reserved', 'confirmed', 'collected', 'expired', 'cancelled')
+
+def _orders(model, item, statuses):
+    return Dataset(model, (
+        ('order_number', model.order_number),
+        ('created_at', model.created_at),
+        ('status', model.status),
+        ('payment_method', model.payment_method),
+        ('payment_status', model.payment_status),
+        ('total_amount', model.total_amount),
+        ('customer_email', User.email),
+        ('shipping_address', model.shipping_address),
+    ), statuses=statuses, lines=_lines(item, 'order_id'))
+
+def _bookings(model, item, statuses):
+    return Dataset(model, (
+        ('booking_number', model.booking_number),
+        ('created_at', model.created_at),
+        ('status', model.status),
+        ('pickup_date', model.pickup_date),
+        ('total_amount', model.total_amount),
+        ('customer_email', User.email),
+    ), statuses=statuses, lines=_lines(item, 'booking_id'))
+
+DATASETS = {
+    'orders': _orders(Order, OrderItem, ORDER_STATUSES),
+    'bookings': _bookings(Booking, BookingItem, BOOKING_STATUSES),
+    # Only finished orders/bookings are archived
+    'archived_orders': _orders(ArchivedOrder, ArchivedOrderItem, ('delivered', 'cancelled')),
+    'archived_bookings': _bookings(ArchivedBooking, ArchivedBookingItem, ('collected', 'expired', 'cancelled')),
+    'users': Dataset(User, (
+        ('username', User.username),
+        ('email', User.email),
+        ('first_name', User.first_name),
+        ('last_name', User.last_name),
+        ('phone', User.phone),
+        ('address', User.address),
+        ('is_admin', User.is_admin),
+        ('created_at', User.created_at),
+    ), keyset=('id',)),  # user.created_at is not indexed; ids follow sign-up order
+}
+
+def parse_filters(dataset, since=None, until=None, status=None):
+    # Validate user-supplied filters; dates are inclusive YYYY-MM-DD days.
+    if dataset not in DATASETS:
+        raise ExportError(f'dataset must be one of {", ".join(DATASETS)}')
+    days = []
+    for value in (since, until):
+        if isinstance(value, str) and value:
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ExportError(f'invalid date {value!r}; use YYYY-MM-DD')
+        days.append(value or None)
+    if status and status not in DATASETS[dataset].statuses:
+        raise ExportError(f'status for {dataset} must be one of {", ".join(DATASETS[dataset].statuses) or "none"}')
+    return {'since': days[0], 'until': days[1], 'status': status or None}
+
+def export_rows(dataset, since=None, until=None, status=None, chunk_size=CHUNK_SIZE):
+    # Yields (rows, lines by parent id) per keyset chunk; rows are plain
+    # tuples in `fieldnames` order, lines tuples in LINE_COLUMNS order.
+    spec = DATASETS[dataset]
+    model = spec.model
+    query = spec.select()
+    if model is not User:
+        query = query.join(User, model.user_id == User.id)
+    if since:
+        query = query.where(model.created_at >= datetime.combine(since, time.min))
+    if until:
+        query = query.where(model.created_at < datetime.combine(until + timedelta(days=1), time.min))
+    if status:
+        query = query.where(model.status == status)
+    columns = [getattr(model, name) for name in spec.keyset]
+    key = tuple_(*columns)
+    query = query.order_by(*columns).limit(chunk_size)
+    positions = [spec.fieldnames.index(name) for name in spec.keyset]
+
+    last = None
+    connection = db.session.connection()
+    while True:
+        rows = connection.execute(query if last is None else query.where(key > tuple_(*last))).fetchall()
+        if not rows:
+            return
+        lines = {}
+        if spec.lines:
+            for line in connection.execute(spec.lines([row[0] for row in rows])):
+                lines.setdefault(line[0], []).append(tuple(line)[1:])
+        last = tuple(rows[-1][position] for position in positions)
+        db.session.rollback()  # release the read snapshot between chunks
+        connection = db.session.connection()
+        yield rows, lines
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _csv_chunks(dataset, chunks):
+    spec = DATASETS[dataset]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(spec.fieldnames)
+    yield buffer.getvalue()
+    empty = ((),)
+    for rows, lines in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        if spec.lines:
+            writer.writerows(tuple(row) + line for row in rows for line in lines.get(row[0], empty))
+        else:
+            writer.writerows(rows)
+        yield buffer.getvalue()
+
+def _jsonl_chunks(dataset, chunks):
+    spec = DATASETS[dataset]
+    names = spec.fieldnames[:len(spec.columns) + 1]
+    for rows, lines in chunks:
+        records = []
+        for row in rows:
+            record = dict(zip(names, map(_value, row)))
+            if spec.lines:
+                record['items'] = [dict(zip(LINE_COLUMNS, line)) for line in lines.get(row[0], ())]
+            records.append(json.dumps(record) + '\n')
+        yield ''.join(records)
+
+def gzipped(chunks, level=GZIP_LEVEL):
+    # Compress text chunks as they come, flushing after each one so the
+    # client receives every chunk (and the gzip header) without waiting.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    yield compressor.flush(zlib.Z_SYNC_FLUSH)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield data
+    yield compressor.flush()
+
+def export(dataset, fmt, since=None, until=None, status=None, gzip=False, chunk_size=CHUNK_SIZE):
+    if fmt not in FORMATS:
+        raise ExportError(f'format must be one of {", ".join(FORMATS)}')
+    chunks = export_rows(dataset, since, until, status, chunk_size)
+    output = _csv_chunks(dataset, chunks) if fmt == 'csv' else _jsonl_chunks(dataset, chunks)
+    return gzipped(output) if gzip else output
+
+def filename(dataset, fmt, since=None, until=None, status=None, gzip=False):
+    parts = [dataset]
+    if status:
+        parts.append(status)
+    if since or until:
+        parts.append(f'{since or "start"}_{until or "now"}')
+    return '-'.join(parts) + f'.{fmt}' + ('.gz' if gzip else '')
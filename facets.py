@@ -0,0 +1,169 @@
+import re
+import threading
+import time
+from database import db, Product
+
+# Facets are kept as bitmaps: a Python int per (facet, value) with bit N set
+# when product N is active and has that value. Filtering is an AND of
+# bitmaps, and a facet count is the popcount of (value bitmap & matches),
+# so every count on the page comes out of one pass in memory.
+
+FACETS = (
+    'category_id', 'brand', 'style', 'color', 'frame_material', 'lens_type',
+    'uv_protection', 'polarization', 'price_bucket',
+)
+
+PRICE_BUCKETS = ((0, 50), (50, 100), (100, 150), (150, 200), (200, 300), (300, None))
+
+BUCKET_RANGES = {
+    (f'{low}+' if high is None else f'{low}-{high}'): (low, high)
+    for low, high in PRICE_BUCKETS
+}
+
+BUCKET_ORDER = {label: position for position, label in enumerate(BUCKET_RANGES)}
+
+FACET_INDEX_TTL = 300
+
+def price_bucket(price):
+    for label, (low, high) in BUCKET_RANGES.items():
+        if high is None or price < high:
+            return label
+
+def _value_order(facet):
+    # Price buckets in price order ('50-100' before '100-150'); the text
+    # facets alphabetically.
+    if facet == 'price_bucket':
+        return lambda item: BUCKET_ORDER[item[0]]
+    return lambda item: str(item[0])
+
+def bitmap_of(ids):
+    bitmap = 0
+    for product_id in ids:
+        bitmap |= 1 << product_id
+    return bitmap
+
+def ids_of(bitmap):
+    return [m.start() for m in re.finditer('1', bin(bitmap)[:1:-1])]
+
+class FacetResult:
+    def __init__(self, matches, counts):
+        self.matches = matches
+        self.counts = counts
+
+    @property
+    def total(self):
+        return self.matches.bit_count()
+
+    @property
+    def product_ids(self):
+        return ids_of(self.matches)
+
+class FacetIndex:
+    def __init__(self, ttl=FACET_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._loaded_at = None
+
+    def _reset(self):
+        self._postings = {facet: {} for facet in FACETS}
+        self._values = {}
+        self._prices = {}
+        self._active = 0
+
+    def _facet_values(self, product):
+        values = {facet: getattr(product, facet) for facet in FACETS if facet != 'price_bucket'}
+        values['uv_protection'] = bool(values['uv_protection'])
+        values['polarization'] = bool(values['polarization'])
+        values['price_bucket'] = price_bucket(product.price)
+        return values
+
+    def _add(self, product):
+        bit = 1 << product.id
+        values = self._facet_values(product)
+        for facet, value in values.items():
+            if value is None:
+                continue
+            postings = self._postings[facet]
+            postings[value] = postings.get(value, 0) | bit
+        self._values[product.id] = values
+        self._prices[product.id] = product.price
+        self._active |= bit
+
+    def _remove(self, product_id):
+        values = self._values.pop(product_id, None)
+        if values is None:
+            return
+        mask = ~(1 << product_id)
+        for facet, value in values.items():
+            postings = self._postings[facet]
+            if value in postings:
+                postings[value] &= mask
+                if not postings[value]:
+                    del postings[value]
+        del self._prices[product_id]
+        self._active &= mask
+
+    def load(self):
+        columns = [getattr(Product, facet) for facet in FACETS if facet != 'price_bucket']
+        rows = db.session.query(Product.id, Product.price, *columns).filter_by(is_active=True).all()
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._add(row)
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.load()
+
+    def update(self, product):
+        # Incremental maintenance from the admin routes: re-file an edited
+        # product, or drop it once it is deactivated.
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._remove(product.id)
+            if product.is_active:
+                self._add(product)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def search(self, filters, restrict_ids=None, min_price=None, max_price=None):
+        self._ensure_loaded()
+        with self._lock:
+            base = self._active
+            if restrict_ids is not None:
+                base &= bitmap_of(restrict_ids)
+            if min_price is not None or max_price is not None:
+                base &= bitmap_of(
+                    product_id for product_id, price in self._prices.items()
+                    if (min_price is None or price >= min_price)
+                    and (max_price is None or price <= max_price)
+                )
+
+            selected = {}
+            for facet, value in filters.items():
+                if facet in self._postings and value is not None:
+                    selected[facet] = self._postings[facet].get(value, 0)
+
+            matches = base
+            for bitmap in selected.values():
+                matches &= bitmap
+
+            # A facet's own selection is left out of its counts, so each
+            # option shows what picking it instead would return.
+            counts = {}
+            for facet, postings in self._postings.items():
+                scope = base
+                for other, bitmap in selected.items():
+                    if other != facet:
+                        scope &= bitmap
+                counts[facet] = {
+                    value: (bitmap & scope).bit_count()
+                    for value, bitmap in sorted(postings.items(), key=_value_order(facet))
+                }
+            return FacetResult(matches, counts)
+
+facet_index = FacetIndex()
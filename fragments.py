@@ -0,0 +1,83 @@
+import os
+from flask import current_app, get_template_attribute
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache
+from cache import TTLCache
+
+# Rendered-HTML cache for markup that repeats across pages: the product
+# cards of the home page, the product grid and the related-products strip
+# (_product_card.html), and the nav menu and footer of base.html
+# (_layout.html). Each fragment is a macro that sees only its arguments,
+# so its output depends on nothing but its cache key.
+#
+# A card is cached per (variant, product id, can-add-to-cart) together
+# with its version: the tuple of product columns the cards display. A
+# stale entry is simply re-rendered when the version it was stored with
+# no longer matches the product being shown, so a price or stock change
+# made by another process is picked up as soon as its page is rendered
+# from fresh rows; the admin routes and stock changes also drop entries
+# through catalog.invalidate_products()/invalidate_catalog().
+#
+# Compiled templates go to a FileSystemBytecodeCache under the instance
+# folder, so new processes load bytecode instead of recompiling, and
+# compile_templates() fills it (and the in-memory template cache the
+# gunicorn workers inherit) before the first request.
+
+CARD_TEMPLATE = '_product_card.html'
+LAYOUT_TEMPLATE = '_layout.html'
+CARD_VARIANTS = ('featured', 'grid', 'related')
+CARD_FIELDS = ('id', 'name', 'brand', 'style', 'color', 'description', 'price', 'discount_price',
+               'stock_quantity', 'image_url')
+FRAGMENT_CACHE_SIZE = 4096
+
+fragment_cache = TTLCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=3600)
+
+def _enabled():
+    return current_app.config.get('FRAGMENT_CACHE', True)
+
+def card_version(product):
+    return tuple(getattr(product, name) for name in CARD_FIELDS)
+
+def product_card(variant, product):
+    can_add = current_user.is_authenticated
+    if not _enabled():
+        return get_template_attribute(CARD_TEMPLATE, variant)(product, can_add)
+    key = ('card', variant, product.id, can_add)
+    version = card_version(product)
+    entry = fragment_cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    html = get_template_attribute(CARD_TEMPLATE, variant)(product, can_add)
+    fragment_cache.set(key, (version, html))
+    return html
+
+def layout_fragment(name, *args):
+    if not _enabled():
+        return get_template_attribute(LAYOUT_TEMPLATE, name)(*args)
+    return fragment_cache.get_or_set(('layout', name) + args,
+                                     lambda: get_template_attribute(LAYOUT_TEMPLATE, name)(*args))
+
+def invalidate_products(product_ids):
+    for product_id in product_ids:
+        for variant in CARD_VARIANTS:
+            for can_add in (False, True):
+                fragment_cache.delete(('card', variant, product_id, can_add))
+
+def clear():
+    fragment_cache.clear()
+
+def compile_templates(app):
+    # Load every template once so its bytecode is cached on disk and in memory.
+    count = 0
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(name)
+        count += 1
+    return count
+
+def init_app(app):
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    app.add_template_global(product_card)
+    app.add_template_global(layout_fragment)
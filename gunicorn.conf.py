@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+
+# Gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:application`.
+# SQLite allows a single writer at a time, so more processes mostly add
+# read throughput; WAL keeps those reads from queueing behind checkouts.
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+
+# Hash passwords on a low-priority process per worker (see passwords.py);
+# gunicorn's entry point is safe to spawn from.
+os.environ.setdefault('PASSWORD_HASH_PROCESSES', '1')
+
+# Import the app (and create/seed the schema) once in the master rather
+# than racing to do it in every worker.
+preload_app = True
+
+def post_fork(server, worker):
+    from app import app
+    from database import db
+    import sqlite_engine
+    sqlite_engine.dispose_engines(app, db)
@@ -0,0 +1,150 @@
+import hashlib
+import os
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from cache import TTLCache
+from database import db, StoreStat
+import catalog
+import facets
+import images
+import stats
+
+# HTTP caching for the storefront.
+#
+# Catalog pages are rendered once per catalog version and served from
+# memory to every anonymous visitor. The version is a counter in
+# store_stat that every write to products or stock bumps inside its own
+# transaction (catalog_changed()), so all processes agree on it; each
+# process re-reads it at most every VERSION_TTL seconds, and immediately
+# after committing a change itself. Whenever it sees a new version, the
+# process drops the local caches pages are rendered from (catalog
+# snapshots, the facet index, rendered cards), so a page stored under the
+# new version is never rendered from data older than it. Cached pages
+# carry a strong ETag, so revalidations are answered with 304 without
+# rendering anything.
+#
+# Pages for logged-in users (cart badge, flashes) are never shared: they
+# are rendered as usual and only get an ETag and `private, no-cache`.
+#
+# Static files are linked with a `?v=<content hash>` fingerprint and
+# served with a one-year immutable lifetime; image variants already have
+# content-hashed names.
+
+VERSION_KEY = 'catalog_version'
+VERSION_TTL = 1  # seconds another process may keep serving an old version
+PAGE_CACHE_SIZE = 256
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+page_cache = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=3600)
+_version = TTLCache(maxsize=1, ttl=VERSION_TTL)
+_fingerprints = TTLCache(maxsize=4096, ttl=3600)
+_seen = {'version': None}
+
+class CachedPage:
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+def catalog_changed():
+    # Call inside the transaction that changes products or stock.
+    stats.increment(VERSION_KEY)
+    db.session.info['catalog_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _catalog_committed(session):
+    if session.info.pop('catalog_changed', False):
+        _version.clear()
+        page_cache.clear()
+
+@event.listens_for(Session, 'after_rollback')
+def _catalog_rolled_back(session):
+    session.info.pop('catalog_changed', None)
+
+def _load_version():
+    version = int(db.session.query(StoreStat.value).filter_by(name=VERSION_KEY).scalar() or 0)
+    if version != _seen['version']:
+        catalog.invalidate_catalog()  # also drops the rendered cards
+        facets.facet_index.invalidate()
+        images.forget_manifests()  # variants built by a worker elsewhere
+        _seen['version'] = version
+    return version
+
+def catalog_version():
+    return _version.get_or_set('version', _load_version)
+
+def _shareable():
+    return (request.method in ('GET', 'HEAD')
+            and not current_user.is_authenticated
+            and not session.get('_flashes'))
+
+def _conditional(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+def cached_page(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _shareable():
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            return _conditional(response, hashlib.sha256(response.get_data()).hexdigest()[:32],
+                                'private, no-cache')
+
+        key = (request.endpoint, request.path, tuple(sorted(request.args.items(multi=True))),
+               catalog_version())
+        page = page_cache.get(key)
+        hit = page is not None
+        if not hit:
+            response = make_response(view(*args, **kwargs))
+            # Only plain 200s that leave the session alone can be shared.
+            if response.status_code != 200 or session.modified or response.headers.get('Set-Cookie'):
+                return response
+            page = CachedPage(response.get_data(), response.mimetype)
+            page_cache.set(key, page)
+        response = current_app.response_class(page.body, mimetype=page.mimetype)
+        response.headers['X-Page-Cache'] = 'hit' if hit else 'miss'
+        return _conditional(response, page.etag, 'public, no-cache')
+    return wrapper
+
+def fingerprint(folder, filename):
+    path = os.path.join(folder, filename)
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    key = (path, info.st_mtime_ns, info.st_size)
+    value = _fingerprints.get(key)
+    if value is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(1 << 16), b''):
+                digest.update(block)
+        value = digest.hexdigest()[:12]
+        _fingerprints.set(key, value)
+    return value
+
+def _hashed_name(filename):
+    return f'/{images.VARIANTS_DIR}/' in '/' + filename
+
+def init_app(app):
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values \
+                and not _hashed_name(values['filename']):
+            version = fingerprint(app.static_folder, values['filename'])
+            if version:
+                values['v'] = version
+
+    @app.after_request
+    def static_cache_headers(response):
+        if request.endpoint == 'static' and response.status_code in (200, 304) and (
+                'v' in request.args or _hashed_name(request.view_args.get('filename', ''))):
+            response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+        return response
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# Time-ordered 76-bit ids, Snowflake style:
+#
+#   42 bits  milliseconds since EPOCH   (good until ~2163)
+#   22 bits  node: ID_NODE env var, else the process id
+#   12 bits  per-process sequence within one millisecond
+#
+# Live processes on a host never share a pid (pid_max <= 2**22), so worker
+# processes cannot collide without any coordination or database round
+# trip. Set ID_NODE explicitly when several hosts share one database.
+# Ids are rendered as fixed-width Crockford base32, so string order is time
+# order and new order numbers land at the right edge of the unique index.
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+EPOCH_MS = int(EPOCH.timestamp() * 1000)
+
+TIME_BITS = 42
+NODE_BITS = 22
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+WIDTH = 16  # 80 bits of base32, enough for 76
+
+class IdGenerator:
+    def __init__(self, node=None):
+        self._fixed_node = node
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _node(self):
+        node = self._fixed_node
+        if node is None and os.environ.get('ID_NODE'):
+            node = int(os.environ['ID_NODE'])
+        if node is None:
+            node = os.getpid()
+        if not 0 <= node <= MAX_NODE:
+            raise ValueError(f'ID node must be between 0 and {MAX_NODE}')
+        return node
+
+    def _reset(self):
+        # Also runs in a forked child, which must not continue its parent's
+        # sequence under a new pid.
+        self._pid = os.getpid()
+        self._node_bits = self._node() << SEQUENCE_BITS
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            now = int(time.time() * 1000) - EPOCH_MS
+            # Never step backwards if the wall clock does.
+            if now <= self._last_ms:
+                now = self._last_ms
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    while now <= self._last_ms:
+                        time.sleep(0.0001)
+                        now = int(time.time() * 1000) - EPOCH_MS
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (NODE_BITS + SEQUENCE_BITS)) | self._node_bits | self._sequence
+
+generator = IdGenerator()
+
+def encode(value):
+    chars = []
+    for _ in range(WIDTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+def new_id():
+    return encode(generator.next_id())
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from PIL import Image, ImageOps, features
+from cache import TTLCache
+
+# Product image variants. Each upload is re-encoded at several widths in
+# modern formats by a background job (see tasks.py); files are named after a hash of
+# the source bytes, so they can be served with far-future cache headers
+# and identical uploads share one set of files. A small JSON manifest per
+# source image tells the templates which variants exist.
+
+VARIANT_WIDTHS = (160, 320, 640, 1024)
+VARIANTS_DIR = 'variants'
+
+FORMATS = {
+    'avif': {'ext': 'avif', 'mime': 'image/avif', 'options': {'quality': 55}},
+    'webp': {'ext': 'webp', 'mime': 'image/webp', 'options': {'quality': 78, 'method': 4}},
+    'jpeg': {'ext': 'jpg', 'mime': 'image/jpeg', 'options': {'quality': 80, 'optimize': True, 'progressive': True}},
+}
+# Modern formats first: browsers take the first <source> they support.
+ENABLED_FORMATS = [fmt for fmt in ('avif', 'webp', 'jpeg') if fmt == 'jpeg' or features.check(fmt)]
+
+_manifests = TTLCache(maxsize=2048, ttl=300)
+PENDING_TTL = 10  # recheck soon for images the worker has not finished
+
+class ImageVariants:
+    def __init__(self, manifest):
+        self.width = manifest['width']
+        self.height = manifest['height']
+        self.sources = {fmt: [(int(width), name) for width, name in sorted(files.items(), key=lambda item: int(item[0]))]
+                        for fmt, files in manifest['variants'].items()}
+
+    def mime(self, fmt):
+        return FORMATS[fmt]['mime']
+
+    def fallback(self, max_width=640):
+        # Largest JPEG no wider than max_width, for the plain <img src>.
+        candidates = self.sources.get('jpeg', [])
+        chosen = [name for width, name in candidates if width <= max_width] or [candidates[0][1]]
+        return chosen[-1]
+
+def _variants_dir(upload_folder):
+    return os.path.join(upload_folder, VARIANTS_DIR)
+
+def _manifest_path(upload_folder, filename):
+    return os.path.join(_variants_dir(upload_folder), filename + '.json')
+
+def _write_atomic(path, write):
+    tmp_path = path + '.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _prepare(image, fmt):
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    return image
+
+def build_variants(upload_folder, filename):
+    source_path = os.path.join(upload_folder, filename)
+    if not os.path.isfile(source_path):
+        return None
+    with open(source_path, 'rb') as source:
+        digest = hashlib.sha256(source.read()).hexdigest()[:16]
+
+    out_dir = _variants_dir(upload_folder)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with Image.open(source_path) as opened:
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    widths = [width for width in VARIANT_WIDTHS if width < image.width] + [min(image.width, VARIANT_WIDTHS[-1])]
+
+    manifest = {'source': filename, 'hash': digest, 'width': image.width, 'height': image.height, 'variants': {}}
+    for fmt in ENABLED_FORMATS:
+        spec = FORMATS[fmt]
+        prepared = _prepare(image, fmt)
+        files = {}
+        for width in sorted(set(widths)):
+            name = f'{digest}-{width}.{spec["ext"]}'
+            path = os.path.join(out_dir, name)
+            if not os.path.exists(path):
+                height = max(1, round(image.height * width / image.width))
+                resized = prepared.resize((width, height), Image.LANCZOS) if width != image.width else prepared
+                _write_atomic(path, lambda tmp: resized.save(tmp, format=fmt.upper(), **spec['options']))
+            files[width] = name
+        manifest['variants'][fmt] = files
+
+    def write_manifest(tmp):
+        with open(tmp, 'w') as handle:
+            json.dump(manifest, handle)
+    _write_atomic(_manifest_path(upload_folder, filename), write_manifest)
+    _manifests.delete(filename)
+    return manifest
+
+def discard_variants(upload_folder, filename):
+    # Variant files are content-addressed and may be shared, so only the
+    # manifest tying them to this upload is removed.
+    try:
+        os.remove(_manifest_path(upload_folder, filename))
+    except FileNotFoundError:
+        pass
+    _manifests.delete(filename)
+
+def forget_manifests():
+    # Drops cached manifests, including "not built yet" answers.
+    _manifests.clear()
+
+def variants_for(upload_folder, filename):
+    if not filename:
+        return None
+    cached = _manifests.get(filename)
+    if cached is not None:
+        return cached or None
+    try:
+        with open(_manifest_path(upload_folder, filename)) as handle:
+            variants = ImageVariants(json.load(handle))
+    except (FileNotFoundError, ValueError, KeyError):
+        _manifests.set(filename, False, ttl=PENDING_TTL)
+        return None
+    _manifests.set(filename, variants)
+    return variants
@@ -0,0 +1,297 @@
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, event, func, or_, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from database import db, Job
+import stock
+
+# Background job queue persisted in the `job` table.
+#
+# enqueue() only adds a row to the caller's transaction, so a job exists
+# exactly when the work that asked for it was committed (an order and its
+# confirmation mail, a product and its image variants). Workers claim one
+# job at a time with a guarded UPDATE ... RETURNING, which SQLite serializes,
+# so any number of threads and processes can share the table. Failed jobs
+# are retried with exponential backoff up to max_attempts; jobs whose
+# worker died are handed out again once they have been running longer than
+# JOB_TIMEOUT, or the longer timeout a slow kind registers with @job.
+#
+# The app starts JOB_WORKERS threads on its first request. Set it to 0 and
+# run `flask run-jobs` to do the work in a separate process instead.
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 5  # seconds, doubled on every failed attempt
+POLL_INTERVAL = 1.0
+JOB_TIMEOUT = timedelta(minutes=10)
+KEEP_FINISHED = timedelta(days=7)
+HOUSEKEEPING_INTERVAL = 60
+CLAIM_ATTEMPTS = 3
+
+# Upper bound on jobs of one kind running at once in this process, so a
+# burst of slow work (image encoding) cannot starve the mail jobs.
+CONCURRENCY = {
+    'image_variants': 1,
+}
+
+# Kinds that legitimately run longer than JOB_TIMEOUT; a running job is
+# only presumed dead, and handed out again, past its kind's timeout.
+TIMEOUTS = {}
+
+handlers = {}
+
+def job(kind, concurrency=None, timeout=None):
+    def register(func):
+        handlers[kind] = func
+        if concurrency is not None:
+            CONCURRENCY[kind] = concurrency
+        if timeout is not None:
+            TIMEOUTS[kind] = timeout
+        return func
+    return register
+
+def enqueue(kind, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS, **payload):
+    now = datetime.utcnow()
+    queued = Job(kind=kind, payload=json.dumps(payload), max_attempts=max_attempts,
+                 run_at=now + timedelta(seconds=delay), created_at=now)
+    db.session.add(queued)
+    db.session.info['jobs_enqueued'] = True
+    return queued
+
+_wakeup = threading.Event()
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        _wakeup.set()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
+
+class QueueMetrics:
+    # Per-process counters; queue depth and age come from the table itself.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.wait_max = 0.0
+        self.run_max = 0.0
+
+    def record(self, outcome, wait, run):
+        with self._lock:
+            if outcome == 'done':
+                self.completed += 1
+            elif outcome == 'failed':
+                self.failed += 1
+            else:
+                self.retried += 1
+            self.wait_total += wait
+            self.run_total += run
+            self.wait_max = max(self.wait_max, wait)
+            self.run_max = max(self.run_max, run)
+
+    def snapshot(self):
+        with self._lock:
+            processed = self.completed + self.failed + self.retried
+            return {
+                'completed': self.completed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'avg_wait': round(self.wait_total / processed, 4) if processed else 0,
+                'max_wait': round(self.wait_max, 4),
+                'avg_run': round(self.run_total / processed, 4) if processed else 0,
+                'max_run': round(self.run_max, 4),
+            }
+
+queue_metrics = QueueMetrics()
+_running = {}
+_running_lock = threading.Lock()
+
+def _saturated_kinds():
+    with _running_lock:
+        return [kind for kind, limit in CONCURRENCY.items() if _running.get(kind, 0) >= limit]
+
+def _track(kind, delta):
+    with _running_lock:
+        _running[kind] = _running.get(kind, 0) + delta
+
+def claim(worker_name, now=None):
+    # Pick a candidate with a plain read first so idle polling never takes
+    # the write lock; the guarded UPDATE then decides which worker gets it.
+    now = now or datetime.utcnow()
+    candidates = select(Job.id).where(Job.status == 'queued', Job.run_at <= now)
+    saturated = _saturated_kinds()
+    if saturated:
+        candidates = candidates.where(Job.kind.notin_(saturated))
+    candidates = candidates.order_by(Job.run_at, Job.id).limit(1)
+    for _ in range(CLAIM_ATTEMPTS):
+        job_id = db.session.execute(candidates).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        row = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', worker=worker_name, started_at=now, attempts=Job.attempts + 1)
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts, Job.run_at)
+            .execution_options(synchronize_session=False)
+        ).first()
+        db.session.commit()
+        if row is not None:
+            return row
+    return None
+
+def _finish(job_id, **values):
+    db.session.execute(
+        update(Job).where(Job.id == job_id).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def run_one(worker_name):
+    # Claim and run a single job. Returns False when nothing was runnable.
+    claimed = claim(worker_name)
+    if claimed is None:
+        return False
+    _track(claimed.kind, 1)
+    started = time.monotonic()
+    wait = max(0.0, (datetime.utcnow() - claimed.run_at).total_seconds())
+    try:
+        handler = handlers.get(claimed.kind)
+        if handler is None:
+            raise LookupError(f'No handler registered for job kind {claimed.kind!r}')
+        handler(**json.loads(claimed.payload))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=5)
+        if claimed.attempts >= claimed.max_attempts:
+            outcome = 'failed'
+            _finish(claimed.id, status='failed', last_error=error, finished_at=datetime.utcnow())
+        else:
+            outcome = 'retried'
+            delay = RETRY_BACKOFF * (2 ** (claimed.attempts - 1))
+            _finish(claimed.id, status='queued', last_error=error,
+                    run_at=datetime.utcnow() + timedelta(seconds=delay))
+    else:
+        outcome = 'done'
+        _finish(claimed.id, status='done', finished_at=datetime.utcnow())
+    finally:
+        _track(claimed.kind, -1)
+    queue_metrics.record(outcome, wait, time.monotonic() - started)
+    return True
+
+def requeue_stale(now=None):
+    now = now or datetime.utcnow()
+    stale = [and_(Job.kind == kind, Job.started_at < now - timeout) for kind, timeout in TIMEOUTS.items()]
+    stale.append(and_(Job.kind.notin_(list(TIMEOUTS)), Job.started_at < now - JOB_TIMEOUT))
+    count = db.session.execute(
+        update(Job).where(Job.status == 'running', or_(*stale))
+        .values(status='queued', worker=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return count
+
+def purge_finished(now=None, keep=KEEP_FINISHED):
+    cutoff = (now or datetime.utcnow()) - keep
+    count = db.session.execute(
+        delete(Job).where(Job.status == 'done', Job.finished_at < cutoff)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return count
+
+def run_pending(worker_name='inline', limit=None):
+    # Drain runnable jobs in the calling thread (CLI, tests, benchmarks).
+    processed = 0
+    while (limit is None or processed < limit) and run_one(worker_name):
+        processed += 1
+    return processed
+
+def metrics(now=None):
+    now = now or datetime.utcnow()
+    by_status = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+    ready, oldest = db.session.query(func.count(Job.id), func.min(Job.run_at)).filter(
+        Job.status == 'queued', Job.run_at <= now
+    ).one()
+    with _running_lock:
+        running_here = {kind: count for kind, count in _running.items() if count}
+    return {
+        'depth': ready,
+        'oldest_ready_age': round((now - oldest).total_seconds(), 3) if oldest else 0,
+        'by_status': by_status,
+        'running_in_process': running_here,
+        'process': queue_metrics.snapshot(),
+    }
+
+class Worker(threading.Thread):
+    def __init__(self, app, name):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.stopping = threading.Event()
+
+    def run(self):
+        last_housekeeping = 0.0
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    if time.monotonic() - last_housekeeping > HOUSEKEEPING_INTERVAL:
+                        last_housekeeping = time.monotonic()
+                        requeue_stale()
+                        purge_finished()
+                    if run_one(self.name):
+                        continue
+                except Exception as error:
+                    db.session.rollback()
+                    if not (isinstance(error, OperationalError) and stock.is_busy_error(error)):
+                        self.app.logger.exception('Job worker %s failed', self.name)
+                finally:
+                    db.session.remove()
+                _wakeup.wait(POLL_INTERVAL)
+                _wakeup.clear()
+
+    def stop(self):
+        self.stopping.set()
+        _wakeup.set()
+
+_workers = []
+_workers_lock = threading.Lock()
+
+def worker_name(index):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+def start_workers(app, count=None):
+    count = app.config.get('JOB_WORKERS', DEFAULT_WORKERS) if count is None else count
+    if len(_workers) >= count and all(worker.is_alive() for worker in _workers):
+        return list(_workers)
+    with _workers_lock:
+        # A forked child inherits the list but not the threads.
+        alive = [worker for worker in _workers if worker.is_alive()]
+        for index in range(len(alive), count):
+            worker = Worker(app, worker_name(index))
+            worker.start()
+            alive.append(worker)
+        _workers[:] = alive
+    return list(_workers)
+
+def stop_workers(timeout=5):
+    with _workers_lock:
+        for worker in _workers:
+            worker.stop()
+        for worker in _workers:
+            worker.join(timeout)
+        _workers.clear()
@@ -0,0 +1,61 @@
+import os
+import smtplib
+import threading
+from email.message import EmailMessage
+from email.utils import make_msgid
+from flask import current_app
+
+# Outgoing mail. Only ever called from background jobs, never from a
+# request handler. MAIL_BACKEND selects the transport:
+#
+#   smtp    deliver through MAIL_SERVER:MAIL_PORT
+#   outbox  write each message as an .eml file under MAIL_OUTBOX_DIR, a
+#           local stand-in for an SMTP server in development
+#   memory  append to `outbox` in this process, for tests and benchmarks
+#
+# Without a MAIL_SERVER the default is the file outbox.
+
+DEFAULT_SENDER = 'SunStyle <no-reply@sunstyle.example>'
+
+outbox = []
+_outbox_lock = threading.Lock()
+
+def _config(name, default=None):
+    return current_app.config.get(name, os.environ.get(name, default))
+
+def backend():
+    return _config('MAIL_BACKEND') or ('smtp' if _config('MAIL_SERVER') else 'outbox')
+
+def build_message(to, subject, html, text=None):
+    message = EmailMessage()
+    message['From'] = _config('MAIL_DEFAULT_SENDER', DEFAULT_SENDER)
+    message['To'] = to
+    message['Subject'] = subject
+    message['Message-ID'] = make_msgid(domain='sunstyle.example')
+    message.set_content(text or 'This message is best viewed in an HTML capable mail client.')
+    message.add_alternative(html, subtype='html')
+    return message
+
+def send_mail(to, subject, html, text=None):
+    message = build_message(to, subject, html, text)
+    selected = backend()
+    if selected == 'smtp':
+        port = int(_config('MAIL_PORT', 25))
+        with smtplib.SMTP(_config('MAIL_SERVER'), port, timeout=30) as server:
+            if str(_config('MAIL_USE_TLS', '')).lower() in ('1', 'true', 'yes'):
+                server.starttls()
+            if _config('MAIL_USERNAME'):
+                server.login(_config('MAIL_USERNAME'), _config('MAIL_PASSWORD'))
+            server.send_message(message)
+    elif selected == 'outbox':
+        folder = _config('MAIL_OUTBOX_DIR') or os.path.join(current_app.instance_path, 'outbox')
+        os.makedirs(folder, exist_ok=True)
+        name = message['Message-ID'].strip('<>').replace('@', '_') + '.eml'
+        with open(os.path.join(folder, name), 'wb') as handle:
+            handle.write(bytes(message))
+    elif selected == 'memory':
+        with _outbox_lock:
+            outbox.append(message)
+    else:
+        raise ValueError(f'Unknown MAIL_BACKEND {selected!r}')
+    return message['Message-ID']
@@ -0,0 +1,246 @@
+import calendar
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select, text, tuple_
+from database import (db, CartItem, Order, OrderItem, Booking, BookingItem, ArchivedOrder, ArchivedOrderItem,
+                      ArchivedBooking, ArchivedBookingItem, Job, MaintenanceRun)
+import jobs
+import stock
+
+# Data lifecycle for the SQLite store, run as one pass:
+#
+#   carts       carts whose newest line is older than CART_EXPIRY_DAYS are
+#               emptied (abandoned carts otherwise live forever);
+#   archive     delivered/cancelled orders and finished bookings older
+#               than ARCHIVE_AFTER_MONTHS move, ids and lines included, to
+#               the *_archive tables, so the listings and their indexes
+#               only cover recent rows;
+#   analyze     refreshes the planner statistics (bounded by
+#               ANALYSIS_LIMIT rows per index, so it stays quick);
+#   vacuum      returns free pages to the filesystem with
+#               PRAGMA incremental_vacuum and truncates the WAL.
+#
+# Rows are moved and deleted in batches of BATCH_SIZE, each in its own
+# short transaction, so the pass never holds the write lock for long.
+# Incremental vacuum needs auto_vacuum=INCREMENTAL, which new databases
+# get from sqlite_engine; an older file is converted by one full VACUUM
+# (`flask maintenance --full-vacuum`), which rewrites the whole file and
+# blocks writers while it runs, so it is never done automatically.
+#
+# The pass runs as the `maintenance` job (tasks.py) at MAINTENANCE_HOUR
+# (UTC) every day; each run schedules the next one, and its report (rows
+# touched, bytes reclaimed, seconds per task) is kept in maintenance_run.
+# Booking reservations past their TTL are released by the `booking_sweep`
+# job every BOOKING_SWEEP_MINUTES, which reschedules itself the same way;
+# it also gives them the `expired` status the archive task looks for.
+
+CART_EXPIRY_DAYS = 30
+ARCHIVE_AFTER_MONTHS = 12
+MAINTENANCE_HOUR = 3
+BOOKING_SWEEP_MINUTES = 15
+BATCH_SIZE = 500
+ANALYSIS_LIMIT = 1000
+KEEP_RUNS = 100
+TASKS = ('carts', 'archive', 'analyze', 'vacuum')
+
+FINISHED_ORDERS = ('delivered', 'cancelled')
+FINISHED_BOOKINGS = ('collected', 'expired', 'cancelled')
+
+def _config(name, default):
+    try:
+        return current_app.config.get(name, default)
+    except RuntimeError:
+        return default
+
+def months_ago(moment, months):
+    year, month = divmod(moment.year * 12 + moment.month - 1 - months, 12)
+    day = min(moment.day, calendar.monthrange(year, month + 1)[1])
+    return moment.replace(year=year, month=month + 1, day=day)
+
+@stock.retry_on_busy
+def _expire_carts_batch(user_ids, cutoff):
+    # Re-checked here: a customer may have come back since the candidates were read.
+    recent = select(CartItem.user_id).where(CartItem.user_id.in_(user_ids), CartItem.added_at >= cutoff)
+    deleted = db.session.execute(
+        delete(CartItem).where(CartItem.user_id.in_(user_ids), CartItem.user_id.notin_(recent))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+def expire_carts(now=None, days=None):
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days or _config('CART_EXPIRY_DAYS', CART_EXPIRY_DAYS))
+    # Users with an old line (index range on added_at), minus those who
+    # touched their cart since: a cart only expires as a whole.
+    candidates = {user_id for user_id, in db.session.query(CartItem.user_id).filter(
+        CartItem.added_at < cutoff).distinct()}
+    active = set()
+    ids = sorted(candidates)
+    for offset in range(0, len(ids), BATCH_SIZE):
+        active.update(user_id for user_id, in db.session.query(CartItem.user_id).filter(
+            CartItem.user_id.in_(ids[offset:offset + BATCH_SIZE]), CartItem.added_at >= cutoff).distinct())
+    db.session.rollback()
+    stale = sorted(candidates - active)
+    deleted = 0
+    for offset in range(0, len(stale), BATCH_SIZE):
+        deleted += _expire_carts_batch(stale[offset:offset + BATCH_SIZE], cutoff)
+    return {'carts': len(stale), 'rows': deleted, 'cutoff': cutoff.isoformat()}
+
+# (live parent, live lines, archive parent, archive lines, line -> parent column, finished statuses)
+ARCHIVES = {
+    'orders': (Order, OrderItem, ArchivedOrder, ArchivedOrderItem, 'order_id', FINISHED_ORDERS),
+    'bookings': (Booking, BookingItem, ArchivedBooking, ArchivedBookingItem, 'booking_id', FINISHED_BOOKINGS),
+}
+
+def _copy_columns(source, target):
+    return [column.name for column in target.__table__.columns if column.name in source.__table__.columns]
+
+@stock.retry_on_busy
+def _archive_batch(kind, cutoff, now, after=None):
+    # Moves the next batch after the (created_at, id) key `after`; returns
+    # the key of the last candidate (None when done) and the counts moved.
+    parent, lines, parent_archive, lines_archive, parent_key, finished = ARCHIVES[kind]
+    # The newest row is never moved, even when it qualifies: SQLite hands
+    # out max(id) + 1 for new rows, so an emptied table would reuse ids
+    # that already exist in the archive.
+    newest = select(func.max(parent.id)).scalar_subquery()
+    candidates = select(parent.id, parent.created_at).where(
+        parent.created_at < cutoff, parent.status.in_(finished), parent.id < newest)
+    if after is not None:
+        candidates = candidates.where(tuple_(parent.created_at, parent.id) > tuple_(*after))
+    rows = db.session.execute(candidates.order_by(parent.created_at, parent.id).limit(BATCH_SIZE)).all()
+    if not rows:
+        db.session.rollback()
+        return None, 0, 0
+    ids = [row.id for row in rows]
+    parent_columns = _copy_columns(parent, parent_archive)
+    line_columns = _copy_columns(lines, lines_archive)
+    parent_table, lines_table = parent.__table__, lines.__table__
+    # The candidates came from a read snapshot, so the copy re-checks them.
+    ids = [row_id for row_id, in db.session.execute(insert(parent_archive.__table__).from_select(
+        parent_columns + ['archived_at'],
+        select(*[parent_table.c[name] for name in parent_columns], literal(now, db.DateTime)).where(
+            parent_table.c.id.in_(ids), parent_table.c.created_at < cutoff, parent_table.c.status.in_(finished))
+    ).returning(parent_archive.__table__.c.id))]
+    moved_lines = db.session.execute(insert(lines_archive.__table__).from_select(
+        line_columns, select(*[lines_table.c[name] for name in line_columns])
+        .where(lines_table.c[parent_key].in_(ids))
+    )).rowcount
+    db.session.execute(delete(lines_table).where(lines_table.c[parent_key].in_(ids)))
+    db.session.execute(delete(parent_table).where(parent_table.c.id.in_(ids)))
+    db.session.commit()
+    return (rows[-1].created_at, rows[-1].id), len(ids), moved_lines
+
+def archive(now=None, months=None):
+    now = now or datetime.utcnow()
+    cutoff = months_ago(now, months or _config('ARCHIVE_AFTER_MONTHS', ARCHIVE_AFTER_MONTHS))
+    report = {'cutoff': cutoff.isoformat()}
+    for kind in ARCHIVES:
+        moved = lines = 0
+        after = None
+        while True:
+            after, batch, batch_lines = _archive_batch(kind, cutoff, now, after)
+            if after is None:
+                break
+            moved += batch
+            lines += batch_lines
+        report[kind] = moved
+        report[f'{kind}_lines'] = lines
+    return report
+
+def _pragma(connection, name):
+    return connection.execute(text(f'PRAGMA {name}')).scalar()
+
+def _file_size(connection):
+    path = connection.engine.url.database
+    if not path or path == ':memory:':
+        return 0
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+def analyze():
+    with db.engine.connect() as connection:
+        connection.execute(text(f'PRAGMA analysis_limit = {int(ANALYSIS_LIMIT)}'))
+        connection.execute(text('ANALYZE'))
+        connection.commit()
+        connection.execute(text('PRAGMA analysis_limit = 0'))
+    return {}
+
+def vacuum(full=False):
+    # Runs outside a transaction on a writer connection.
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        page_size = _pragma(connection, 'page_size')
+        free_before = _pragma(connection, 'freelist_count')
+        size_before = _file_size(connection)
+        mode = _pragma(connection, 'auto_vacuum')
+        if full:
+            connection.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+            connection.execute(text('VACUUM'))
+        elif mode == 2:
+            # Each step of the statement frees one page and execute() only
+            # takes the first; executescript runs it to completion.
+            connection.connection.driver_connection.executescript('PRAGMA incremental_vacuum')
+        connection.execute(text('PRAGMA wal_checkpoint(TRUNCATE)')).fetchall()
+        report = {
+            'mode': 'full' if full else ('incremental' if mode == 2 else 'skipped: auto_vacuum is off'),
+            'free_pages_before': free_before,
+            'free_pages_after': _pragma(connection, 'freelist_count'),
+            'reclaimed_bytes': size_before - _file_size(connection),
+        }
+        report['free_bytes_released'] = (free_before - report['free_pages_after']) * page_size
+    return report
+
+def run(tasks=TASKS, full_vacuum=False, now=None):
+    started_at = datetime.utcnow()
+    report = {}
+    for task in tasks:
+        started = time.perf_counter()
+        if task == 'carts':
+            result = expire_carts(now)
+        elif task == 'archive':
+            result = archive(now)
+        elif task == 'analyze':
+            result = analyze()
+        elif task == 'vacuum':
+            result = vacuum(full=full_vacuum)
+        else:
+            raise ValueError(f'Unknown maintenance task {task!r}')
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        report[task] = result
+    seconds = (datetime.utcnow() - started_at).total_seconds()
+    db.session.add(MaintenanceRun(started_at=started_at, seconds=seconds, report=json.dumps(report)))
+    old = select(MaintenanceRun.id).order_by(MaintenanceRun.id.desc()).offset(KEEP_RUNS).limit(1).scalar_subquery()
+    db.session.execute(delete(MaintenanceRun).where(MaintenanceRun.id <= old))
+    db.session.commit()
+    return report
+
+def next_run(now=None):
+    now = now or datetime.utcnow()
+    at = now.replace(hour=_config('MAINTENANCE_HOUR', MAINTENANCE_HOUR), minute=0, second=0, microsecond=0)
+    return at if at > now else at + timedelta(days=1)
+
+def scheduled_at():
+    return db.session.query(func.min(Job.run_at)).filter(
+        Job.kind == 'maintenance', Job.status == 'queued').scalar()
+
+def schedule(now=None):
+    # Queue the next nightly pass unless one is already waiting.
+    if _config('MAINTENANCE_HOUR', MAINTENANCE_HOUR) is None or scheduled_at() is not None:
+        return None
+    now = now or datetime.utcnow()
+    return jobs.enqueue('maintenance', delay=(next_run(now) - now).total_seconds(), max_attempts=3)
+
+def schedule_booking_sweep(now=None):
+    # Queue the next expired-booking sweep unless one is already waiting.
+    minutes = _config('BOOKING_SWEEP_MINUTES', BOOKING_SWEEP_MINUTES)
+    if minutes is None or db.session.query(Job.id).filter(
+            Job.kind == 'booking_sweep', Job.status == 'queued').first() is not None:
+        return None
+    return jobs.enqueue('booking_sweep', delay=minutes * 60, max_attempts=3)
+
+def recent_runs(limit=10):
+    return [{'started_at': run.started_at.isoformat(), 'seconds': round(run.seconds, 3),
+             'report': json.loads(run.report)}
+            for run in MaintenanceRun.query.order_by(MaintenanceRun.id.desc()).limit(limit)]
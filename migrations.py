@@ -0,0 +1,110 @@
+from sqlalchemy import text
+from database import db, DEFAULT_SKU_FORMAT, free_sku
+import search
+
+# Versioned schema changes for existing databases. The applied version is
+# kept in SQLite's `PRAGMA user_version`; upgrade() runs every migration
+# above it in order. create_all() still builds new tables (with their
+# declared indexes) first, so migrations only deal with tables that
+# already exist. Each step must be safe to re-run, since SQLite commits
+# DDL as it goes and a crash can land between a step and the version bump.
+
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return register
+
+def _create_indexes(connection, *names):
+    wanted = set(names)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in wanted:
+                index.create(bind=connection, checkfirst=True)
+                wanted.discard(index.name)
+    if wanted:
+        raise LookupError(f'Indexes not declared in database.py: {sorted(wanted)}')
+
+@migration(1, 'Keyset pagination, stock and booking expiry indexes')
+def _pagination_indexes(connection):
+    _create_indexes(connection,
+                    'ix_product_price_id', 'ix_product_name_id', 'ix_product_stock_quantity',
+                    'ix_order_created_at_id', 'ix_order_user_created_at_id',
+                    'ix_booking_created_at_id', 'ix_booking_user_created_at_id',
+                    'ix_booking_status_pickup_date', 'ix_job_status_run_at')
+
+@migration(2, 'Merge duplicate cart rows and make (user_id, product_id) unique')
+def _unique_cart_items(connection):
+    connection.execute(text(
+        "UPDATE cart_item SET quantity = ("
+        "  SELECT SUM(quantity) FROM cart_item AS other"
+        "  WHERE other.user_id = cart_item.user_id AND other.product_id = cart_item.product_id"
+        ") WHERE id IN ("
+        "  SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id HAVING COUNT(*) > 1"
+        ")"
+    ))
+    connection.execute(text(
+        "DELETE FROM cart_item WHERE id NOT IN ("
+        "  SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id"
+        ")"
+    ))
+    _create_indexes(connection, 'uq_cart_item_user_product')
+
+@migration(3, 'Foreign-key and storefront filter indexes')
+def _foreign_key_indexes(connection):
+    _create_indexes(connection,
+                    'ix_cart_item_product_id',
+                    'ix_order_item_order_id', 'ix_order_item_product_id',
+                    'ix_booking_item_booking_id', 'ix_booking_item_product_id',
+                    'ix_product_active_id', 'ix_product_active_price_id',
+                    'ix_product_active_name_id', 'ix_product_category_active_id')
+
+@migration(4, 'Product SKU for bulk catalog import; search trigger on indexed columns only')
+def _product_sku(connection):
+    columns = {row[1] for row in connection.execute(text('PRAGMA table_info(product)'))}
+    if 'sku' not in columns:
+        connection.execute(text('ALTER TABLE product ADD COLUMN sku VARCHAR(64)'))
+    _create_indexes(connection, 'uq_product_sku')
+    # Stock-only updates from feeds should not rewrite the search index.
+    has_search = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+    )).first()
+    if has_search:
+        connection.execute(text('DROP TRIGGER IF EXISTS product_fts_au'))
+        connection.execute(text(search.UPDATE_TRIGGER))
+
+@migration(5, 'Index cart rows by age for the stale cart sweep')
+def _cart_added_at(connection):
+    _create_indexes(connection, 'ix_cart_item_added_at')
+
+@migration(6, 'Backfill id-based SKUs for products entered by hand')
+def _backfill_skus(connection):
+    connection.execute(text(
+        "UPDATE product SET sku = printf(:format, id)"
+        " WHERE (sku IS NULL OR sku = '')"
+        " AND NOT EXISTS (SELECT 1 FROM product AS other WHERE other.sku = printf(:format, product.id))"
+    ), {'format': DEFAULT_SKU_FORMAT})
+    # The few whose SKU an imported product already uses get a suffix.
+    for (product_id,) in connection.execute(text("SELECT id FROM product WHERE sku IS NULL OR sku = ''")).all():
+        connection.execute(text('UPDATE product SET sku = :sku WHERE id = :id'),
+                           {'sku': free_sku(connection, product_id), 'id': product_id})
+
+def current_version(connection):
+    return connection.execute(text('PRAGMA user_version')).scalar()
+
+def pending(connection):
+    version = current_version(connection)
+    return [entry for entry in MIGRATIONS if entry[0] > version]
+
+def upgrade():
+    db.create_all()
+    applied = []
+    with db.engine.begin() as connection:
+        for version, description, func in pending(connection):
+            func(connection)
+            connection.execute(text(f'PRAGMA user_version = {int(version)}'))
+            applied.append((version, description))
+    return applied
@@ -0,0 +1,63 @@
+from datetime import datetime
+from sqlalchemy import delete, insert
+from database import db, Product, CartItem, Order, OrderItem
+import catalog
+import jobs
+import stats
+import stock
+
+# Order placement as a fixed sequence of set-based statements: one joined
+# cart+product read, one INSERT for the order, one executemany INSERT for
+# its lines, one conditional stock UPDATE, the dashboard counter upserts,
+# the confirmation mail job and one cart DELETE, all in a single
+# transaction. Statement count does not grow with cart size.
+
+def load_cart(user_id):
+    return db.session.query(
+        CartItem.id, CartItem.product_id, CartItem.quantity, Product.price
+    ).join(Product, CartItem.product_id == Product.id).filter(
+        CartItem.user_id == user_id
+    ).all()
+
+@stock.retry_on_busy
+def place_order(user_id, order_number, payment_method, shipping_address):
+    cart_lines = load_cart(user_id)
+    # A line left at zero or below by older clients is dropped with the
+    # order rather than failing the stock reservation.
+    lines = [line for line in cart_lines if line.quantity >= 1]
+    if not lines:
+        return None
+
+    total_amount = sum(line.price * line.quantity for line in lines)
+    now = datetime.utcnow()
+
+    order_id = db.session.execute(insert(Order).values(
+        order_number=order_number,
+        total_amount=total_amount,
+        payment_method=payment_method,
+        shipping_address=shipping_address,
+        user_id=user_id,
+        created_at=now,
+        updated_at=now
+    )).inserted_primary_key[0]
+
+    db.session.execute(insert(OrderItem), [
+        {'order_id': order_id, 'product_id': line.product_id,
+         'quantity': line.quantity, 'price': line.price}
+        for line in lines
+    ])
+
+    stock.reserve_stock((line.product_id, line.quantity) for line in lines)
+    stats.record_order(total_amount, now)
+    jobs.enqueue('order_confirmation', order_id=order_id)
+
+    # Delete exactly the rows that were ordered; anything added to the cart
+    # concurrently stays there.
+    db.session.execute(
+        delete(CartItem).where(CartItem.id.in_([line.id for line in cart_lines]))
+        .execution_options(synchronize_session=False)
+    )
+
+    db.session.commit()
+    catalog.invalidate_products([line.product_id for line in lines])
+    return order_id
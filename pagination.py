@@ -0,0 +1,165 @@
+import base64
+import json
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import tuple_
+from database import Product, User, Order, Booking, ArchivedOrder, ArchivedBooking
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+# Sort options per listing: name -> (columns, descending). The last column
+# is always the primary key so every ordering is total and stable, and each
+# option has a matching index in database.py so a page is an index range
+# scan no matter how deep the cursor is.
+PRODUCT_SORTS = {
+    'newest': ((Product.id,), True),
+    'oldest': ((Product.id,), False),
+    'price_asc': ((Product.price, Product.id), False),
+    'price_desc': ((Product.price, Product.id), True),
+    'name': ((Product.name, Product.id), False),
+}
+
+USER_SORTS = {
+    'newest': ((User.id,), True),
+    'oldest': ((User.id,), False),
+}
+
+ORDER_SORTS = {
+    'newest': ((Order.created_at, Order.id), True),
+    'oldest': ((Order.created_at, Order.id), False),
+}
+
+BOOKING_SORTS = {
+    'newest': ((Booking.created_at, Booking.id), True),
+    'oldest': ((Booking.created_at, Booking.id), False),
+}
+
+ARCHIVED_ORDER_SORTS = {
+    'newest': ((ArchivedOrder.created_at, ArchivedOrder.id), True),
+    'oldest': ((ArchivedOrder.created_at, ArchivedOrder.id), False),
+}
+
+ARCHIVED_BOOKING_SORTS = {
+    'newest': ((ArchivedBooking.created_at, ArchivedBooking.id), True),
+    'oldest': ((ArchivedBooking.created_at, ArchivedBooking.id), False),
+}
+
+def encode_cursor(values):
+    data = [{'dt': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, size):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if not isinstance(data, list) or len(data) != size:
+            return None
+        values = []
+        for value in data:
+            # Only scalars and {'dt': iso} come out of encode_cursor; anything
+            # else (a tampered cursor) would reach the query as a bound list.
+            if isinstance(value, dict) and list(value) == ['dt'] and isinstance(value['dt'], str):
+                values.append(datetime.fromisoformat(value['dt']))
+            elif isinstance(value, (str, int, float)):
+                values.append(value)
+            else:
+                return None
+        return values
+    except (ValueError, KeyError, TypeError):
+        return None
+
+class Page:
+    def __init__(self, items, sort, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def url(self, **cursor):
+        args = request.args.to_dict()
+        args.pop('after', None)
+        args.pop('before', None)
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+def paginate(query, sorts, default_sort='newest', default_per_page=DEFAULT_PER_PAGE):
+    sort = request.args.get('sort', default_sort)
+    if sort not in sorts:
+        sort = default_sort
+    columns, descending = sorts[sort]
+
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = decode_cursor(before or after, len(columns)) if (before or after) else None
+    backwards = cursor is not None and before is not None
+
+    # Walking backwards runs the same index in reverse and flips the page
+    # back afterwards, so "previous" is as cheap as "next".
+    reverse = descending != backwards
+    if cursor is not None:
+        key = tuple_(*columns)
+        query = query.filter(key < tuple_(*cursor) if reverse else key > tuple_(*cursor))
+    query = query.order_by(*[c.desc() if reverse else c.asc() for c in columns])
+
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+
+    def cursor_of(item):
+        return encode_cursor([getattr(item, c.key) for c in columns])
+
+    next_cursor = prev_cursor = None
+    if items:
+        if more or backwards:
+            next_cursor = cursor_of(items[-1])
+        if (more and backwards) or (cursor is not None and not backwards):
+            prev_cursor = cursor_of(items[0])
+    return Page(items, sort, per_page, next_cursor, prev_cursor)
+
+def paginate_ranked(query, ranked_ids, default_per_page=DEFAULT_PER_PAGE):
+    # Relevance order comes from the search index rather than a column, so
+    # the (already capped) match set is ordered in memory and the cursor is
+    # a position in it.
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+
+    rank = {product_id: position for position, product_id in enumerate(ranked_ids)}
+    rows = query.filter(Product.id.in_(ranked_ids)).all() if ranked_ids else []
+    rows.sort(key=lambda row: rank[row.id])
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = decode_cursor(before or after, 1) if (before or after) else None
+    if cursor is not None and (type(cursor[0]) is not int or cursor[0] < 0):
+        cursor = None  # a position is a non-negative int; anything else starts over
+    if cursor is None:
+        start = 0
+    elif before:
+        start = max(0, cursor[0] - per_page)
+    else:
+        start = cursor[0] + 1
+    items = rows[start:start + per_page]
+
+    next_cursor = prev_cursor = None
+    if items:
+        if start + per_page < len(rows):
+            next_cursor = encode_cursor([start + len(items) - 1])
+        if start > 0:
+            prev_cursor = encode_cursor([start])
+    return Page(items, 'relevance', per_page, next_cursor, prev_cursor)
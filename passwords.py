@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing off the request threads. scrypt costs ~150ms of CPU per
+# call; done inline, a burst of logins takes every request thread and the
+# CPU with it. Hashes run instead on a small pool with a hard cap on work
+# in flight: when the cap is reached the caller gets PoolBusy at once
+# (the route answers 503) rather than queueing behind the flood.
+#
+# By default the pool is one thread: hashlib releases the GIL while
+# hashing, so this caps hashing at one core's worth of work per web
+# process. With PASSWORD_HASH_PROCESSES=1 (set in gunicorn.conf.py) it is
+# a worker process started at low CPU priority instead, so the scheduler
+# runs catalog requests first whenever both want the CPU. That mode spawns
+# a fresh interpreter, so the entry script must guard its main code with
+# `if __name__ == '__main__'`. PASSWORD_HASH_WORKERS=0 hashes inline on
+# the request thread, as before.
+
+HASH_WORKERS = 1
+MAX_PENDING = 8  # running + queued hashes per web process
+HASH_TIMEOUT = 10  # seconds
+WORKER_NICENESS = 10
+
+class PoolBusy(Exception):
+    pass
+
+def _lower_priority():
+    try:
+        os.nice(WORKER_NICENESS)
+    except OSError:
+        pass
+
+class HashPool:
+    def __init__(self, workers=HASH_WORKERS, max_pending=MAX_PENDING, processes=False):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.processes = processes
+        self.submitted = 0
+        self.rejected = 0
+        self.pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+
+    def configure(self, workers, max_pending, processes):
+        self.shutdown()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.processes = processes
+
+    def _get_executor(self):
+        # Created on first use, i.e. after any gunicorn fork.
+        with self._lock:
+            if self._executor is None:
+                if self.processes:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, initializer=_lower_priority,
+                        mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='password-hash')
+            return self._executor
+
+    def _release(self, future=None):
+        with self._pending_lock:
+            self.pending -= 1
+
+    def run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        with self._pending_lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PoolBusy()
+            self.pending += 1
+            self.submitted += 1
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=HASH_TIMEOUT)
+        except TimeoutError:
+            raise PoolBusy()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'processes': self.processes,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+        }
+
+pool = HashPool()
+
+def init_app(app):
+    pool.configure(app.config.get('PASSWORD_HASH_WORKERS', HASH_WORKERS),
+                   app.config.get('PASSWORD_HASH_PENDING', MAX_PENDING),
+                   app.config.get('PASSWORD_HASH_PROCESSES', False))
+
+def verify(password_hash, password):
+    return pool.run(check_password_hash, password_hash, password)
+
+def hash_password(password):
+    return pool.run(generate_password_hash, password)
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+# Per-request cost accounting: SQL statements and time (from engine
+# events), template render time and the statements issued while rendering
+# (lazy loads hiding in Jinja), wall time and, with PROFILE_MEMORY on, the
+# tracemalloc peak. Each request then
+#
+#   - gets X-SQL-* / X-Render-* headers and a Server-Timing header when
+#     the app runs in debug mode or PROFILE_HEADERS is set,
+#   - is written as one JSON line to the slow-request log when it takes
+#     longer than SLOW_REQUEST_MS,
+#   - is folded into per-endpoint totals shown at /admin/perf.
+#
+# The memory peak uses one process-wide tracemalloc counter, so it is only
+# exact when requests do not overlap.
+
+SLOW_REQUEST_MS = 500
+RECENT_SAMPLES = 200  # per endpoint, for percentiles
+
+slow_log = logging.getLogger('sunstyle.slow_requests')
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.render_sql_count = 0
+        self._render_depth = 0
+        self._render_started = 0.0
+
+    def as_dict(self, wall_time):
+        return {
+            'wall_ms': round(wall_time * 1000, 2),
+            'sql_count': self.sql_count,
+            'sql_ms': round(self.sql_time * 1000, 2),
+            'render_ms': round(self.render_time * 1000, 2),
+            'render_sql_count': self.render_sql_count,
+        }
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.wall_total = 0.0
+        self.wall_max = 0.0
+        self.sql_total = 0
+        self.sql_time_total = 0.0
+        self.render_total = 0.0
+        self.slow = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, profile, wall_time, slow):
+        self.requests += 1
+        self.wall_total += wall_time
+        self.wall_max = max(self.wall_max, wall_time)
+        self.sql_total += profile.sql_count
+        self.sql_time_total += profile.sql_time
+        self.render_total += profile.render_time
+        self.slow += slow
+        self.recent.append(wall_time)
+
+    def percentile(self, fraction):
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+    def summary(self, endpoint):
+        return {
+            'endpoint': endpoint,
+            'requests': self.requests,
+            'avg_ms': self.wall_total / self.requests * 1000,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p95_ms': self.percentile(0.95) * 1000,
+            'max_ms': self.wall_max * 1000,
+            'avg_sql': self.sql_total / self.requests,
+            'avg_sql_ms': self.sql_time_total / self.requests * 1000,
+            'avg_render_ms': self.render_total / self.requests * 1000,
+            'slow': self.slow,
+            'total_ms': self.wall_total * 1000,
+        }
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+def endpoint_summaries():
+    with _endpoints_lock:
+        rows = [stats.summary(endpoint) for endpoint, stats in _endpoints.items()]
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+def reset():
+    with _endpoints_lock:
+        _endpoints.clear()
+
+def _current():
+    return g.get('profile') if has_request_context() else None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info['profile_started'] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current()
+    started = conn.info.pop('profile_started', None)
+    if profile is None or started is None:
+        return
+    profile.sql_time += time.perf_counter() - started
+    profile.sql_count += 1
+    if profile._render_depth:
+        profile.render_sql_count += 1
+
+def _before_render(sender, template, context, **extra):
+    profile = _current()
+    if profile is not None:
+        if not profile._render_depth:
+            profile._render_started = time.perf_counter()
+        profile._render_depth += 1
+
+def _rendered(sender, template, context, **extra):
+    profile = _current()
+    if profile is not None and profile._render_depth:
+        profile._render_depth -= 1
+        if not profile._render_depth:
+            profile.render_time += time.perf_counter() - profile._render_started
+
+def _start():
+    g.profile = RequestProfile()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+def _finish(app, response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    wall_time = time.perf_counter() - profile.started
+    peak_kb = tracemalloc.get_traced_memory()[1] // 1024 if tracemalloc.is_tracing() else None
+    threshold = app.config.get('SLOW_REQUEST_MS', SLOW_REQUEST_MS) / 1000
+    slow = wall_time >= threshold
+    endpoint = request.endpoint or '<unmatched>'
+
+    with _endpoints_lock:
+        _endpoints.setdefault(endpoint, EndpointStats()).add(profile, wall_time, slow)
+
+    if app.debug or app.config.get('PROFILE_HEADERS'):
+        response.headers['X-SQL-Count'] = str(profile.sql_count)
+        response.headers['X-SQL-Time-ms'] = f'{profile.sql_time * 1000:.2f}'
+        response.headers['X-Render-Time-ms'] = f'{profile.render_time * 1000:.2f}'
+        response.headers['X-Render-SQL-Count'] = str(profile.render_sql_count)
+        response.headers['X-Request-Time-ms'] = f'{wall_time * 1000:.2f}'
+        if peak_kb is not None:
+            response.headers['X-Peak-Memory-KB'] = str(peak_kb)
+        response.headers['Server-Timing'] = (
+            f'sql;desc="{profile.sql_count} queries";dur={profile.sql_time * 1000:.2f}, '
+            f'render;dur={profile.render_time * 1000:.2f}, total;dur={wall_time * 1000:.2f}'
+        )
+
+    if slow:
+        entry = dict(profile.as_dict(wall_time),
+                     at=datetime.utcnow().isoformat(timespec='milliseconds'),
+                     method=request.method, path=request.full_path.rstrip('?'),
+                     endpoint=endpoint, status=response.status_code)
+        if peak_kb is not None:
+            entry['peak_kb'] = peak_kb
+        slow_log.warning(json.dumps(entry))
+    return response
+
+def _configure_slow_log(app):
+    if slow_log.handlers:
+        return
+    path = app.config.get('SLOW_REQUEST_LOG') or os.path.join(app.instance_path, 'slow_requests.log')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.WARNING)
+    slow_log.propagate = False
+
+def init_app(app, db):
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.before_request(_start)
+
+    @app.after_request
+    def record_request_profile(response):
+        return _finish(app, response)
+
+    _configure_slow_log(app)
+    if app.config.get('PROFILE_MEMORY') and not tracemalloc.is_tracing():
+        tracemalloc.start()
@@ -0,0 +1,56 @@
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+from database import (db, Product, CartItem, Order, OrderItem, Booking, BookingItem, ArchivedOrder, ArchivedOrderItem,
+                      ArchivedBooking, ArchivedBookingItem)
+
+# Loader options per page. Each view loads everything its template touches
+# up front (one JOIN for to-one, one SELECT ... IN per to-many level), so a
+# page costs a fixed number of statements however many rows it shows.
+VIEWS = {
+    'orders': (
+        selectinload(Order.order_items).joinedload(OrderItem.product),
+    ),
+    'admin_orders': (
+        joinedload(Order.user),
+        selectinload(Order.order_items).joinedload(OrderItem.product),
+    ),
+    'dashboard_orders': (
+        joinedload(Order.user),
+    ),
+    'bookings': (
+        selectinload(Booking.booking_items).joinedload(BookingItem.product),
+    ),
+    'admin_bookings': (
+        joinedload(Booking.user),
+        selectinload(Booking.booking_items).joinedload(BookingItem.product),
+    ),
+    'archived_orders': (
+        selectinload(ArchivedOrder.order_items).joinedload(ArchivedOrderItem.product),
+    ),
+    'archived_bookings': (
+        selectinload(ArchivedBooking.booking_items).joinedload(ArchivedBookingItem.product),
+    ),
+    'admin_products': (
+        joinedload(Product.category),
+    ),
+    'product_detail': (
+        joinedload(Product.category),
+    ),
+    'cart': (
+        joinedload(CartItem.product),
+    ),
+}
+
+def with_view(query, view):
+    return query.options(*VIEWS[view])
+
+def order_counts_by_user(user_ids):
+    if not user_ids:
+        return {}
+    counts = {}
+    for model in (Order, ArchivedOrder):
+        for user_id, count in db.session.query(model.user_id, func.count(model.id)).filter(
+            model.user_id.in_(user_ids)
+        ).group_by(model.user_id):
+            counts[user_id] = counts.get(user_id, 0) + count
+    return counts
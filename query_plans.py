@@ -0,0 +1,118 @@
+import re
+from contextlib import contextmanager
+from sqlalchemy import event
+from database import db, User, Product, Category
+
+# EXPLAIN QUERY PLAN regression check. Requests a fixed set of storefront
+# and admin pages through the test client, captures every SELECT they
+# issue and fails if SQLite plans any of them as a full table scan,
+# including an unbounded scan fed into a sort. Pages are requested twice
+# and only the second pass is checked, so one-off warm-up loads (facet
+# index, catalog cache) are left out.
+#
+# A plain SCAN is accepted when the statement has a LIMIT and no temp
+# B-tree sort: SQLite is then walking an index or the rowid in the
+# requested order and stops after one page.
+
+# Tables that are read whole on purpose; all of them stay tiny.
+FULL_SCAN_OK = {'category', 'store_stat', 'product_fts'}
+
+PAGES = (
+    '/',
+    '/products',
+    '/products?sort=price_asc',
+    '/products?sort=name',
+    '/products?category_id=1',
+    '/products?category_id=1&sort=price_desc',
+    '/products?price_bucket=100-150',
+    '/products?q=aviator',
+    '/products?q=aviator&sort=price_asc',
+    '/product/{product_id}',
+    '/cart',
+    '/orders',
+    '/bookings',
+    '/profile',
+    '/admin/dashboard',
+    '/admin/products',
+    '/admin/products?sort=price_desc',
+    '/admin/orders',
+    '/admin/users',
+    '/admin/bookings',
+)
+
+SCAN = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+@contextmanager
+def captured_selects():
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            statements.append((statement, parameters))
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', capture)
+
+def explain(statement, parameters):
+    with db.engine.connect() as connection:
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return [row[3] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+def problems_in(statement, plan):
+    # A sort over a bounded SEARCH (ids from the search index, one user's
+    # rows) is fine; only scans of a whole table are reported.
+    sorts = TEMP_SORT in plan
+    limited = bool(LIMIT.search(statement))
+    found = []
+    for step in plan:
+        match = SCAN.match(step)
+        if match and match.group(1) not in FULL_SCAN_OK and (sorts or not limited):
+            found.append(step + (' + ' + TEMP_SORT if sorts else ''))
+    return found
+
+def check(app):
+    admin = User.query.filter_by(is_admin=True).order_by(User.id).first()
+    if admin is None:
+        raise LookupError('check-query-plans needs an admin user to request the admin pages')
+    product = Product.query.filter_by(is_active=True).order_by(Product.id).first()
+    category = Category.query.order_by(Category.id).first()
+    paths = [path.format(product_id=product.id if product else 1) for path in PAGES]
+    if category is not None:
+        paths = [path.replace('category_id=1', f'category_id={category.id}') for path in paths]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+
+    for path in paths:
+        client.get(path)
+    failures = []
+    seen = set()
+    for path in paths:
+        with captured_selects() as statements:
+            status = client.get(path).status_code
+        if status >= 400:
+            failures.append((path, f'HTTP {status}', []))
+            continue
+        for statement, parameters in statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = explain(statement, parameters)
+            bad = problems_in(statement, plan)
+            if bad:
+                failures.append((path, statement, bad))
+    return len(seen), failures
@@ -0,0 +1,97 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+# In-memory limits for the authentication routes, checked before any
+# database read or password hash:
+#
+#   - TokenBucket per client IP bounds the request rate while allowing a
+#     short burst (a user retyping a password);
+#   - SlidingWindow per account email counts failed logins over the last
+#     `window` seconds, so guessing one account from many IPs is capped
+#     too and the lock lifts gradually as old failures age out.
+#
+# State lives in each process and is bounded by `max_keys` (least
+# recently used keys are dropped), so a flood of distinct keys cannot
+# grow it without limit.
+
+MAX_KEYS = 100000
+
+class Limited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limited; retry after {retry_after}s')
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, capacity, per_second, max_keys=MAX_KEYS):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, cost=1):
+        # Take `cost` tokens or raise Limited with the wait until they exist.
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.per_second)
+            if tokens < cost:
+                self._store(key, (tokens, now))
+                raise Limited(max(1, math.ceil((cost - tokens) / self.per_second)))
+            self._store(key, (tokens - cost, now))
+
+    def _store(self, key, value):
+        self._buckets[key] = value
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+class SlidingWindow:
+    def __init__(self, limit, window, max_keys=MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        self._events.move_to_end(key)
+        return events
+
+    def check(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is not None and len(events) >= self.limit:
+                raise Limited(max(1, math.ceil(events[0] + self.window - now)))
+
+    def add(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is None:
+                events = self._events[key] = deque(maxlen=self.limit)
+            events.append(now)
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+
+    def clear(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
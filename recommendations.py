@@ -0,0 +1,271 @@
+from itertools import chain
+import numpy as np
+from scipy import sparse
+from sqlalchemy import delete, func, select
+from database import (db, Product, OrderItem, BookingItem, ArchivedOrderItem, ArchivedBookingItem, ProductNeighbor,
+                      StoreStat)
+import http_cache
+
+# "Related products" lists, computed offline and stored in product_neighbor
+# so the detail page reads one product's list with a single range scan of
+# its primary key.
+#
+# Each order and each booking is a basket. With X the binary basket x
+# product matrix, C = X'X holds co-purchase counts and its diagonal n the
+# number of baskets per product; the co-purchase score of a pair is the
+# cosine C_ij / sqrt(n_i n_j). Candidates are every co-purchased pair plus
+# each product's nearest attribute peers (same style, brand, frame, lens,
+# most bought first), so new or rarely sold frames still get a list. A
+# candidate's score blends the co-purchase cosine with weighted attribute
+# matches and a small popularity tie-break; the top NEIGHBORS active
+# products are kept per product. Everything past the row loading is
+# vectorized numpy/scipy, so a rebuild over millions of order lines costs
+# one sequential read of order_item and booking_item.
+#
+# build() recomputes every list. refresh() only picks up order lines added
+# since the last run (a watermark in store_stat) and recomputes the lists
+# of the products they touch, reading their baskets through the
+# product_id / order_id indexes. Lines moved to the archive tables by
+# maintenance.py keep their ids and still count as baskets.
+
+NEIGHBORS = 8
+PEERS = 8  # attribute peers considered per product
+FETCH_SIZE = 50000
+WRITE_BATCH = 5000
+MAX_BASKET = 100  # larger baskets (bulk/test orders) say nothing about taste
+
+W_CO = 0.7
+W_ATTR = 0.3
+W_POPULARITY = 0.01
+ATTRIBUTES = (('style', 0.35), ('brand', 0.3), ('frame_material', 0.2), ('lens_type', 0.15))
+
+ORDER_WATERMARK = 'recs_order_item_id'
+BOOKING_WATERMARK = 'recs_booking_item_id'
+
+class _Catalog:
+    # Product attributes as arrays indexed by position in the sorted id list.
+    def __init__(self):
+        rows = db.session.query(
+            Product.id, Product.is_active, *(getattr(Product, name) for name, _ in ATTRIBUTES)
+        ).order_by(Product.id).all()
+        self.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.active = np.fromiter((bool(row[1]) for row in rows), dtype=bool, count=len(rows))
+        self.codes = []
+        for column in range(len(ATTRIBUTES)):
+            values = {}
+            codes = [values.setdefault(row[column + 2].strip().lower(), len(values))
+                     if row[column + 2] else -1 for row in rows]
+            self.codes.append(np.array(codes, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, product_ids):
+        # Positions of known ids, and the mask of ids that are known.
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, product_ids), max(len(self.ids) - 1, 0))
+        known = self.ids[positions] == product_ids if len(self.ids) else np.zeros(len(product_ids), bool)
+        return positions, known
+
+def _fetch_pairs(statement):
+    baskets = []
+    products = []
+    # Core rows on the session's connection: no ORM row processing.
+    result = db.session.connection().execute(statement.execution_options(stream_results=True))
+    for chunk in result.partitions(FETCH_SIZE):
+        array = np.fromiter(chain.from_iterable(chunk), dtype=np.int64, count=2 * len(chunk)).reshape(-1, 2)
+        baskets.append(array[:, 0])
+        products.append(array[:, 1])
+    if not baskets:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate(baskets), np.concatenate(products)
+
+def _basket_lines(order_filter=None, booking_filter=None):
+    # (basket, product) pairs from the live and archived lines; a filter is
+    # a function of the line model. Booking baskets get negative ids so
+    # they never collide with orders.
+    baskets = []
+    products = []
+    for models, parent, where, sign in (((OrderItem, ArchivedOrderItem), 'order_id', order_filter, 1),
+                                        ((BookingItem, ArchivedBookingItem), 'booking_id', booking_filter, -1)):
+        for model in models:
+            query = select(getattr(model, parent), model.product_id)
+            if where is not None:
+                query = query.where(where(model))
+            model_baskets, model_products = _fetch_pairs(query)
+            baskets.append(sign * model_baskets)
+            products.append(model_products)
+    return np.concatenate(baskets), np.concatenate(products)
+
+def _basket_matrix(catalog, baskets, products):
+    positions, known = catalog.positions(products)
+    _, basket_index = np.unique(baskets[known], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(known.sum(), dtype=np.float32), (basket_index, positions[known])),
+        shape=(basket_index.max() + 1 if len(basket_index) else 0, len(catalog))
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    sizes = np.diff(matrix.indptr)
+    if (sizes > MAX_BASKET).any():
+        matrix = matrix[sizes <= MAX_BASKET]
+    return matrix
+
+def _peer_pairs(catalog, popularity, rows):
+    # Pairs (row, peer) for the PEERS neighbours of each row in attribute
+    # order, best sellers first within equal attributes.
+    order = np.lexsort((catalog.ids, -popularity) + tuple(reversed(catalog.codes)))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    offsets = np.concatenate([np.arange(1, PEERS // 2 + 1), -np.arange(1, PEERS // 2 + 1)])
+    targets = rank[rows][:, None] + offsets[None, :]
+    sources = np.broadcast_to(rows[:, None], targets.shape)
+    inside = (targets >= 0) & (targets < len(order))
+    return sources[inside], order[targets[inside]]
+
+def _rank(catalog, rows, cols, cooccur, counts, popularity):
+    # Score candidate pairs and keep the best NEIGHBORS per row.
+    keep = (rows != cols) & catalog.active[cols]
+    rows, cols, cooccur = rows[keep], cols[keep], cooccur[keep]
+    if len(rows):
+        key = rows * len(catalog) + cols
+        order = np.lexsort((-cooccur, key))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key[order][1:] != key[order][:-1]
+        order = order[first]
+        rows, cols, cooccur = rows[order], cols[order], cooccur[order]
+
+    norm = np.sqrt(counts[rows].astype(np.float64) * counts[cols])
+    score = W_CO * np.divide(cooccur, norm, out=np.zeros(len(rows)), where=norm > 0)
+    for codes, (_, weight) in zip(catalog.codes, ATTRIBUTES):
+        score += W_ATTR * weight * ((codes[rows] == codes[cols]) & (codes[rows] >= 0))
+    score += W_POPULARITY * np.log1p(popularity[cols]) / np.log1p(max(popularity.max(initial=0), 1))
+
+    order = np.lexsort((catalog.ids[cols], -score, rows))
+    rows, cols, score = rows[order], cols[order], score[order]
+    starts = np.searchsorted(rows, rows, side='left')
+    rank = np.arange(len(rows)) - starts
+    keep = (rank < NEIGHBORS) & (score > W_POPULARITY)
+    return rows[keep], rank[keep], cols[keep], score[keep]
+
+def _write(catalog, rows, ranks, cols, scores, replace=None):
+    table = ProductNeighbor.__table__
+    if replace is None:
+        db.session.execute(delete(table))
+    else:
+        for start in range(0, len(replace), WRITE_BATCH):
+            db.session.execute(delete(table).where(
+                table.c.product_id.in_(catalog.ids[replace[start:start + WRITE_BATCH]].tolist())
+            ))
+    records = [{'product_id': product_id, 'rank': rank, 'neighbor_id': neighbor_id, 'score': round(score, 6)}
+               for product_id, rank, neighbor_id, score in zip(
+                   catalog.ids[rows].tolist(), ranks.tolist(), catalog.ids[cols].tolist(), scores.tolist())]
+    for start in range(0, len(records), WRITE_BATCH):
+        db.session.execute(table.insert(), records[start:start + WRITE_BATCH])
+    return len(records)
+
+def _watermarks():
+    return (db.session.query(func.max(OrderItem.id)).scalar() or 0,
+            db.session.query(func.max(BookingItem.id)).scalar() or 0)
+
+def _set_watermarks(order_item_id, booking_item_id):
+    for name, value in ((ORDER_WATERMARK, order_item_id), (BOOKING_WATERMARK, booking_item_id)):
+        db.session.merge(StoreStat(name=name, value=value))
+
+def _basket_counts(catalog, order_mark, booking_mark):
+    # Baskets per product, counted the way build() counts them (the
+    # diagonal of X'X): distinct baskets, lines up to the watermarks,
+    # baskets of more than MAX_BASKET products left out. Used for the
+    # cosine denominators and the popularity ordering of attribute peers.
+    counts = np.zeros(len(catalog))
+    for models, parent, mark in (((OrderItem, ArchivedOrderItem), 'order_id', order_mark),
+                                 ((BookingItem, ArchivedBookingItem), 'booking_id', booking_mark)):
+        for model in models:
+            basket = getattr(model, parent)
+            kept = select(basket).where(model.id <= mark).group_by(basket) \
+                .having(func.count(model.product_id.distinct()) <= MAX_BASKET)
+            grouped = db.session.query(model.product_id, func.count(basket.distinct())).filter(
+                model.id <= mark, basket.in_(kept)).group_by(model.product_id).all()
+            if grouped:
+                ids, values = np.array(grouped, dtype=np.int64).T
+                where, ok = catalog.positions(ids)
+                np.add.at(counts, where[ok], values[ok])
+    return counts
+
+def build():
+    # Recompute every list and replace the table in one transaction.
+    catalog = _Catalog()
+    order_mark, booking_mark = _watermarks()
+    baskets, products = _basket_lines(lambda model: model.id <= order_mark, lambda model: model.id <= booking_mark)
+    matrix = _basket_matrix(catalog, baskets, products)
+    cooccur = (matrix.T @ matrix).tocoo()
+    counts = np.zeros(len(catalog))
+    diagonal = cooccur.row == cooccur.col
+    counts[cooccur.row[diagonal]] = cooccur.data[diagonal]
+
+    everything = np.arange(len(catalog))
+    peer_rows, peer_cols = _peer_pairs(catalog, counts, everything)
+    rows = np.concatenate([cooccur.row.astype(np.int64), peer_rows])
+    cols = np.concatenate([cooccur.col.astype(np.int64), peer_cols])
+    values = np.concatenate([cooccur.data.astype(np.float64), np.zeros(len(peer_rows))])
+    written = _write(catalog, *_rank(catalog, rows, cols, values, counts, counts))
+    _set_watermarks(order_mark, booking_mark)
+    http_cache.catalog_changed()  # cached detail pages show the old lists
+    db.session.commit()
+    return {'products': len(catalog), 'baskets': matrix.shape[0], 'pairs': int((~diagonal).sum()),
+            'neighbors': written}
+
+def refresh():
+    # Recompute the lists of products bought since the last run.
+    marks = dict(db.session.query(StoreStat.name, StoreStat.value).filter(
+        StoreStat.name.in_((ORDER_WATERMARK, BOOKING_WATERMARK))).all())
+    if len(marks) < 2:
+        return build()
+    order_mark, booking_mark = _watermarks()
+    touched = {product_id for product_id, in db.session.query(OrderItem.product_id).filter(
+        OrderItem.id > marks[ORDER_WATERMARK], OrderItem.id <= order_mark).distinct()}
+    touched |= {product_id for product_id, in db.session.query(BookingItem.product_id).filter(
+        BookingItem.id > marks[BOOKING_WATERMARK], BookingItem.id <= booking_mark).distinct()}
+    if not touched:
+        return {'products': 0, 'baskets': 0, 'pairs': 0, 'neighbors': 0}
+
+    catalog = _Catalog()
+    positions, known = catalog.positions(sorted(touched))
+    rows_wanted = positions[known]
+    touched = catalog.ids[rows_wanted].tolist()
+    baskets, products = _basket_lines(
+        lambda model: model.order_id.in_(select(model.order_id).where(model.product_id.in_(touched))
+                                         .where(model.id <= order_mark).correlate(None)) & (model.id <= order_mark),
+        lambda model: model.booking_id.in_(select(model.booking_id).where(model.product_id.in_(touched))
+                                           .where(model.id <= booking_mark).correlate(None)) & (model.id <= booking_mark),
+    )
+    matrix = _basket_matrix(catalog, baskets, products)
+    cooccur = (matrix[:, rows_wanted].T @ matrix).tocoo()
+    rows = rows_wanted[cooccur.row]
+    cols = cooccur.col.astype(np.int64)
+
+    counts = _basket_counts(catalog, order_mark, booking_mark)
+
+    peer_rows, peer_cols = _peer_pairs(catalog, counts, rows_wanted)
+    ranked = _rank(catalog, np.concatenate([rows, peer_rows]), np.concatenate([cols, peer_cols]),
+                   np.concatenate([cooccur.data.astype(np.float64), np.zeros(len(peer_rows))]),
+                   counts, counts)
+    written = _write(catalog, *ranked, replace=rows_wanted)
+    _set_watermarks(order_mark, booking_mark)
+    http_cache.catalog_changed()  # cached detail pages show the old lists
+    db.session.commit()
+    return {'products': len(rows_wanted), 'baskets': matrix.shape[0], 'pairs': len(rows), 'neighbors': written}
+
+def related_products(product, limit=4):
+    related = Product.query.join(ProductNeighbor, ProductNeighbor.neighbor_id == Product.id).filter(
+        ProductNeighbor.product_id == product.id,
+        Product.is_active == True
+    ).order_by(ProductNeighbor.rank).limit(limit).all()
+    if related:
+        return related
+    # Not built yet (or a brand-new product): same-category products.
+    return Product.query.filter(
+        Product.category_id == product.category_id,
+        Product.id != product.id,
+        Product.is_active == True
+    ).limit(limit).all()
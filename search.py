@@ -0,0 +1,78 @@
+import re
+from sqlalchemy import text
+from database import db
+
+SEARCH_LIMIT = 500
+MAX_TERMS = 8
+
+# Indexed product columns and their bm25 weights, in FTS column order.
+FIELDS = (
+    ('name', 10.0),
+    ('brand', 6.0),
+    ('style', 4.0),
+    ('color', 2.0),
+    ('frame_material', 2.0),
+    ('lens_type', 2.0),
+    ('description', 1.0),
+)
+
+_columns = ', '.join(name for name, _ in FIELDS)
+_new = ', '.join('new.' + name for name, _ in FIELDS)
+_old = ', '.join('old.' + name for name, _ in FIELDS)
+
+# Only changes to indexed columns touch the index, so stock and price
+# updates (checkout, bulk stock feeds) skip it.
+UPDATE_TRIGGER = f"""CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF {_columns} ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old});
+        INSERT INTO product_fts(rowid, {_columns}) VALUES (new.id, {_new});
+    END"""
+
+# External-content FTS5 table over `product`. The triggers keep it in step
+# with every write to the product table, whichever route makes it.
+DDL = [
+    f"""CREATE VIRTUAL TABLE product_fts USING fts5(
+        {_columns},
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, {_columns}) VALUES (new.id, {_new});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old});
+    END""",
+    UPDATE_TRIGGER,
+    "INSERT INTO product_fts(product_fts, rank) VALUES ('rank', 'bm25(%s)')"
+    % ', '.join(str(weight) for _, weight in FIELDS),
+    "INSERT INTO product_fts(product_fts) VALUES ('rebuild')",
+]
+
+def create_search_index():
+    exists = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+    )).first()
+    if exists:
+        return False
+    for statement in DDL:
+        db.session.execute(text(statement))
+    db.session.commit()
+    return True
+
+def rebuild_search_index():
+    db.session.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+def to_match_query(q):
+    # Every term must match, each as a prefix ("avi" finds "Aviator").
+    # Terms are quoted so user input can never inject FTS operators.
+    terms = re.findall(r'\w+', (q or '').lower())[:MAX_TERMS]
+    return ' '.join('"%s"*' % term for term in terms) or None
+
+def search_product_ids(q, limit=SEARCH_LIMIT):
+    match = to_match_query(q)
+    if match is None:
+        return []
+    rows = db.session.execute(text(
+        "SELECT rowid FROM product_fts WHERE product_fts MATCH :match ORDER BY rank LIMIT :limit"
+    ).columns(), {'match': match, 'limit': limit})
+    return [row[0] for row in rows]
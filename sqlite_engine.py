@@ -0,0 +1,89 @@
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.sql.selectable import Select, TextualSelect
+from flask_sqlalchemy.session import Session
+
+# SQLite engine setup for concurrent use.
+#
+# Every connection runs in WAL mode with synchronous=NORMAL, so readers
+# never block behind a writer and commits are not fsynced individually;
+# busy_timeout makes a second writer wait for the lock instead of failing
+# with "database is locked". SELECTs (including text(...).columns()) go to
+# a separate `read` engine whose connections are query_only; everything
+# else, and every statement after the first write in a transaction (so a
+# transaction reads its own writes), goes to the default engine.
+#
+# SQLITE_TUNING=0 turns all of this off, for comparing against the stock
+# configuration.
+
+READ_BIND = 'read'
+
+PRAGMAS = {
+    # Only takes effect on a new file, or at the next full VACUUM (see
+    # maintenance.py); has to come before journal_mode.
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,           # ms
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'cache_size': -16000,           # KiB, per connection
+    'temp_store': 'MEMORY',
+}
+
+WRITE_POOL = {'pool_size': 4, 'max_overflow': 4, 'pool_timeout': 30}
+READ_POOL = {'pool_size': 8, 'max_overflow': 8, 'pool_timeout': 30}
+
+def enabled(app):
+    return app.config.get('SQLITE_TUNING', os.environ.get('SQLITE_TUNING', '1')) not in ('0', 0, False)
+
+def configure(app):
+    # Must run before db.init_app(), which creates the engines.
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not uri.startswith('sqlite') or not enabled(app) or ':memory:' in uri:
+        return
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dict(WRITE_POOL))
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    binds.setdefault(READ_BIND, dict(READ_POOL, url=uri))
+
+def _apply_pragmas(read_only):
+    def on_connect(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=1')
+        cursor.close()
+    return on_connect
+
+def install(app, db):
+    # Must run after db.init_app().
+    if not enabled(app):
+        return
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _apply_pragmas(key == READ_BIND))
+
+def dispose_engines(app, db):
+    # For a forked worker: drop pooled connections inherited from the parent
+    # without closing them underneath it.
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not self.info.get('wrote'):
+            reader = self._db.engines.get(READ_BIND)
+            if reader is not None and isinstance(clause, (Select, TextualSelect)):
+                return reader
+        self.info['wrote'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _reset_routing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
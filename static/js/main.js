@@ -85,46 +85,104 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 // AJAX functions
-function addToCart(productId, quantity = 1) {
-    fetch(`/add_to_cart/${productId}`, {
+// Cart changes made in quick succession are queued and sent to /api/cart
+// as one batch; the response carries only the touched lines and totals.
+const cartQueue = { operations: [], waiting: [], timer: null };
+const CART_BATCH_DELAY = 150;
+
+function queueCartOperation(operation) {
+    return new Promise((resolve, reject) => {
+        cartQueue.operations.push(operation);
+        cartQueue.waiting.push({ resolve, reject });
+        clearTimeout(cartQueue.timer);
+        cartQueue.timer = setTimeout(flushCartQueue, CART_BATCH_DELAY);
+    });
+}
+
+function flushCartQueue() {
+    const operations = cartQueue.operations.splice(0);
+    const waiting = cartQueue.waiting.splice(0);
+    fetch('/api/cart', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ quantity: quantity })
+        body: JSON.stringify({ operations: operations })
     })
     .then(response => response.json())
     .then(data => {
-        if (data.success) {
-            // Update cart count
-            const cartCount = document.querySelector('.cart-count');
-            if (cartCount) {
-                cartCount.textContent = data.cart_count;
-            }
-            // Show success message
-            showNotification('Product added to cart!', 'success');
+        if (data.cart) {
+            updateCartDisplay(data);
         }
+        (data.errors || []).forEach(error => showNotification(error.error, 'danger'));
+        if (data.error) {
+            showNotification(data.error, 'danger');
+        }
+        waiting.forEach(callback => callback.resolve(data));
     })
     .catch(error => {
         console.error('Error:', error);
-        showNotification('Error adding product to cart', 'error');
+        showNotification('Error updating cart', 'danger');
+        waiting.forEach(callback => callback.reject(error));
     });
 }
 
-function updateCartItem(cartItemId, quantity) {
-    fetch(`/update_cart/${cartItemId}`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ quantity: quantity })
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            location.reload(); // Reload to update totals
+function formatPrice(value) {
+    return '\u20b9' + Number(value).toFixed(2);
+}
+
+function updateCartDisplay(data) {
+    document.querySelectorAll('.cart-count').forEach(badge => {
+        badge.textContent = data.cart.count;
+    });
+    (data.lines || []).forEach(line => {
+        const row = document.querySelector(`[data-cart-line="${line.product_id}"]`);
+        if (!row) {
+            return;
+        }
+        if (line.quantity === 0) {
+            row.remove();
+            return;
+        }
+        const input = row.querySelector('input[name="quantity"]');
+        if (input) {
+            input.value = line.quantity;
+            input.max = line.max_quantity;
+        }
+        const lineMax = row.querySelector('.line-max');
+        if (lineMax) {
+            lineMax.textContent = line.max_quantity;
         }
+        const lineTotal = row.querySelector('.line-total');
+        if (lineTotal) {
+            lineTotal.textContent = formatPrice(line.line_total);
+        }
+    });
+    document.querySelectorAll('[data-cart-total]').forEach(element => {
+        const key = element.dataset.cartTotal;
+        element.textContent = key === 'count' ? data.cart.count : formatPrice(data.cart[key]);
     });
+    if (data.cart.count === 0 && document.querySelector('[data-cart-line]') === null
+            && document.querySelector('[data-cart-total]')) {
+        location.reload(); // show the empty-cart page
+    }
+}
+
+function addToCart(productId, quantity = 1) {
+    queueCartOperation({ op: 'add', product_id: productId, quantity: quantity })
+        .then(data => {
+            if (data.success) {
+                showNotification('Product added to cart!', 'success');
+            }
+        });
+}
+
+function updateCartItem(productId, quantity) {
+    return queueCartOperation({ op: 'set', product_id: productId, quantity: quantity });
+}
+
+function removeCartItem(productId) {
+    return queueCartOperation({ op: 'remove', product_id: productId });
 }
 
 function showNotification(message, type = 'info') {
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, union_all
+from sqlalchemy.dialects.sqlite import insert
+from database import db, User, Product, Order, Booking, ArchivedOrder, ArchivedBooking, StoreStat, DailySales
+
+COUNTERS = ('users', 'products', 'orders', 'bookings', 'revenue')
+LOW_STOCK_THRESHOLD = 5
+LOW_STOCK_LIMIT = 20
+
+# Dashboard statistics are kept as running counters instead of being
+# recounted per page view. Every helper here only adds statements to the
+# caller's transaction, so a counter moves exactly when the row it counts
+# is committed. `flask rebuild-stats` recomputes everything from the base
+# tables if they ever drift; orders and bookings moved to the archive
+# tables by maintenance.py still count.
+
+def increment(name, amount=1):
+    db.session.execute(
+        insert(StoreStat).values(name=name, value=amount)
+        .on_conflict_do_update(index_elements=[StoreStat.name],
+                               set_={'value': StoreStat.value + amount})
+    )
+
+def record_order(total_amount, when=None):
+    day = (when or datetime.utcnow()).date()
+    increment('orders')
+    increment('revenue', total_amount)
+    db.session.execute(
+        insert(DailySales).values(day=day, orders=1, revenue=total_amount)
+        .on_conflict_do_update(index_elements=[DailySales.day], set_={
+            'orders': DailySales.orders + 1,
+            'revenue': DailySales.revenue + total_amount,
+        })
+    )
+
+def counters():
+    values = dict.fromkeys(COUNTERS, 0)
+    values.update(db.session.query(StoreStat.name, StoreStat.value).all())
+    return values
+
+def daily_sales(days=7):
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    return DailySales.query.filter(DailySales.day >= since).order_by(DailySales.day.desc()).all()
+
+def low_stock_products(threshold=LOW_STOCK_THRESHOLD, limit=LOW_STOCK_LIMIT):
+    return Product.query.filter(Product.stock_quantity <= threshold).order_by(
+        Product.stock_quantity
+    ).limit(limit).all()
+
+def rebuild():
+    orders = union_all(
+        select(Order.created_at, Order.total_amount),
+        select(ArchivedOrder.created_at, ArchivedOrder.total_amount),
+    ).subquery()
+    totals = {
+        'users': User.query.count(),
+        'products': Product.query.count(),
+        'orders': Order.query.count() + ArchivedOrder.query.count(),
+        'bookings': Booking.query.count() + ArchivedBooking.query.count(),
+        'revenue': db.session.query(func.coalesce(func.sum(orders.c.total_amount), 0)).scalar(),
+    }
+    per_day = db.session.query(
+        func.date(orders.c.created_at), func.count(), func.sum(orders.c.total_amount)
+    ).group_by(func.date(orders.c.created_at)).all()
+
+    # Only the counters are recomputed; other rows (the catalog version in
+    # http_cache.py) must survive a rebuild.
+    StoreStat.query.filter(StoreStat.name.in_(COUNTERS)).delete(synchronize_session=False)
+    DailySales.query.delete()
+    db.session.add_all(StoreStat(name=name, value=value) for name, value in totals.items())
+    db.session.add_all(
+        DailySales(day=datetime.strptime(day, '%Y-%m-%d').date(), orders=orders, revenue=revenue)
+        for day, orders, revenue in per_day if day is not None
+    )
+    db.session.commit()
+    return totals
+
+def ensure_initialized():
+    if StoreStat.query.first() is None:
+        rebuild()
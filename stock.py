@@ -0,0 +1,113 @@
+import random
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from sqlalchemy import case, update
+from sqlalchemy.exc import OperationalError
+from database import db, Product, Booking, BookingItem
+import http_cache
+
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05  # seconds, doubled on every retry
+
+# A reserved booking holds its stock until this long after the pickup date.
+BOOKING_RESERVATION_TTL = timedelta(days=1)
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock for products {product_ids}')
+        self.product_ids = product_ids
+
+def is_busy_error(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def retry_on_busy(func):
+    # Re-run a whole unit of work when SQLite reports a lock conflict. The
+    # wrapped function must be safe to repeat from scratch, i.e. it builds
+    # and commits its own transaction.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                db.session.rollback()
+                if not is_busy_error(error) or attempt == BUSY_RETRIES - 1:
+                    raise
+                time.sleep(BUSY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+    return wrapper
+
+def _merge(quantities):
+    merged = {}
+    for product_id, quantity in quantities:
+        merged[product_id] = merged.get(product_id, 0) + quantity
+    return merged
+
+def reserve_stock(quantities):
+    # Decrement stock for every (product_id, quantity) pair in one
+    # conditional UPDATE. Rows whose stock would go negative are not
+    # touched, so a short rowcount means at least one product is short and
+    # the caller must roll the transaction back.
+    wanted = _merge(quantities)
+    if not wanted:
+        return
+    if any(quantity < 1 for quantity in wanted.values()):
+        raise ValueError('Quantities must be positive')
+    amount = case(wanted, value=Product.id)
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(wanted), Product.stock_quantity >= amount)
+        .values(stock_quantity=Product.stock_quantity - amount)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(wanted):
+        rows = db.session.query(Product.id, Product.stock_quantity).filter(Product.id.in_(wanted)).all()
+        stock = dict(rows)
+        raise OutOfStock(sorted(
+            product_id for product_id, quantity in wanted.items()
+            if stock.get(product_id, 0) < quantity
+        ))
+    http_cache.catalog_changed()
+
+def release_stock(quantities):
+    returned = _merge(quantities)
+    if not returned:
+        return
+    amount = case(returned, value=Product.id)
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(returned))
+        .values(stock_quantity=Product.stock_quantity + amount)
+        .execution_options(synchronize_session=False)
+    )
+    http_cache.catalog_changed()
+
+@retry_on_busy
+def release_expired_bookings(now=None):
+    cutoff = (now or datetime.utcnow()) - BOOKING_RESERVATION_TTL
+    candidates = db.session.query(Booking.id).filter(
+        Booking.status == 'reserved',
+        Booking.pickup_date < cutoff
+    ).all()
+
+    released = []
+    for (booking_id,) in candidates:
+        # The status flip is the claim: if another worker expired this
+        # booking first, the rowcount is 0 and its stock is left alone.
+        claimed = db.session.execute(
+            update(Booking)
+            .where(Booking.id == booking_id, Booking.status == 'reserved')
+            .values(status='expired', updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            continue
+        items = db.session.query(BookingItem.product_id, BookingItem.quantity).filter_by(
+            booking_id=booking_id
+        ).all()
+        release_stock(items)
+        released.append(booking_id)
+
+    db.session.commit()
+    return released
@@ -0,0 +1,54 @@
+import json
+from datetime import timedelta
+from flask import current_app, render_template
+from database import db, Order
+from queries import with_view
+from jobs import job
+import http_cache
+import images
+import mail
+import maintenance
+import stock
+
+# Handlers for the background job queue. Each one receives the keyword
+# payload given to jobs.enqueue() and must be safe to run again after a
+# failure part-way through.
+
+@job('order_confirmation', concurrency=4)
+def send_order_confirmation(order_id):
+    order = with_view(Order.query, 'admin_orders').filter_by(id=order_id).first()
+    if order is None:
+        return
+    html = render_template('email_templates/order_confirmation.html', order=order)
+    mail.send_mail(order.user.email, f'Your SunStyle order #{order.order_number}', html,
+                   text=f'Thank you for your order #{order.order_number}. '
+                        f'Total: ₹{order.total_amount:.2f}')
+
+@job('newsletter_welcome', concurrency=4)
+def send_newsletter_welcome(email):
+    html = render_template('email_templates/newsletter_welcome.html', email=email)
+    mail.send_mail(email, 'Welcome to the SunStyle newsletter', html,
+                   text='Thanks for subscribing to SunStyle updates and offers.')
+
+@job('image_variants')
+def build_image_variants(filename):
+    if images.build_variants(current_app.config['UPLOAD_FOLDER'], filename) is not None:
+        # Pages and cards rendered meanwhile link the full-size upload.
+        http_cache.catalog_changed()
+        db.session.commit()
+
+# Archiving a large backlog and vacuuming can outlast the default lease.
+@job('maintenance', timeout=timedelta(hours=3))
+def run_maintenance():
+    maintenance.schedule()  # the next night's pass
+    db.session.commit()
+    report = maintenance.run()
+    current_app.logger.info('Maintenance pass: %s', json.dumps(report))
+
+@job('booking_sweep')
+def sweep_expired_bookings():
+    maintenance.schedule_booking_sweep()  # the next sweep
+    db.session.commit()
+    released = stock.release_expired_bookings()
+    if released:
+        current_app.logger.info('Released %d expired booking(s)', len(released))
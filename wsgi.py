@@ -0,0 +1,23 @@
+import os
+
+# Production entry point:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:application
+#
+# Settings come from the environment: SECRET_KEY, DATABASE_URL,
+# JOB_WORKERS, SQLITE_TUNING, PROXY_HOPS (set to the number of reverse
+# proxies in front of gunicorn) and the MAIL_* variables (see mail.py).
+
+def create_app():
+    from app import app, init_db
+    import fragments
+    app.config['DEBUG'] = False
+    if os.environ.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+    if os.environ.get('INIT_DB', '1') != '0':
+        init_db()
+    # Compile templates once in the (preloading) master; workers inherit them.
+    fragments.compile_templates(app)
+    return app
+
+application = create_app()